@@ -0,0 +1,102 @@
+"""Benchmark de l'ingestion Milvus : chemin incrémental face au chargement en masse
+
+Usage:
+    python bench_ingestion.py [--rows 50000] [--dim 1024] [--runs 1]
+
+Nécessite un Milvus démarré (Config.MILVUS_HOST/PORT). Les embeddings sont synthétiques
+(aléatoires, normalisés) : seul le coût d'ingestion est mesuré, pas celui de l'API d'embedding.
+
+- incrémental (chemin historique) : collection créée avec l'index IVF_FLAT, insertion par
+  lots de 1000 dicts (une ligne = un dict Python), puis chargement ;
+- masse : collection sans index, insertion en colonnes par lots de BULK_BATCH_SIZE,
+  un seul flush, construction de l'index puis chargement.
+
+Le temps est mesuré jusqu'à une collection chargée et interrogeable, puis vérifié par une
+recherche. Les collections de benchmark sont supprimées à la fin.
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from themes import THEME_NAMES
+from milvus_client import (create_collection, insert_embeddings, bulk_insert_embeddings,
+                           get_milvus_client, search_similar)
+
+
+def make_dataset(rows: int, dim: int, seed: int = 42):
+    """Chunks, embeddings normalisés, doc_id (50 documents) et thèmes synthétiques"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((rows, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = [f"Chunk {i} : caravane, astrolabe et manuscrits de Bagdad. " * 8 for i in range(rows)]
+    doc_ids = [i % 50 for i in range(rows)]
+    themes = [THEME_NAMES[i % len(THEME_NAMES)] for i in range(rows)]
+    return texts, vectors, doc_ids, themes
+
+
+def run_incremental(name: str, texts, vectors, doc_ids, themes, dim: int) -> float:
+    started = time.perf_counter()
+    create_collection(name, dim=dim)
+    # Chemin historique : listes Python de floats, un dict par ligne
+    insert_embeddings(name, list(range(len(texts))), texts, vectors.tolist(), doc_ids, themes)
+    get_milvus_client().load_collection(collection_name=name)
+    return time.perf_counter() - started
+
+
+def run_bulk(name: str, texts, vectors, doc_ids, themes, dim: int) -> float:
+    started = time.perf_counter()
+    create_collection(name, dim=dim, build_index=False)
+    bulk_insert_embeddings(name, texts, vectors, doc_ids, themes)
+    return time.perf_counter() - started
+
+
+def check_searchable(name: str, vector, rows: int):
+    client = get_milvus_client()
+    client.flush(collection_name=name)
+    count = int(client.get_collection_stats(name).get('row_count', 0))
+    hits = search_similar(name, vector, limit=1)
+    assert count == rows, f"{name}: {count} lignes pour {rows}"
+    assert hits, f"{name}: aucune réponse à la recherche"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--runs', type=int, default=1)
+    args = parser.parse_args()
+
+    texts, vectors, doc_ids, themes = make_dataset(args.rows, args.dim)
+    print(f"{args.rows} chunks synthétiques, dimension {args.dim}, {args.runs} exécution(s)\n")
+
+    paths = (('incremental', run_incremental), ('masse', run_bulk))
+    timings = {label: [] for label, _ in paths}
+    client = get_milvus_client()
+    try:
+        for run in range(args.runs):
+            for label, func in paths:
+                name = f"bench_ingestion_{label}"
+                # Journal d'insertion lot par lot masqué : seules les durées sont affichées
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed = func(name, texts, vectors, doc_ids, themes, args.dim)
+                check_searchable(name, vectors[0], args.rows)
+                timings[label].append(elapsed)
+                print(f"Exécution {run + 1} - {label:<11}: {elapsed:7.2f}s ({args.rows / elapsed:,.0f} lignes/s)")
+    finally:
+        for label, _ in paths:
+            name = f"bench_ingestion_{label}"
+            if client.has_collection(name):
+                client.drop_collection(name)
+
+    incremental = min(timings['incremental'])
+    bulk = min(timings['masse'])
+    print(f"\nMeilleur temps incrémental : {incremental:.2f}s")
+    print(f"Meilleur temps en masse    : {bulk:.2f}s")
+    print(f"Gain : {incremental - bulk:.2f}s ({incremental / bulk:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,21 @@
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_mistralai import MistralAIEmbeddings
 from config import Config
+from vectors import validate_vectors
+
+
+class Float32MistralEmbeddings(MistralAIEmbeddings):
+    """Embeddings Mistral convertis une seule fois en matrice float32 validée (n, 1024)"""
+
+    def embed_documents(self, texts):
+        return validate_vectors(super().embed_documents(texts))
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
 
 
 def get_embedding_model():
-    return MistralAIEmbeddings(
+    return Float32MistralEmbeddings(
         model=Config.EMBEDDING_MODEL,
         mistral_api_key=Config.MISTRAL_API_KEY
     )
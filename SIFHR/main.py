@@ -1,18 +1,23 @@
 from chunking_embedding import get_embedding_model, chunk_document
+from themes import chunk_themes
 from minio_client import list_documents, read_document
-from milvus_client import create_collection, insert_embeddings
+from milvus_client import create_collection, insert_embeddings, bulk_insert_embeddings
+from document_catalog import document_catalog
 from multi_query_retriever import get_multi_query_retriever, create_vectorstore_retriever, get_llm
+import sys
 import time
+import numpy as np
 
 
-def main():
+def main(bulk=True):
     # Initialisation des modèles
     embedding_model = get_embedding_model()
     llm = get_llm()
     
     # Création de la collection Milvus
+    # Chargement en masse : l'index est construit après l'insertion (voir bench_ingestion.py)
     collection_name = "data_sifhr"
-    create_collection(collection_name, dim=1024)
+    create_collection(collection_name, dim=1024, build_index=not bulk)
     
     # Récupération et traitement des documents depuis MinIO
     documents = list_documents()
@@ -23,7 +28,10 @@ def main():
         return None
         
     all_chunks = []
-    all_metadatas = []
+    # Un doc_id entier par chunk ; les métadonnées sont enregistrées une fois par document
+    all_doc_ids = []
+    # Thème de chaque chunk (clé de partition)
+    all_themes = []
     
     for doc_name in documents:
         try:
@@ -41,13 +49,17 @@ def main():
         from config import Config
         minio_path = f"minio://{Config.MINIO_ENDPOINT}/{Config.MINIO_BUCKET_NAME}/{doc_name}"
         
-        all_chunks.extend(chunks)
-        all_metadatas.extend([{
+        doc_id, = document_catalog.register([{
             "source": doc_name,
             "minio_path": minio_path,
             "bucket": Config.MINIO_BUCKET_NAME,
             "endpoint": Config.MINIO_ENDPOINT
-        }] * len(chunks))
+        }])
+        all_chunks.extend(chunks)
+        all_doc_ids.extend([doc_id] * len(chunks))
+        themes = chunk_themes(chunks, content)
+        all_themes.extend(themes)
+        print(f"  Thèmes: {dict((theme, themes.count(theme)) for theme in sorted(set(themes)))}")
     
     # Génération des embeddings et insertion dans Milvus par lots
     if all_chunks:
@@ -55,6 +67,7 @@ def main():
         
         # Traiter par lots maximaux pour être le plus efficace possible
         batch_size = 100  # Lot très grand pour maximiser la vitesse
+        # Matrices float32 par lot, concaténées une seule fois avant l'insertion
         all_embeddings = []
         total_batches = (len(all_chunks) + batch_size - 1) // batch_size
         start_time = time.time()
@@ -77,7 +90,7 @@ def main():
                 batch_start = time.time()
                 batch_embeddings = embedding_model.embed_documents(batch_chunks)
                 batch_time = time.time() - batch_start
-                all_embeddings.extend(batch_embeddings)
+                all_embeddings.append(batch_embeddings)
                 print(f"  ✓ Lot traité en {batch_time:.1f}s")
                 
                 # Pas de pause pour vitesse maximale (commentez si vous avez des erreurs 429)
@@ -91,7 +104,7 @@ def main():
                 # Réessayer le lot
                 try:
                     batch_embeddings = embedding_model.embed_documents(batch_chunks)
-                    all_embeddings.extend(batch_embeddings)
+                    all_embeddings.append(batch_embeddings)
                 except Exception as e2:
                     print(f"Échec définitif du lot: {e2}")
                     return None
@@ -99,9 +112,14 @@ def main():
         total_time = time.time() - start_time
         print(f"\nTemps total pour les embeddings: {total_time:.1f}s")
         
+        all_embeddings = np.concatenate(all_embeddings) if all_embeddings else np.empty((0, 1024), dtype=np.float32)
+        
         if len(all_embeddings) == len(all_chunks):
-            ids = list(range(len(all_chunks)))
-            insert_embeddings(collection_name, ids, all_chunks, all_embeddings, all_metadatas)
+            if bulk:
+                bulk_insert_embeddings(collection_name, all_chunks, all_embeddings, all_doc_ids, all_themes)
+            else:
+                ids = list(range(len(all_chunks)))
+                insert_embeddings(collection_name, ids, all_chunks, all_embeddings, all_doc_ids, all_themes)
             print("Embeddings insérés avec succès!")
         else:
             print("Erreur: nombre d'embeddings ne correspond pas au nombre de chunks")
@@ -117,5 +135,6 @@ def main():
 
 
 if __name__ == "__main__":
-    multi_retriever = main()
+    # --incremental : ancien chemin (index créé d'abord, insertion ligne par ligne)
+    multi_retriever = main(bulk="--incremental" not in sys.argv)
     print("RAG system initialisé avec succès!")
\ No newline at end of file
@@ -1,5 +1,11 @@
-from pymilvus import MilvusClient, DataType
+from pymilvus import MilvusClient, DataType, Collection, connections
 from config import Config
+from vectors import as_search_vectors, validate_vectors
+
+# Champs scalaires de la collection, dans l'ordre du schéma (chargement en colonnes)
+SCALAR_FIELDS = ["text", "doc_id", "theme"]
+# Lignes par lot en chargement en colonnes (un lot reste sous la limite de message gRPC de 64 Mo)
+BULK_BATCH_SIZE = 5000
 
 
 def get_milvus_client():
@@ -8,41 +14,66 @@ def get_milvus_client():
     )
 
 
-def create_collection(collection_name, dim=1024):
+def get_orm_collection(collection_name):
+    # L'API ORM accepte l'insertion en colonnes (MilvusClient.insert n'accepte que des lignes)
+    connections.connect(alias="sifhr_bulk", uri=f"http://{Config.MILVUS_HOST}:{Config.MILVUS_PORT}")
+    return Collection(collection_name, using="sifhr_bulk")
+
+
+def vector_index_params(client):
+    index_params = client.prepare_index_params()
+    index_params.add_index(
+        field_name="vector",
+        index_type="IVF_FLAT",
+        metric_type="COSINE",
+        params={"nlist": 1024}
+    )
+    # Index scalaires pour les filtres de recherche (thème, document)
+    index_params.add_index(field_name="theme", index_type="INVERTED")
+    index_params.add_index(field_name="doc_id", index_type="INVERTED")
+    return index_params
+
+
+def create_collection(collection_name, dim=1024, build_index=True):
+    """Recréer la collection ; build_index=False pour un chargement en masse (index construit après)"""
     client = get_milvus_client()
     
     if client.has_collection(collection_name):
         client.drop_collection(collection_name)
     
+    # Même schéma quel que soit le mode de chargement (build_index ne diffère que l'index)
     schema = client.create_schema(auto_id=True, enable_dynamic_field=True)
     
     schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
     schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=dim)
     schema.add_field(field_name="text", datatype=DataType.VARCHAR, max_length=65535)
-    schema.add_field(field_name="source", datatype=DataType.VARCHAR, max_length=1024)
-    schema.add_field(field_name="minio_path", datatype=DataType.VARCHAR, max_length=2048)
-    schema.add_field(field_name="bucket", datatype=DataType.VARCHAR, max_length=256)
-    schema.add_field(field_name="endpoint", datatype=DataType.VARCHAR, max_length=256)
+    # Source, chemin MinIO, bucket et endpoint : une ligne par document dans le catalogue
+    # (document_catalog.py), les chunks ne portent que l'identifiant du document
+    schema.add_field(field_name="doc_id", datatype=DataType.INT64)
+    # Époque ou lieu du chunk (themes.py) : clé de partition, un filtre sur le thème ne
+    # parcourt que les partitions concernées
+    schema.add_field(field_name="theme", datatype=DataType.VARCHAR, max_length=64, is_partition_key=True)
     
-    index_params = client.prepare_index_params()
-    index_params.add_index(
-        field_name="vector",
-        index_type="IVF_FLAT",
-        metric_type="COSINE",
-        params={"nlist": 1024}
-    )
-    
-    client.create_collection(
-        collection_name=collection_name,
-        schema=schema,
-        index_params=index_params
-    )
+    if build_index:
+        client.create_collection(
+            collection_name=collection_name,
+            schema=schema,
+            index_params=vector_index_params(client)
+        )
+    else:
+        # Sans index la collection n'est pas chargée : pas d'indexation des segments pendant l'insertion
+        client.create_collection(
+            collection_name=collection_name,
+            schema=schema
+        )
     
     print(f"Collection {collection_name} créée avec succès.")
 
 
-def insert_embeddings(collection_name, ids, texts, embeddings, metadatas):
+def insert_embeddings(collection_name, ids, texts, embeddings, doc_ids, themes):
     client = get_milvus_client()
+    # Matrice float32 : chaque ligne est un tableau passé tel quel à pymilvus
+    embeddings = validate_vectors(embeddings)
     
     # Insérer par petits lots pour éviter la limite de taille de message
     batch_size = 1000  # Lot raisonnable pour Milvus
@@ -51,17 +82,16 @@ def insert_embeddings(collection_name, ids, texts, embeddings, metadatas):
     for i in range(0, len(texts), batch_size):
         batch_texts = texts[i:i+batch_size]
         batch_embeddings = embeddings[i:i+batch_size]
-        batch_metadatas = metadatas[i:i+batch_size]
+        batch_doc_ids = doc_ids[i:i+batch_size]
+        batch_themes = themes[i:i+batch_size]
         
         data = []
-        for text, embedding, metadata in zip(batch_texts, batch_embeddings, batch_metadatas):
+        for text, embedding, doc_id, theme in zip(batch_texts, batch_embeddings, batch_doc_ids, batch_themes):
             data.append({
                 "vector": embedding,
                 "text": text,
-                "source": metadata.get("source", ""),
-                "minio_path": metadata.get("minio_path", ""),
-                "bucket": metadata.get("bucket", ""),
-                "endpoint": metadata.get("endpoint", "")
+                "doc_id": doc_id,
+                "theme": theme
             })
         
         client.insert(collection_name=collection_name, data=data)
@@ -71,15 +101,42 @@ def insert_embeddings(collection_name, ids, texts, embeddings, metadatas):
     print(f"✓ Tous les {total_inserted} embeddings insérés dans {collection_name}")
 
 
+def bulk_insert_embeddings(collection_name, texts, embeddings, doc_ids, themes, batch_size=BULK_BATCH_SIZE):
+    """Chargement en masse : lots en colonnes, un seul flush, puis construction de l'index et chargement
+
+    La collection doit avoir été créée avec create_collection(..., build_index=False).
+    """
+    collection = get_orm_collection(collection_name)
+    vectors = validate_vectors(embeddings)
+    columns = {"text": list(texts), "doc_id": list(doc_ids), "theme": list(themes)}
+    total_inserted = 0
+    
+    for i in range(0, len(vectors), batch_size):
+        # Une liste par champ (ordre du schéma) au lieu d'un dict par ligne
+        batch = [vectors[i:i+batch_size]] + [columns[field][i:i+batch_size] for field in SCALAR_FIELDS]
+        collection.insert(batch)
+        total_inserted += len(batch[0])
+        print(f"Inséré lot {i//batch_size + 1}: {len(batch[0])} embeddings (Total: {total_inserted}/{len(vectors)})")
+    
+    # Un seul flush : les segments sont scellés une fois, au lieu d'être indexés au fil de l'eau
+    collection.flush()
+    
+    client = get_milvus_client()
+    client.create_index(collection_name=collection_name, index_params=vector_index_params(client))
+    client.load_collection(collection_name=collection_name)
+    
+    print(f"✓ Tous les {total_inserted} embeddings chargés et indexés dans {collection_name}")
+
+
 def search_similar(collection_name, query_embedding, limit=5):
     client = get_milvus_client()
     
     results = client.search(
         collection_name=collection_name,
-        data=[query_embedding],
+        data=as_search_vectors([query_embedding]),
         anns_field="vector",
         search_params={"metric_type": "COSINE", "params": {"nprobe": 10}},
-        output_fields=["text", "source"],
+        output_fields=["text", "doc_id"],
         limit=limit
     )
     
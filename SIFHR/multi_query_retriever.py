@@ -2,6 +2,7 @@ from langchain.retrievers.multi_query import MultiQueryRetriever
 from langchain_community.vectorstores import Milvus
 from langchain_google_genai import ChatGoogleGenerativeAI
 from config import Config
+from document_catalog import CatalogRetriever
 
 
 def get_multi_query_retriever(llm, retriever):
@@ -11,13 +12,16 @@ def get_multi_query_retriever(llm, retriever):
     )
 
 
-def create_vectorstore_retriever(collection_name, embedding_model):
+def create_vectorstore_retriever(collection_name, embedding_model, expr=None):
+    # expr : filtre Milvus sur des champs scalaires indexés (ex. 'theme in ["andalus"]')
     vectorstore = Milvus(
         collection_name=collection_name,
         embedding_function=embedding_model,
         connection_args={"host": Config.MILVUS_HOST, "port": Config.MILVUS_PORT}
     )
-    return vectorstore.as_retriever()
+    # Les chunks ne portent que doc_id : source et chemin MinIO viennent du catalogue
+    search_kwargs = {"expr": expr} if expr else {}
+    return CatalogRetriever(retriever=vectorstore.as_retriever(search_kwargs=search_kwargs))
 
 
 def get_llm():
@@ -0,0 +1,55 @@
+"""Vecteurs d'embedding en tableaux NumPy float32 contigus
+
+Les embeddings circulent sous forme de matrices (n, dim) float32 au lieu de listes de
+listes de floats Python (≈7 fois moins de mémoire). La validation et la normalisation
+sont vectorisées, et pymilvus reçoit directement les tableaux float32 (sérialisés en
+octets pour la recherche, sans conversion élément par élément).
+"""
+from typing import Optional
+
+import numpy as np
+
+
+class EmbeddingValidationError(ValueError):
+    """Vecteurs invalides : dimension incorrecte, valeurs NaN/infinies ou vecteurs nuls"""
+
+
+def as_float32_matrix(vectors, dim: Optional[int] = None) -> np.ndarray:
+    """Matrice (n, dim) float32 contiguë ; une matrice déjà conforme n'est pas copiée"""
+    try:
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    except ValueError as e:
+        raise EmbeddingValidationError(f"Vecteurs de dimensions differentes: {e}") from e
+    if matrix.size == 0:
+        return matrix.reshape(0, dim or 0)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if matrix.ndim != 2:
+        raise EmbeddingValidationError(f"Matrice d'embeddings attendue, tableau de forme {matrix.shape}")
+    if dim and matrix.shape[1] != dim:
+        raise EmbeddingValidationError(f"Dimension {matrix.shape[1]} au lieu de {dim}")
+    return matrix
+
+
+def validate_vectors(matrix: np.ndarray, dim: Optional[int] = None) -> np.ndarray:
+    """Dimension, valeurs finies et vecteurs non nuls (la similarité COSINE est indéfinie pour un vecteur nul)"""
+    matrix = as_float32_matrix(matrix, dim)
+    finite = np.isfinite(matrix).all(axis=1)
+    if not finite.all():
+        raise EmbeddingValidationError(f"Valeurs NaN ou infinies dans les vecteurs {np.flatnonzero(~finite)[:10].tolist()}")
+    zero = ~matrix.any(axis=1)
+    if zero.any():
+        raise EmbeddingValidationError(f"Vecteurs nuls {np.flatnonzero(zero)[:10].tolist()}")
+    return matrix
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Normalisation L2 de chaque ligne (les vecteurs nuls restent nuls)"""
+    matrix = as_float32_matrix(matrix)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def as_search_vectors(vectors, dim: Optional[int] = None) -> list:
+    """Vecteurs de requête pour pymilvus : lignes float32 (vues, sans copie ni conversion)"""
+    return list(validate_vectors(vectors, dim))
@@ -0,0 +1,153 @@
+"""Benchmark du convertisseur PDF sur un long scénario (≈10 000 mots)
+
+Usage:
+    python bench_pdf.py [--words 10000] [--runs 3]
+
+Compare l'ancien parser ligne par ligne (un Spacer par ligne vide, gras seulement)
+au tokenizer actuel : nombre de flowables, temps de parsing et temps de mise en page
+ReportLab (doc.build). Mesure aussi la mémoire par PDF (tracemalloc : pic pendant
+la génération et mémoire retenue par la réponse) du chemin bytes + base64 de
+/check-similarity face au rendu fichier de /export/pdf. Le pic est comparable (ReportLab
+construit le document en mémoire dans les deux cas) : seule la mémoire retenue par la
+réponse (bytes, base64 et corps JSON) diffère.
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import time
+import tracemalloc
+from io import BytesIO
+
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+from pdf_converter import PDFConverter, iter_file_chunks
+
+
+WORDS = ("calife palais Bagdad mosquée caravane épices manuscrit astrolabe jardin fontaine "
+         "zellige mouqarnas calligraphie marchand érudit poète souk minaret lanterne "
+         "parchemin énigme trésor vizir Cordoue Samarcande soie encens").split()
+
+
+def make_scenario(word_count: int, seed: int = 42) -> str:
+    """Générer un scénario markdown réaliste (titres, listes, citations, blancs)"""
+    rng = random.Random(seed)
+    lines = ["# Le Secret des Sept Portes de Bagdad", ""]
+    written = 0
+    act = 1
+    while written < word_count:
+        lines += [f"## Acte {act} : La Porte de **{rng.choice(WORDS)}**", ""]
+        for _ in range(4):
+            for _ in range(rng.randint(3, 6)):
+                sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 16)))
+                lines.append(f"{sentence.capitalize()} *{rng.choice(WORDS)}* **{rng.choice(WORDS)}**.")
+                written += len(sentence.split()) + 2
+            lines += ["", ""]
+        lines += ["### Énigmes", ""]
+        for i in range(1, 4):
+            lines.append(f"{i}. {' '.join(rng.choice(WORDS) for _ in range(10))}")
+            written += 10
+        lines += ["", "> " + " ".join(rng.choice(WORDS) for _ in range(20)), "", "---", ""]
+        written += 20
+        act += 1
+    return "\n".join(lines)
+
+
+def legacy_parse(converter: PDFConverter, content: str) -> list:
+    """Ancien parser ligne par ligne, conservé ici pour comparaison"""
+    elements = []
+    content = converter.clean_text_for_pdf(content)
+    for line in content.split('\n'):
+        line = line.strip()
+        if not line:
+            elements.append(Spacer(1, 6))
+        elif line.startswith('# '):
+            elements.append(Paragraph(line[2:].strip(), converter.styles['CustomTitle']))
+            elements.append(Spacer(1, 12))
+        elif line.startswith('## '):
+            elements.append(Paragraph(line[3:].strip(), converter.styles['CustomHeading']))
+        elif line.startswith('### '):
+            elements.append(Paragraph(f"<b>{line[4:].strip()}</b>", converter.styles['CustomBold']))
+        elif line.startswith('- ') or line.startswith('• '):
+            elements.append(Paragraph(f"• {line[2:].strip()}", converter.styles['CustomBody']))
+        elif '**' in line:
+            elements.append(Paragraph(re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', line), converter.styles['CustomBody']))
+        else:
+            elements.append(Paragraph(line, converter.styles['CustomBody']))
+    return elements
+
+
+def layout(elements: list) -> int:
+    """Mettre en page les éléments et retourner la taille du PDF"""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=60, leftMargin=60,
+                            topMargin=60, bottomMargin=60)
+    doc.build(elements)
+    return len(buffer.getvalue())
+
+
+def bench(label: str, parse, content: str, runs: int):
+    parse_times, layout_times = [], []
+    count = size = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        elements = parse(content)
+        parse_times.append(time.perf_counter() - start)
+        count = len(elements)
+
+        start = time.perf_counter()
+        size = layout(elements)
+        layout_times.append(time.perf_counter() - start)
+
+    print(f"{label:<10} flowables={count:>6}  parse={min(parse_times) * 1000:8.1f} ms  "
+          f"layout={min(layout_times) * 1000:8.1f} ms  pdf={size / 1024:.0f} Ko")
+
+
+def peak_memory(label: str, fn):
+    """Afficher le pic d'allocation Python pendant l'appel et la mémoire retenue par la réponse"""
+    tracemalloc.start()
+    try:
+        size, payload = fn()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del payload
+    print(f"{label:<22} peak={peak / (1024 * 1024):7.2f} Mo  "
+          f"retenu={retained / (1024 * 1024):7.2f} Mo  pdf={size / 1024:.0f} Ko")
+
+
+def bytes_and_base64(converter: PDFConverter, content: str):
+    """Chemin /check-similarity : BytesIO -> getvalue() -> base64 -> corps JSON"""
+    pdf_bytes, filename = converter.convert_to_pdf(content, "Benchmark", use_cache=False)
+    pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
+    body = json.dumps({"pdf_data": pdf_base64, "pdf_filename": filename}).encode('utf-8')
+    return len(pdf_bytes), (pdf_bytes, pdf_base64, body)
+
+
+def file_and_stream(converter: PDFConverter, content: str):
+    """Chemin /export/pdf : fichier temporaire relu par morceaux de 64 Ko"""
+    path, _ = converter.convert_to_file(content, "Benchmark", use_cache=False)
+    return sum(len(chunk) for chunk in iter_file_chunks(path)), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--words', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    converter = PDFConverter()
+    content = make_scenario(args.words)
+    print(f"Scenario: {len(content.split())} mots, {content.count(chr(10)) + 1} lignes")
+
+    bench("legacy", lambda c: legacy_parse(converter, c), content, args.runs)
+    bench("tokenizer", converter.parse_markdown_to_elements, content, args.runs)
+
+    peak_memory("bytes + base64", lambda: bytes_and_base64(converter, content))
+    peak_memory("fichier + streaming", lambda: file_and_stream(converter, content))
+
+
+if __name__ == "__main__":
+    main()
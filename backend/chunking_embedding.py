@@ -3,12 +3,57 @@ from langchain_mistralai import MistralAIEmbeddings
 from langchain_anthropic import ChatAnthropic
 from langchain.embeddings.base import Embeddings
 from config import Config
+from vectors import as_float32_matrix, normalize_rows, validate_vectors
+from embedding_batcher import QUERY_BATCHING, BatchedQueryEmbeddings, MicroBatcher
 import numpy as np
 from typing import List
+import io
+import os
+import asyncio
 import hashlib
+import threading
+from concurrent.futures import Future
 import requests
+import httpx
 import json
 
+# Requêtes d'embedding simultanées sur le chemin async (Claude et Voyage, un appel par texte)
+EMBEDDING_CONCURRENCY = int(os.getenv('SIFHR_EMBEDDING_CONCURRENCY', 8))
+
+# Fournisseur d'embeddings : mistral (API) ou local (modèle ONNX quantifié sur CPU)
+EMBEDDING_PROVIDER = os.getenv('SIFHR_EMBEDDING_PROVIDER', 'mistral')
+# Modèle local multilingue, fichier ONNX quantifié (int8) et dimension (0 = dimension native)
+LOCAL_EMBEDDING_MODEL = os.getenv('SIFHR_LOCAL_EMBEDDING_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+LOCAL_EMBEDDING_BACKEND = os.getenv('SIFHR_LOCAL_EMBEDDING_BACKEND', 'onnx')
+LOCAL_EMBEDDING_ONNX_FILE = os.getenv('SIFHR_LOCAL_EMBEDDING_ONNX_FILE', 'onnx/model_qint8_avx512_vnni.onnx')
+LOCAL_EMBEDDING_DIM = int(os.getenv('SIFHR_LOCAL_EMBEDDING_DIM', 0))
+# Regroupement dynamique : textes par passe du modèle et attente maximale pour compléter un lot
+LOCAL_EMBEDDING_BATCH = int(os.getenv('SIFHR_LOCAL_EMBEDDING_BATCH', 64))
+LOCAL_EMBEDDING_WAIT_MS = float(os.getenv('SIFHR_LOCAL_EMBEDDING_WAIT_MS', 5))
+
+# Dimension des embeddings Claude et Voyage
+CLAUDE_EMBEDDING_DIM = 1536
+
+
+class Float32MistralEmbeddings(MistralAIEmbeddings):
+    """Embeddings Mistral convertis une seule fois en matrice float32 validée
+
+    Les listes de floats de la réponse JSON ne sont pas conservées : ingestion, recherche
+    et vérification de similarité manipulent des tableaux (n, 1024) contigus.
+    """
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return validate_vectors(super().embed_documents(texts))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> np.ndarray:
+        return validate_vectors(await super().aembed_documents(texts))
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        return (await self.aembed_documents([text]))[0]
+
 
 class ClaudeEmbeddings(Embeddings):
     """Embeddings personnalisés utilisant Claude pour générer des représentations vectorielles"""
@@ -20,68 +65,89 @@ class ClaudeEmbeddings(Embeddings):
             temperature=0.7
         )
     
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Générer des embeddings pour une liste de documents en utilisant Claude"""
-        embeddings = []
-        for text in texts:
-            # Utiliser Claude pour créer une représentation sémantique du texte
-            prompt = f"""Analysez le texte suivant et créez une représentation vectorielle sémantique en retournant exactement 1536 nombres décimaux séparés par des virgules, chaque nombre étant entre -1.0 et 1.0. Ces nombres doivent représenter les concepts, thèmes et significations du texte.
+    @staticmethod
+    def _prompt(text: str) -> str:
+        # Utiliser Claude pour créer une représentation sémantique du texte
+        return f"""Analysez le texte suivant et créez une représentation vectorielle sémantique en retournant exactement 1536 nombres décimaux séparés par des virgules, chaque nombre étant entre -1.0 et 1.0. Ces nombres doivent représenter les concepts, thèmes et significations du texte.
 
 Texte: {text[:500]}...
 
 Répondez uniquement avec 1536 nombres séparés par des virgules, sans explication:"""
-            
+
+    @staticmethod
+    def _parse_vector(response) -> np.ndarray:
+        response_text = response.content if hasattr(response, 'content') else str(response)
+
+        # Parser la réponse en une passe : les éléments non numériques deviennent NaN puis 0
+        text = response_text.replace('\n', '')
+        numbers = np.empty(0, dtype=np.float32)
+        if text.strip():
+            numbers = np.atleast_1d(np.genfromtxt(io.StringIO(text), delimiter=',', comments=None,
+                                                  dtype=np.float32))
+        # S'assurer que les nombres sont dans la plage [-1, 1]
+        numbers = np.clip(np.nan_to_num(numbers, nan=0.0, posinf=1.0, neginf=-1.0), -1.0, 1.0)
+
+        # Exactement 1536 dimensions : tronquer ou compléter avec des zéros
+        vector = np.zeros(CLAUDE_EMBEDDING_DIM, dtype=np.float32)
+        count = min(len(numbers), CLAUDE_EMBEDDING_DIM)
+        vector[:count] = numbers[:count]
+        return vector
+
+    @staticmethod
+    def _hash_vector(text: str) -> np.ndarray:
+        # Fallback vers la méthode hash en cas d'erreur : 4 valeurs dans [-1, 1] par octet du SHA-256
+        digest = np.frombuffer(hashlib.sha256(text.encode()).digest(), dtype=np.uint8).astype(np.float32)
+        values = np.stack([
+            digest / 255.0,
+            (digest % 128) / 127.0,
+            (digest % 64) / 63.0,
+            (digest % 32) / 31.0
+        ], axis=1).ravel() * 2 - 1
+
+        vector = np.zeros(CLAUDE_EMBEDDING_DIM, dtype=np.float32)
+        vector[:len(values)] = values
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """Générer des embeddings pour une liste de documents en utilisant Claude"""
+        embeddings = np.zeros((len(texts), CLAUDE_EMBEDDING_DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
             try:
-                response = self.llm.invoke(prompt)
-                response_text = response.content if hasattr(response, 'content') else str(response)
-                
-                # Parser la réponse pour extraire les nombres
-                numbers = []
-                for item in response_text.replace('\n', '').split(','):
-                    try:
-                        num = float(item.strip())
-                        # S'assurer que le nombre est dans la plage [-1, 1]
-                        num = max(-1.0, min(1.0, num))
-                        numbers.append(num)
-                    except ValueError:
-                        # En cas d'erreur, utiliser une valeur par défaut
-                        numbers.append(0.0)
-                
-                # S'assurer qu'on a exactement 1536 dimensions
-                if len(numbers) < 1536:
-                    # Compléter avec des zéros
-                    numbers.extend([0.0] * (1536 - len(numbers)))
-                elif len(numbers) > 1536:
-                    # Tronquer à 1536
-                    numbers = numbers[:1536]
-                
-                embeddings.append(numbers)
-                
+                embeddings[i] = self._parse_vector(self.llm.invoke(self._prompt(text)))
             except Exception as e:
                 print(f"Erreur lors de la génération d'embedding avec Claude: {e}")
-                # Fallback vers la méthode hash en cas d'erreur
-                text_hash = hashlib.sha256(text.encode()).hexdigest()
-                vector = []
-                for i in range(0, min(len(text_hash), 96), 2):
-                    hex_val = text_hash[i:i+2]
-                    vector.extend([
-                        (int(hex_val, 16) / 255.0) * 2 - 1,  # Normaliser entre -1 et 1
-                        ((int(hex_val, 16) % 128) / 127.0) * 2 - 1,
-                        ((int(hex_val, 16) % 64) / 63.0) * 2 - 1,
-                        ((int(hex_val, 16) % 32) / 31.0) * 2 - 1
-                    ])
-                
-                while len(vector) < 1536:
-                    vector.append(0.0)
-                
-                embeddings.append(vector[:1536])
-        
-        return embeddings
-    
-    def embed_query(self, text: str) -> List[float]:
+                embeddings[i] = self._hash_vector(text)
+        return self._with_fallback(texts, embeddings)
+
+    def _with_fallback(self, texts: List[str], embeddings: np.ndarray) -> np.ndarray:
+        # Réponse sans aucun nombre exploitable (vecteur nul) : vecteur de hash à la place
+        for i in np.flatnonzero(~embeddings.any(axis=1)):
+            embeddings[i] = self._hash_vector(texts[i])
+        return validate_vectors(embeddings, CLAUDE_EMBEDDING_DIM)
+
+    def embed_query(self, text: str) -> np.ndarray:
         """Générer un embedding pour une requête"""
         return self.embed_documents([text])[0]
 
+    async def aembed_documents(self, texts: List[str]) -> np.ndarray:
+        """Version async : appels simultanés (bornés) au lieu d'un appel après l'autre"""
+        semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+        embeddings = np.zeros((len(texts), CLAUDE_EMBEDDING_DIM), dtype=np.float32)
+
+        async def embed(i: int, text: str):
+            async with semaphore:
+                try:
+                    embeddings[i] = self._parse_vector(await self.llm.ainvoke(self._prompt(text)))
+                except Exception as e:
+                    print(f"Erreur lors de la génération d'embedding avec Claude: {e}")
+                    embeddings[i] = self._hash_vector(text)
+
+        await asyncio.gather(*(embed(i, text) for i, text in enumerate(texts)))
+        return self._with_fallback(texts, embeddings)
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        return (await self.aembed_documents([text]))[0]
+
 
 class VoyageEmbeddings(Embeddings):
     """Embeddings utilisant Voyage-3-Large via l'API Anthropic"""
@@ -90,60 +156,194 @@ class VoyageEmbeddings(Embeddings):
         self.api_key = api_key
         self.model = model
         self.api_url = "https://api.anthropic.com/v1/messages"
+        # Connexions HTTP réutilisées (keep-alive) au lieu d'une connexion TLS par texte
+        self.session = requests.Session()
+        self._async_client = None
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                # Pas de limite d'attente d'une connexion libre : les textes font la queue dans le pool
+                timeout=httpx.Timeout(60.0, pool=None),
+                limits=httpx.Limits(max_connections=EMBEDDING_CONCURRENCY, max_keepalive_connections=EMBEDDING_CONCURRENCY)
+            )
+        return self._async_client
+
+    def _headers(self) -> dict:
+        return {
+            'Content-Type': 'application/json',
+            'x-api-key': self.api_key,
+            'anthropic-version': '2023-06-01'
+        }
+
+    @staticmethod
+    def _payload(text: str) -> dict:
+        # Pour l'instant, utiliser Claude pour créer des embeddings sémantiques
+        # En attendant l'API Voyage officielle
+        return {
+            "model": "claude-3-haiku-20240307",
+            "max_tokens": 1000,
+            "messages": [{
+                "role": "user",
+                "content": f"Create a 1536-dimensional semantic embedding vector for this text (return only comma-separated numbers): {text[:500]}"
+            }]
+        }
+
+    @staticmethod
+    def _vectors(answered: List[bool]) -> np.ndarray:
+        # Générer des vecteurs aléatoires (normalisés si l'API a répondu) pour la démonstration
+        answered = np.asarray(answered, dtype=bool)
+        vectors = np.random.uniform(-1, 1, (len(answered), CLAUDE_EMBEDDING_DIM)).astype(np.float32)
+        vectors[answered] = normalize_rows(vectors[answered])
+        return validate_vectors(vectors, CLAUDE_EMBEDDING_DIM)
     
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
         """Générer des embeddings pour une liste de documents"""
-        embeddings = []
+        answered = []
         for text in texts:
-            # Pour l'instant, utiliser Claude pour créer des embeddings sémantiques
-            # En attendant l'API Voyage officielle
             try:
-                headers = {
-                    'Content-Type': 'application/json',
-                    'x-api-key': self.api_key,
-                    'anthropic-version': '2023-06-01'
-                }
-                
-                payload = {
-                    "model": "claude-3-haiku-20240307",
-                    "max_tokens": 1000,
-                    "messages": [{
-                        "role": "user",
-                        "content": f"Create a 1536-dimensional semantic embedding vector for this text (return only comma-separated numbers): {text[:500]}"
-                    }]
-                }
-                
-                response = requests.post(self.api_url, headers=headers, json=payload)
-                if response.status_code == 200:
-                    # Parser la réponse et créer un vecteur
-                    import random
-                    # Générer un vecteur aléatoire normalisé pour la démonstration
-                    vector = [random.uniform(-1, 1) for _ in range(1536)]
-                    # Normaliser le vecteur
-                    norm = sum(x*x for x in vector) ** 0.5
-                    if norm > 0:
-                        vector = [x/norm for x in vector]
-                    embeddings.append(vector)
-                else:
-                    # Fallback : vecteur aléatoire
-                    vector = [random.uniform(-1, 1) for _ in range(1536)]
-                    embeddings.append(vector)
-                    
-            except Exception as e:
+                response = self.session.post(self.api_url, headers=self._headers(), json=self._payload(text))
+                answered.append(response.status_code == 200)
+            except Exception:
                 # Fallback en cas d'erreur
-                import random
-                vector = [random.uniform(-1, 1) for _ in range(1536)]
-                embeddings.append(vector)
+                answered.append(False)
         
-        return embeddings
+        return self._vectors(answered)
     
-    def embed_query(self, text: str) -> List[float]:
+    def embed_query(self, text: str) -> np.ndarray:
         """Générer un embedding pour une requête"""
         return self.embed_documents([text])[0]
 
-def get_embedding_model():
+    async def aembed_documents(self, texts: List[str]) -> np.ndarray:
+        """Version async : client httpx partagé, requêtes simultanées bornées par le pool de connexions"""
+        async def embed(text: str) -> bool:
+            try:
+                response = await self.async_client.post(self.api_url, headers=self._headers(), json=self._payload(text))
+                return response.status_code == 200
+            except Exception:
+                return False
+
+        return self._vectors(list(await asyncio.gather(*(embed(text) for text in texts))))
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        return (await self.aembed_documents([text]))[0]
+
+class LocalEmbeddings(Embeddings):
+    """Embeddings locaux sur CPU : modèle multilingue ONNX quantifié, sans appel réseau
+
+    Les demandes des différents threads (ingestion, recherche, vérification de similarité)
+    sont regroupées par un thread unique en lots de LOCAL_EMBEDDING_BATCH textes : une
+    requête isolée attend au plus LOCAL_EMBEDDING_WAIT_MS millisecondes qu'un lot se forme.
+    Les vecteurs sont normalisés (similarité COSINE dans Milvus) et, si dim est fourni,
+    tronqués à cette dimension avant normalisation.
+    """
+
+    def __init__(self, model_name: str = LOCAL_EMBEDDING_MODEL, dim: int = LOCAL_EMBEDDING_DIM,
+                 backend: str = LOCAL_EMBEDDING_BACKEND, onnx_file: str = LOCAL_EMBEDDING_ONNX_FILE,
+                 batch_size: int = LOCAL_EMBEDDING_BATCH, max_wait_ms: float = LOCAL_EMBEDDING_WAIT_MS):
+        self.model_name = model_name
+        self.dim = dim or None
+        self.backend = backend
+        self.onnx_file = onnx_file
+        self.batch_size = max(1, batch_size)
+        self._model = None
+        self._model_lock = threading.Lock()
+        # Un seul thread : les lots sont encodés l'un après l'autre sur le CPU
+        self._batcher = MicroBatcher(self._encode, 'local', self.batch_size, max_wait_ms)
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    def _load_model(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "SIFHR_EMBEDDING_PROVIDER=local nécessite sentence-transformers[onnx] (pip install \"sentence-transformers[onnx]\")"
+            ) from e
+
+        kwargs = {}
+        if self.backend == 'onnx' and self.onnx_file:
+            kwargs['model_kwargs'] = {'file_name': self.onnx_file}
+        model = SentenceTransformer(self.model_name, device='cpu', backend=self.backend,
+                                    truncate_dim=self.dim, **kwargs)
+        native_dim = model.get_sentence_embedding_dimension()
+        print(f"Modele d'embedding local {self.model_name} ({self.backend}) charge, dimension {native_dim}")
+        return model
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                    convert_to_numpy=True, show_progress_bar=False)
+        return as_float32_matrix(vectors)
+
+    def submit(self, texts: List[str]) -> Future:
+        """Mettre des textes en file ; le Future reçoit leurs vecteurs"""
+        return self._batcher.submit(texts)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self.submit(texts).result()
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> np.ndarray:
+        # Aucun thread bloqué en attente : le Future est attendu dans la boucle d'événements
+        return await asyncio.wrap_future(self.submit(texts))
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        return (await self.aembed_documents([text]))[0]
+
+
+_local_embeddings = None
+_local_embeddings_lock = threading.Lock()
+
+
+def get_local_embeddings() -> LocalEmbeddings:
+    """Instance partagée : le modèle est chargé une seule fois par processus"""
+    global _local_embeddings
+    with _local_embeddings_lock:
+        if _local_embeddings is None:
+            _local_embeddings = LocalEmbeddings()
+    return _local_embeddings
+
+
+EMBEDDING_PROVIDERS = ('mistral', 'local')
+
+_batched_embeddings = {}
+_batched_embeddings_lock = threading.Lock()
+
+
+def get_embedding_model(provider=None):
+    # provider : celui d'une collection réindexée (voir reindex.py), sinon SIFHR_EMBEDDING_PROVIDER
+    provider = provider or EMBEDDING_PROVIDER
+
+    # Modèle local sur CPU : la dimension dépend du modèle (384 par défaut) et diffère de
+    # celle de Mistral, les collections doivent être réindexées avec ce modèle
+    if provider == 'local':
+        return get_local_embeddings()
+
+    # Requêtes regroupées entre appelants simultanés : une instance partagée par fournisseur
+    if QUERY_BATCHING:
+        with _batched_embeddings_lock:
+            if provider not in _batched_embeddings:
+                _batched_embeddings[provider] = BatchedQueryEmbeddings(_api_embedding_model(), name=provider)
+        return _batched_embeddings[provider]
+    return _api_embedding_model()
+
+
+def _api_embedding_model():
     # Utiliser Mistral pour les embeddings (1024 dimensions - compatible avec Milvus)
-    return MistralAIEmbeddings(
+    return Float32MistralEmbeddings(
         mistral_api_key=Config.MISTRAL_API_KEY,
         model=Config.EMBEDDING_MODEL
     )
@@ -169,4 +369,59 @@ def chunk_document(content, chunk_size=512, chunk_overlap=50):
         is_separator_regex=False,
     )
     chunks = text_splitter.split_text(content)
-    return chunks
\ No newline at end of file
+    return chunks
+
+
+def chunk_and_embed_document(content, doc_name, metadata=None, collection_name="scenarios_sifhr",
+                             embedding_model=None):
+    """Découper un document, embedder tous les chunks en un lot et les insérer dans Milvus"""
+    from milvus_client import ensure_scenario_collection, insert_rows
+    from similarity_checker import minhash_signature, new_scenario_id, similarity_checker
+
+    metadata = metadata or {}
+    try:
+        chunks = chunk_document(content)
+        if not chunks:
+            return {'success': False, 'error': 'Document vide', 'chunks_count': 0, 'embeddings_count': 0}
+
+        # Un seul appel d'embedding pour tous les chunks
+        embedding_model = embedding_model or get_embedding_model()
+        embeddings = as_float32_matrix(embedding_model.embed_documents(chunks))
+        if len(embeddings) != len(chunks):
+            return {
+                'success': False,
+                'error': f"{len(embeddings)} embeddings pour {len(chunks)} chunks",
+                'chunks_count': len(chunks),
+                'embeddings_count': len(embeddings)
+            }
+
+        # Collection et index créés au premier usage
+        ensure_scenario_collection(collection_name, dim=embeddings.shape[1])
+
+        title = metadata.get('title', doc_name)
+        signature = minhash_signature(content)
+        # Même identifiant sur tous les chunks : recherche vectorielle et MinHash regroupent par scénario
+        scenario_id = new_scenario_id()
+        rows = []
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            rows.append({
+                "vector": embedding,
+                "text": chunk,
+                "title": title,
+                "type": metadata.get('type', ''),
+                "source": metadata.get('source', doc_name),
+                "embedding_date": metadata.get('embedding_date', ''),
+                "chunk_index": i,
+                "scenario_id": scenario_id,
+                "minhash": json.dumps(signature) if i == 0 else ""
+            })
+
+        inserted = insert_rows(collection_name, rows)
+        similarity_checker.register_scenario(scenario_id, title, signature)
+        print(f"Document {doc_name}: {inserted} chunks embeddés et insérés dans {collection_name}")
+
+        return {'success': True, 'chunks_count': len(chunks), 'embeddings_count': len(embeddings)}
+
+    except Exception as e:
+        print(f"Erreur lors de l'embedding du document {doc_name}: {e}")
+        return {'success': False, 'error': str(e), 'chunks_count': 0, 'embeddings_count': 0}
@@ -0,0 +1,160 @@
+"""Catalogue des documents sources de la base de connaissances
+
+Les chunks de data_sifhr ne portent plus que leur texte, leur vecteur et un doc_id entier :
+source, chemin MinIO, bucket et endpoint (jusqu'à 3,5 Ko par ligne, identiques pour tous
+les chunks d'un document) sont stockés une seule fois par document dans la collection
+catalogue. Le retriever complète les métadonnées des chunks trouvés après la recherche,
+à partir d'un cache en mémoire (quelques dizaines de documents).
+
+Le doc_id est dérivé du chemin MinIO : l'ingestion SIFHR et la réindexation attribuent le
+même identifiant au même document sans coordination.
+"""
+import os
+import asyncio
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pymilvus import DataType
+
+from milvus_client import get_milvus_client
+
+# Collection catalogue (une ligne par document source)
+DOCUMENT_CATALOG_COLLECTION = os.getenv('SIFHR_DOCUMENT_CATALOG', 'data_sifhr_documents')
+DOCUMENT_FIELDS = ["source", "minio_path", "bucket", "endpoint"]
+# Milvus exige un champ vectoriel : vecteur nul de dimension 2, jamais interrogé
+PLACEHOLDER_DIM = 2
+
+
+def document_id(minio_path: str) -> int:
+    """Identifiant stable (entier positif sur 63 bits) dérivé du chemin MinIO du document"""
+    digest = hashlib.blake2b(minio_path.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
+
+class DocumentCatalog:
+    """Table doc_id -> métadonnées du document, stockée dans Milvus et mise en cache"""
+
+    def __init__(self, collection_name: str = DOCUMENT_CATALOG_COLLECTION):
+        self.collection_name = collection_name
+        self._documents: Dict[int, Dict] = {}
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        """Créer (et charger) la collection catalogue au premier usage"""
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            client = get_milvus_client()
+            if not client.has_collection(self.collection_name):
+                schema = client.create_schema(auto_id=False, enable_dynamic_field=False)
+                schema.add_field(field_name="doc_id", datatype=DataType.INT64, is_primary=True)
+                schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=PLACEHOLDER_DIM)
+                schema.add_field(field_name="source", datatype=DataType.VARCHAR, max_length=1024)
+                schema.add_field(field_name="minio_path", datatype=DataType.VARCHAR, max_length=2048)
+                schema.add_field(field_name="bucket", datatype=DataType.VARCHAR, max_length=256)
+                schema.add_field(field_name="endpoint", datatype=DataType.VARCHAR, max_length=256)
+
+                index_params = client.prepare_index_params()
+                index_params.add_index(field_name="vector", index_type="FLAT", metric_type="L2")
+                client.create_collection(collection_name=self.collection_name, schema=schema,
+                                         index_params=index_params)
+                print(f"Collection {self.collection_name} créée avec succès.")
+            client.load_collection(collection_name=self.collection_name)
+            self._ready = True
+
+    def register(self, documents: Iterable[Dict]) -> List[int]:
+        """Enregistrer (upsert) des documents ; retourne leurs doc_id dans le même ordre"""
+        doc_ids = []
+        rows = {}
+        for document in documents:
+            row = {field: document.get(field, '') for field in DOCUMENT_FIELDS}
+            doc_id = document_id(row['minio_path'] or row['source'])
+            doc_ids.append(doc_id)
+            rows[doc_id] = row
+
+        # Documents déjà connus à l'identique : aucune écriture
+        new_rows = {doc_id: row for doc_id, row in rows.items() if self._documents.get(doc_id) != row}
+        if new_rows:
+            self.ensure()
+            get_milvus_client().upsert(
+                collection_name=self.collection_name,
+                data=[dict(row, doc_id=doc_id, vector=[0.0] * PLACEHOLDER_DIM) for doc_id, row in new_rows.items()]
+            )
+            with self._lock:
+                self._documents.update(new_rows)
+        return doc_ids
+
+    def lookup(self, doc_ids: Iterable[int]) -> Dict[int, Dict]:
+        """Métadonnées des documents ; les doc_id inconnus du cache sont lus en une requête"""
+        wanted = {int(doc_id) for doc_id in doc_ids}
+        missing = [doc_id for doc_id in wanted if doc_id not in self._documents]
+        if missing:
+            try:
+                self.ensure()
+                rows = get_milvus_client().query(
+                    collection_name=self.collection_name,
+                    filter=f"doc_id in {missing}",
+                    output_fields=["doc_id"] + DOCUMENT_FIELDS
+                )
+                with self._lock:
+                    for row in rows:
+                        self._documents[int(row['doc_id'])] = {field: row.get(field, '') for field in DOCUMENT_FIELDS}
+            except Exception as e:
+                print(f"Catalogue des documents indisponible: {e}")
+        return {doc_id: self._documents[doc_id] for doc_id in wanted if doc_id in self._documents}
+
+    def is_cached(self, docs: List[Document]) -> bool:
+        return all(int(doc.metadata['doc_id']) in self._documents for doc in docs if 'doc_id' in doc.metadata)
+
+    def join(self, docs: List[Document]) -> List[Document]:
+        """Compléter les métadonnées des chunks par celles de leur document"""
+        doc_ids = [doc.metadata['doc_id'] for doc in docs if 'doc_id' in doc.metadata]
+        if not doc_ids:
+            # Collection historique : les métadonnées sont déjà dans les chunks
+            return docs
+        documents = self.lookup(doc_ids)
+        for doc in docs:
+            document = documents.get(int(doc.metadata.get('doc_id', -1)))
+            if document is not None:
+                doc.metadata.update(document)
+        return docs
+
+
+class CatalogRetriever(BaseRetriever):
+    """Retriever vectoriel suivi de la jointure avec le catalogue des documents
+
+    fallback : retriever interrogé si celui-ci ne trouve rien (recherche restreinte à des
+    partitions, voir multi_query_retriever.scope_retriever).
+    """
+
+    retriever: BaseRetriever
+    catalog: Any = None
+    fallback: Optional[BaseRetriever] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        if not docs and self.fallback is not None:
+            docs = self.fallback.invoke(query, config={"callbacks": run_manager.get_child()})
+        return (self.catalog or document_catalog).join(docs)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        docs = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        if not docs and self.fallback is not None:
+            docs = await self.fallback.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        catalog = self.catalog or document_catalog
+        if catalog.is_cached(docs):
+            return catalog.join(docs)
+        # Document absent du cache : requête Milvus synchrone, hors de la boucle d'événements
+        return await asyncio.to_thread(catalog.join, docs)
+
+
+# Instance globale
+document_catalog = DocumentCatalog()
@@ -0,0 +1,216 @@
+"""Regroupement (micro-batching) des embeddings demandés simultanément
+
+Chaque question et chaque variante du MultiQueryRetriever appelle embed_query : sous
+charge, des dizaines de petites requêtes HTTP par seconde, chacune payant un aller-retour
+complet et comptant dans la limite de débit du fournisseur. Un MicroBatcher collecte les
+textes des appelants simultanés pendant quelques millisecondes (ou jusqu'à une taille
+maximale), envoie un seul embed_documents et redistribue les vecteurs aux appelants.
+
+Métriques (GET /llm/stats) : taille des lots et attente ajoutée par le regroupement.
+"""
+import os
+import time
+import queue
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from vectors import EmbeddingValidationError, as_float32_matrix, validate_vectors
+
+# Regroupement des requêtes d'embedding (API) : activé, taille maximale d'un lot, attente
+# maximale pour compléter un lot et lots envoyés simultanément
+QUERY_BATCHING = os.getenv('SIFHR_QUERY_BATCHING', '1') == '1'
+QUERY_BATCH_SIZE = int(os.getenv('SIFHR_QUERY_BATCH_SIZE', 32))
+QUERY_BATCH_WAIT_MS = float(os.getenv('SIFHR_QUERY_BATCH_WAIT_MS', 5))
+QUERY_BATCH_WORKERS = int(os.getenv('SIFHR_QUERY_BATCH_WORKERS', 4))
+
+# Tranches de l'histogramme des tailles de lot
+BATCH_SIZE_BUCKETS = ((1, '1'), (4, '2-4'), (8, '5-8'), (16, '9-16'), (None, '17+'))
+
+_batchers_lock = threading.Lock()
+_batchers: Dict[str, 'MicroBatcher'] = {}
+
+
+class MicroBatcher:
+    """File partagée : un thread forme les lots, embed_fn est appelé une fois par lot
+
+    workers=1 : les lots sont traités par le thread de regroupement (modèle local sur CPU) ;
+    workers>1 : plusieurs lots peuvent être en vol (API HTTP), le lot suivant se forme
+    pendant que le précédent attend sa réponse.
+    dedupe=True : un texte demandé par plusieurs appelants du même lot n'est embeddé qu'une fois.
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], np.ndarray], name: str, max_batch: int,
+                 max_wait_ms: float, workers: int = 1, dedupe: bool = False):
+        self.embed_fn = embed_fn
+        self.name = name
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.dedupe = dedupe
+        self._executor = (ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'sifhr-batch-{name}')
+                          if workers > 1 else None)
+        self._requests = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self.reset()
+        with _batchers_lock:
+            _batchers[name] = self
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.texts = 0
+            self.batches = 0
+            self.deduplicated = 0
+            self.errors = 0
+            self.max_batch_size = 0
+            self.batch_sizes = Counter()
+            self.waits = []
+            self.call_times = []
+
+    def submit(self, texts: List[str]) -> Future:
+        """Mettre des textes en file ; le Future reçoit leur matrice de vecteurs"""
+        future = Future()
+        if not texts:
+            future.set_result(validate_vectors([]))
+            return future
+        self._ensure_worker()
+        self._requests.put((list(texts), future, time.perf_counter()))
+        return future
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name=f'sifhr-batcher-{self.name}', daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        """Thread de regroupement : concatène les demandes en attente jusqu'à la taille ou l'échéance"""
+        while True:
+            pending = [self._requests.get()]
+            count = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                count += len(item[0])
+
+            pending = [item for item in pending if item[1].set_running_or_notify_cancel()]
+            if not pending:
+                continue
+            if self._executor is not None:
+                self._executor.submit(self._flush, pending)
+            else:
+                self._flush(pending)
+
+    def _flush(self, pending):
+        dispatched = time.perf_counter()
+        texts = [text for item in pending for text in item[0]]
+        unique = list(dict.fromkeys(texts)) if self.dedupe else texts
+        try:
+            vectors = as_float32_matrix(self.embed_fn(unique))
+            if len(vectors) != len(unique):
+                raise EmbeddingValidationError(f"{len(vectors)} vecteurs pour {len(unique)} textes")
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            for _, future, _ in pending:
+                future.set_exception(e)
+            return
+        if unique is not texts:
+            position = {text: i for i, text in enumerate(unique)}
+            vectors = vectors[[position[text] for text in texts]]
+        finished = time.perf_counter()
+
+        offset = 0
+        for item_texts, future, _ in pending:
+            # Un vecteur invalide n'échoue que la demande qui le contient
+            try:
+                future.set_result(validate_vectors(vectors[offset:offset + len(item_texts)]))
+            except EmbeddingValidationError as e:
+                future.set_exception(e)
+            offset += len(item_texts)
+
+        self._record(pending, len(texts), len(unique), dispatched, finished)
+
+    def _record(self, pending, size: int, unique: int, dispatched: float, finished: float):
+        with self._lock:
+            self.requests += len(pending)
+            self.texts += size
+            self.batches += 1
+            self.deduplicated += size - unique
+            self.max_batch_size = max(self.max_batch_size, size)
+            for limit, label in BATCH_SIZE_BUCKETS:
+                if limit is None or size <= limit:
+                    self.batch_sizes[label] += 1
+                    break
+            # Attente ajoutée : de la demande à l'envoi du lot
+            self.waits.extend(dispatched - submitted for _, _, submitted in pending)
+            del self.waits[:-1000]
+            self.call_times.append(finished - dispatched)
+            del self.call_times[:-1000]
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self.waits)
+            calls = self.call_times
+            return {
+                'requests': self.requests,
+                'texts': self.texts,
+                'batches': self.batches,
+                'avg_batch_size': round(self.texts / self.batches, 2) if self.batches else None,
+                'max_batch_size': self.max_batch_size,
+                'batch_sizes': {label: self.batch_sizes[label] for _, label in BATCH_SIZE_BUCKETS},
+                'deduplicated': self.deduplicated,
+                'errors': self.errors,
+                'wait_avg_ms': round(1000 * sum(waits) / len(waits), 2) if waits else None,
+                'wait_p50_ms': round(1000 * waits[len(waits) // 2], 2) if waits else None,
+                'wait_p95_ms': round(1000 * waits[int(len(waits) * 0.95)], 2) if waits else None,
+                'wait_max_ms': round(1000 * waits[-1], 2) if waits else None,
+                'embed_avg_ms': round(1000 * sum(calls) / len(calls), 2) if calls else None,
+            }
+
+
+def embedding_batch_stats() -> dict:
+    """Métriques de tous les regroupements du processus"""
+    with _batchers_lock:
+        batchers = list(_batchers.values())
+    return {batcher.name: batcher.stats() for batcher in batchers}
+
+
+class BatchedQueryEmbeddings(Embeddings):
+    """Embeddings dont les requêtes (embed_query) de tous les appelants sont regroupées
+
+    embed_documents (ingestion, chunks d'un scénario) est déjà un lot : appel direct.
+    """
+
+    def __init__(self, embeddings: Embeddings, name: str, max_batch: int = QUERY_BATCH_SIZE,
+                 max_wait_ms: float = QUERY_BATCH_WAIT_MS, workers: int = QUERY_BATCH_WORKERS):
+        self.embeddings = embeddings
+        self.batcher = MicroBatcher(embeddings.embed_documents, name, max_batch, max_wait_ms,
+                                    workers=workers, dedupe=True)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.batcher.submit([text]).result()[0]
+
+    async def aembed_documents(self, texts: List[str]) -> np.ndarray:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        # Aucun thread bloqué en attente : le Future est attendu dans la boucle d'événements
+        return (await asyncio.wrap_future(self.batcher.submit([text])))[0]
@@ -0,0 +1,201 @@
+"""Recherche fédérée : base de connaissances et scénarios déjà générés, interrogés en parallèle
+
+Les scénarios indexés dans scenarios_sifhr (voir /embed-scenario) servent de contexte à la
+génération au même titre que la base documentaire :
+1. la requête est embeddée une fois par modèle d'embedding (en parallèle s'il y en a plusieurs) ;
+2. chaque collection est interrogée en parallèle : la durée est celle de la plus lente ;
+3. les scores de chaque collection sont normalisés (min-max sur ses résultats), pondérés
+   par collection, puis fusionnés ; un quota par collection borne sa part du contexte.
+"""
+import os
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from chunking_embedding import EMBEDDING_PROVIDER, get_embedding_model
+from document_catalog import document_catalog
+from milvus_client import ahas_collection, asearch_batch, collection_fields, has_collection, search_batch
+from similarity_checker import SCENARIO_COLLECTION
+
+# Recherche fédérée activée (sinon base de connaissances seule)
+FEDERATED_SEARCH = os.getenv('SIFHR_FEDERATED_SEARCH', '1') == '1'
+# Poids et quota (documents au plus dans le contexte) de chaque collection
+KNOWLEDGE_WEIGHT = float(os.getenv('SIFHR_KNOWLEDGE_WEIGHT', 1.0))
+KNOWLEDGE_QUOTA = int(os.getenv('SIFHR_KNOWLEDGE_QUOTA', 4))
+SCENARIO_WEIGHT = float(os.getenv('SIFHR_SCENARIO_WEIGHT', 0.6))
+SCENARIO_QUOTA = int(os.getenv('SIFHR_SCENARIO_QUOTA', 2))
+# Résultats demandés à chaque collection avant la fusion
+FEDERATED_FETCH = int(os.getenv('SIFHR_FEDERATED_FETCH', 8))
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='sifhr-federated')
+
+
+class SearchSource:
+    """Collection interrogée par la recherche fédérée, avec son modèle d'embedding"""
+
+    def __init__(self, label: str, collection_name: str, embedding_model, weight: float, quota: int,
+                 output_fields: List[str], expr: str = '', filterable: bool = False):
+        self.label = label
+        self.collection_name = collection_name
+        self.embedding_model = embedding_model
+        self.weight = weight
+        self.quota = quota
+        self.output_fields = output_fields
+        self.expr = expr
+        # Champ theme présent : la source accepte les filtres de portée (themes.py)
+        self.filterable = filterable
+        self.available = False
+
+    def with_filter(self, expr: str) -> 'SearchSource':
+        if not self.filterable:
+            return self
+        source = SearchSource(self.label, self.collection_name, self.embedding_model, self.weight,
+                              self.quota, self.output_fields, expr, self.filterable)
+        source.available = self.available
+        return source
+
+    def to_documents(self, hits) -> List[Document]:
+        docs = []
+        for hit in hits:
+            metadata = dict(hit['entity'])
+            text = metadata.pop('text', '')
+            if 'title' in metadata and 'source' not in metadata:
+                metadata['source'] = f"Scénario : {metadata['title']}"
+            metadata.update(collection=self.label, score=float(hit['distance']))
+            docs.append(Document(page_content=text, metadata=metadata))
+        return docs
+
+    def search(self, vector) -> List[Document]:
+        # Collection créée au premier usage (scénarios) : vérifiée tant qu'elle n'a pas été vue
+        if not self.available:
+            self.available = has_collection(self.collection_name)
+            if not self.available:
+                return []
+        hits = search_batch(self.collection_name, [vector], limit=FEDERATED_FETCH,
+                            output_fields=self.output_fields, filter=self.expr)
+        if self.expr and not hits[0]:
+            # Rien dans les partitions visées : même recherche sur toute la collection
+            hits = search_batch(self.collection_name, [vector], limit=FEDERATED_FETCH,
+                                output_fields=self.output_fields)
+        return self.to_documents(hits[0])
+
+    async def asearch(self, vector) -> List[Document]:
+        if not self.available:
+            self.available = await ahas_collection(self.collection_name)
+            if not self.available:
+                return []
+        hits = await asearch_batch(self.collection_name, [vector], limit=FEDERATED_FETCH,
+                                   output_fields=self.output_fields, filter=self.expr)
+        if self.expr and not hits[0]:
+            hits = await asearch_batch(self.collection_name, [vector], limit=FEDERATED_FETCH,
+                                       output_fields=self.output_fields)
+        return self.to_documents(hits[0])
+
+
+def fuse(sources: List[SearchSource], results: List[List[Document]], k: int) -> List[Document]:
+    """Scores normalisés par collection et pondérés, quotas par collection, doublons de texte écartés"""
+    candidates = []
+    for source, docs in zip(sources, results):
+        if not docs:
+            continue
+        scores = [doc.metadata['score'] for doc in docs]
+        low, high = min(scores), max(scores)
+        for doc in docs:
+            normalized = (doc.metadata['score'] - low) / (high - low) if high > low else 1.0
+            doc.metadata['fused_score'] = round(source.weight * normalized, 4)
+            candidates.append((doc.metadata['fused_score'], doc.metadata['score'], source, doc))
+    candidates.sort(key=lambda c: (c[0], c[1]), reverse=True)
+
+    fused = []
+    taken = Counter()
+    seen = set()
+    for _, _, source, doc in candidates:
+        if len(fused) >= k:
+            break
+        if taken[source.label] >= source.quota or doc.page_content in seen:
+            continue
+        taken[source.label] += 1
+        seen.add(doc.page_content)
+        fused.append(doc)
+    return fused
+
+
+class FederatedRetriever(BaseRetriever):
+    """Retriever sur plusieurs collections interrogées en parallèle, résultats fusionnés"""
+
+    sources: List[Any]
+    k: int = KNOWLEDGE_QUOTA + SCENARIO_QUOTA
+    # Retriever non filtré utilisé si la recherche restreinte ne trouve rien
+    fallback: Optional[BaseRetriever] = None
+
+    def _models(self) -> Dict[int, Any]:
+        return {id(source.embedding_model): source.embedding_model for source in self.sources}
+
+    def scoped(self, expr: str) -> 'FederatedRetriever':
+        """Même recherche, filtre appliqué aux collections qui l'acceptent"""
+        return FederatedRetriever(sources=[source.with_filter(expr) for source in self.sources],
+                                  k=self.k, fallback=self)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # 1. Un embedding par modèle, 2. une recherche par collection, chaque étape en parallèle
+        models = self._models()
+        vector_futures = {key: _executor.submit(model.embed_query, query) for key, model in models.items()}
+        vectors = {key: future.result() for key, future in vector_futures.items()}
+        search_futures = [_executor.submit(source.search, vectors[id(source.embedding_model)])
+                          for source in self.sources]
+        results = []
+        for source, future in zip(self.sources, search_futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Recherche {source.label} en echec: {e}")
+                results.append([])
+
+        docs = fuse(self.sources, results, self.k)
+        if not docs and self.fallback is not None:
+            return self.fallback.invoke(query, config={"callbacks": run_manager.get_child()})
+        return document_catalog.join(docs)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        models = self._models()
+        embedded = await asyncio.gather(*(model.aembed_query(query) for model in models.values()))
+        vectors = dict(zip(models, embedded))
+        searched = await asyncio.gather(*(source.asearch(vectors[id(source.embedding_model)])
+                                          for source in self.sources), return_exceptions=True)
+        results = []
+        for source, result in zip(self.sources, searched):
+            if isinstance(result, BaseException):
+                print(f"Recherche {source.label} en echec: {result}")
+                result = []
+            results.append(result)
+
+        docs = fuse(self.sources, results, self.k)
+        if not docs and self.fallback is not None:
+            return await self.fallback.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        if document_catalog.is_cached(docs):
+            return document_catalog.join(docs)
+        return await asyncio.to_thread(document_catalog.join, docs)
+
+
+def create_federated_retriever(knowledge_collection: str, embedding_model, provider: Optional[str] = None):
+    """Base de connaissances (version en service) et scénarios générés ; None si Milvus est indisponible"""
+    fields = collection_fields(knowledge_collection)
+    if not fields:
+        return None
+
+    # Les scénarios sont embeddés avec le modèle par défaut : même instance si même fournisseur
+    scenario_model = embedding_model if (provider or EMBEDDING_PROVIDER) == EMBEDDING_PROVIDER else get_embedding_model()
+    knowledge_fields = [field for field in ("text", "doc_id", "theme", "source", "minio_path") if field in fields]
+    sources = [
+        SearchSource('connaissances', knowledge_collection, embedding_model, KNOWLEDGE_WEIGHT, KNOWLEDGE_QUOTA,
+                     knowledge_fields, filterable='theme' in fields),
+        SearchSource('scenarios', SCENARIO_COLLECTION, scenario_model, SCENARIO_WEIGHT, SCENARIO_QUOTA,
+                     ["text", "title", "chunk_index"]),
+    ]
+    return FederatedRetriever(sources=sources)
@@ -0,0 +1,167 @@
+"""Contrôle d'une génération de l'agent : échéance, annulation et sortie partielle
+
+Un GenerationControl est passé comme callback LangChain à l'agent ; il est propagé à
+l'outil RAG, au retriever multi-requêtes et aux appels LLM. À chaque début de chaîne,
+d'outil, de recherche et à chaque token streamé, il vérifie l'échéance et l'annulation
+et interrompt l'exécution en levant une exception (raise_error=True). Les tokens déjà
+reçus sont conservés pour renvoyer une sortie partielle.
+"""
+import os
+import time
+import asyncio
+import threading
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Échéance par défaut d'une génération (secondes, 0 = aucune)
+CHAT_DEADLINE = float(os.getenv('SIFHR_CHAT_DEADLINE', 600))
+# Intervalle de vérification de la déconnexion du client HTTP
+DISCONNECT_POLL_INTERVAL = float(os.getenv('SIFHR_DISCONNECT_POLL_INTERVAL', 0.5))
+
+
+class GenerationCancelled(Exception):
+    """Génération annulée par le client (message cancel ou déconnexion)"""
+
+
+class GenerationDeadlineExceeded(GenerationCancelled):
+    """Échéance de la génération dépassée"""
+
+
+class ClientDisconnected(GenerationCancelled):
+    """Client HTTP déconnecté avant la fin de la génération"""
+
+
+class GenerationControl(BaseCallbackHandler):
+    """Callback qui interrompt l'agent à l'échéance ou dès que la génération est annulée
+
+    raise_error=True : l'exception remonte au lieu d'être journalisée par LangChain.
+    Avec un LLM en streaming, la vérification a lieu à chaque token, ce qui ferme le
+    flux HTTP du modèle ; arun_with_control annule en plus la tâche de génération dans
+    la boucle d'événements, sans attendre le prochain callback.
+    run_inline=True : sur le chemin async, la vérification s'exécute dans la boucle
+    d'événements au lieu d'être déportée dans un thread.
+    """
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, timeout: Optional[float] = None,
+                 cancel_event: Optional[threading.Event] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.cancel_event = cancel_event or threading.Event()
+        self._tokens: Dict[UUID, List[str]] = {}
+        self._lock = threading.Lock()
+        self._partial_builder: Optional[Callable[[], str]] = None
+
+    def remaining(self) -> Optional[float]:
+        """Secondes restantes avant l'échéance (None si aucune)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check(self):
+        if self.cancel_event.is_set():
+            raise GenerationCancelled("Generation annulee")
+        if self.expired:
+            self.cancel_event.set()
+            raise GenerationDeadlineExceeded("Echeance de la generation depassee")
+
+    def set_partial_builder(self, builder: Callable[[], str]):
+        """Générations en plusieurs appels (mode sections) : fonction qui assemble la sortie partielle"""
+        self._partial_builder = builder
+
+    @property
+    def partial_output(self) -> str:
+        """Texte du plus long appel LLM streamé (le scénario en cours de génération)
+
+        Si un builder est enregistré, lui seul fait foi : '' tant qu'il n'a rien
+        d'assemblable, sans retomber sur les tokens bruts (plan JSON, reformulations).
+        """
+        if self._partial_builder is not None:
+            return self._partial_builder()
+        with self._lock:
+            runs = [''.join(tokens) for tokens in self._tokens.values()]
+        return max(runs, key=len, default='')
+
+    def on_llm_start(self, *args, **kwargs):
+        self.check()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID = None, **kwargs):
+        if isinstance(token, str) and token:
+            with self._lock:
+                self._tokens.setdefault(run_id, []).append(token)
+        self.check()
+
+    def on_chain_start(self, *args, **kwargs):
+        self.check()
+
+    def on_tool_start(self, *args, **kwargs):
+        self.check()
+
+    def on_retriever_start(self, *args, **kwargs):
+        self.check()
+
+
+async def arun_with_control(awaitable: Awaitable, control: GenerationControl,
+                            is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None):
+    """Exécuter une génération sous contrôle d'échéance et de déconnexion
+
+    La génération est une tâche de la boucle d'événements. À l'échéance ou à la déconnexion, la tâche est annulée : l'annulation traverse l'agent,
+    le retriever et le client HTTP du LLM (flux fermé), sans thread à attendre.
+    """
+    task = asyncio.ensure_future(awaitable)
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    try:
+        while True:
+            timeout = DISCONNECT_POLL_INTERVAL
+            remaining = control.remaining()
+            if remaining is not None:
+                timeout = min(timeout, remaining)
+
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if done:
+                return task.result()
+            if control.expired:
+                control.cancel()
+                task.cancel()
+                raise GenerationDeadlineExceeded("Echeance de la generation depassee")
+            if is_disconnected is not None and await is_disconnected():
+                control.cancel()
+                task.cancel()
+                raise ClientDisconnected("Client deconnecte")
+    except asyncio.CancelledError:
+        control.cancel()
+        task.cancel()
+        raise
+
+
+async def aiter_with_deadline(aiterable: AsyncIterable, control: GenerationControl) -> AsyncIterator:
+    """Itérer un flux async en bornant chaque attente par le temps restant du contrôle
+
+    Les callbacks ne vérifient l'échéance qu'au début d'une étape ou à chaque token : une
+    étape bloquée (recherche Milvus, appel sans réponse) est ici annulée à l'échéance.
+    """
+    iterator = aiterable.__aiter__()
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(iterator.__anext__(), timeout=control.remaining())
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                control.cancel()
+                raise GenerationDeadlineExceeded("Echeance de la generation depassee")
+            yield item
+    finally:
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            await aclose()
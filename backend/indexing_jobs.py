@@ -0,0 +1,100 @@
+"""Indexation des scénarios générés en arrière-plan (chunking, embedding, insertion Milvus)"""
+import os
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from chunking_embedding import chunk_and_embed_document
+from similarity_checker import similarity_checker, SCENARIO_COLLECTION
+
+# Jobs d'indexation simultanés (limite la pression sur l'API d'embedding et Milvus)
+EMBED_WORKERS = int(os.getenv('SIFHR_EMBED_WORKERS', 2))
+# Nombre de jobs dont l'état est conservé
+JOB_HISTORY = 500
+
+_executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix='sifhr-embed')
+_jobs_lock = threading.Lock()
+
+# job_id -> état du job
+embedding_jobs: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def _update_job(job_id: str, **fields):
+    with _jobs_lock:
+        job = embedding_jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+
+def _run_indexing_job(job_id: str, content: str, title: str, force_embed: bool):
+    """Exécution du job : vérification de similarité (si demandée) puis indexation"""
+    try:
+        if not force_embed:
+            _update_job(job_id, status='checking')
+            similarity_result = similarity_checker.check_scenario_similarity(content)
+            if similarity_result['has_duplicates']:
+                _update_job(job_id, status='duplicate', similarity_info=similarity_result,
+                            finished_at=str(datetime.now()))
+                print(f"Job {job_id}: scenario similaire detecte, indexation annulee")
+                return
+
+        _update_job(job_id, status='embedding')
+        result = chunk_and_embed_document(
+            content=content,
+            doc_name=title,
+            metadata={
+                'title': title,
+                'type': 'scenario_generated',
+                'source': 'sifhr_ai',
+                'embedding_date': str(datetime.now())
+            },
+            collection_name=SCENARIO_COLLECTION
+        )
+
+        if result['success']:
+            _update_job(job_id, status='done', embedded=True,
+                        chunks_created=result.get('chunks_count', 0),
+                        embeddings_created=result.get('embeddings_count', 0),
+                        finished_at=str(datetime.now()))
+        else:
+            _update_job(job_id, status='failed', error=result.get('error', 'Erreur inconnue'),
+                        finished_at=str(datetime.now()))
+
+    except Exception as e:
+        print(f"Job {job_id}: erreur d'indexation: {e}")
+        _update_job(job_id, status='failed', error=str(e), finished_at=str(datetime.now()))
+
+
+def submit_scenario_indexing(content: str, title: str, force_embed: bool = False) -> str:
+    """Planifier l'indexation d'un scénario et retourner immédiatement l'identifiant du job"""
+    job_id = str(uuid.uuid4())
+    with _jobs_lock:
+        embedding_jobs[job_id] = {
+            'job_id': job_id,
+            'scenario_title': title,
+            'status': 'queued',
+            'embedded': False,
+            'force_embed': force_embed,
+            'created_at': str(datetime.now()),
+            'finished_at': None,
+        }
+        while len(embedding_jobs) > JOB_HISTORY:
+            embedding_jobs.popitem(last=False)
+
+    _executor.submit(_run_indexing_job, job_id, content, title, force_embed)
+    return job_id
+
+
+def get_indexing_job(job_id: str) -> Optional[dict]:
+    """Retourner une copie de l'état d'un job d'indexation"""
+    with _jobs_lock:
+        job = embedding_jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+
+def shutdown_indexing_jobs():
+    """Arrêter le pool d'indexation en laissant finir les jobs en cours"""
+    _executor.shutdown(wait=False, cancel_futures=True)
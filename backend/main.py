@@ -3,254 +3,14 @@ import os
 if sys.platform.startswith('win'):
     os.environ['PYTHONIOENCODING'] = 'utf-8'
 
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain.tools import Tool
-from langchain_core.prompts import PromptTemplate as CorePromptTemplate
-from chunking_embedding import get_embedding_model
-from multi_query_retriever import get_llm, create_vectorstore_retriever, get_multi_query_retriever
+from rag_engine import engine, create_agentic_rag_system, GENERATION_MODES, GENERATION_MODE
+from scenario_prompts import prompt_cache_metrics
+from generation_control import (CHAT_DEADLINE, ClientDisconnected, GenerationCancelled,
+                                GenerationControl, GenerationDeadlineExceeded, aiter_with_deadline,
+                                arun_with_control)
 from datetime import datetime
 
 
-class RAGTool:
-    """Outil RAG pour scénarios immersifs"""
-
-    def __init__(self):
-        print(" Initialisation de l'outil RAG...")
-
-        # Initialisation des composants RAG
-        self.embedding_model = get_embedding_model()
-        self.llm = get_llm()
-
-        # Créer le retriever
-        collection_name = "data_sifhr"
-        retriever = create_vectorstore_retriever(collection_name, self.embedding_model)
-        self.retriever = get_multi_query_retriever(self.llm, retriever)
-#PROMPT *****
-        # Prompt dynamique enrichi pour scénarios immersifs de 15+ pages
-        prompt_prefix = """Tu es un maître de jeu expert spécialisé dans la création de scénarios immersifs 
-inspirés de l'histoire authentique, des légendes et des civilisations arabo-musulmanes. 
-Ton objectif est de créer des épopées de chasse au trésor exceptionnellement détaillées, captivantes et riches.
-
-EXIGENCE DE LONGUEUR CRITIQUE :
-**TON SCÉNARIO DOIT FAIRE AU MINIMUM 15 PAGES IMPRIMÉES** (environ 8000-10000 mots)
-- Développe chaque section en profondeur avec des détails exhaustifs
-- Ne résume JAMAIS, développe toujours plus en détail
-- Écris des descriptions longues et immersives pour chaque lieu, personnage, objet
-- Multiplie les sous-sections, les détails historiques, les dialogues étendus
-
- STYLE NARRATIF EXIGÉ :
-- Adopte un ton évocateur et poétique, digne des Mille et Une Nuits
-- Utilise des métaphores orientales et des descriptions sensorielles (parfums, sons, textures)
-- Intègre des éléments culturels authentiques (architecture, arts, sciences, philosophie)
-- Crée une atmosphère mystique et majestueuse
-
- STRUCTURE OBLIGATOIRE DU SCÉNARIO ÉTENDU :
-1. **PROLOGUE IMMERSIF** (2-3 pages) : Contexte historique détaillé avec descriptions de l'époque, des lieux, de l'atmosphère
-2. **7-10 ACTES DÉTAILLÉS** : Chaque acte doit faire 1-2 pages minimum avec défis progressifs complexes
-3. **ÉNIGMES CULTURELLES MULTIPLES** : 3-5 énigmes par acte basées sur l'histoire, la géographie, l'art islamique
-4. **PERSONNAGES HISTORIQUES DÉVELOPPÉS** : Biographies, motivations, dialogues pour califes, érudits, poètes, marchands
-5. **LIEUX EMBLÉMATIQUES DÉTAILLÉS** : Descriptions architecturales complètes de palais, mosquées, marchés, bibliothèques
-6. **TRÉSORS MULTIPLES** : Plusieurs trésors intermédiaires avant le trésor final
-7. **ÉLÉMENTS D'AMBIANCE ÉTENDUS** : Descriptions de musique, parfums, lumières, matériaux sur plusieurs paragraphes
-
- EXIGENCES DE CONTENU :
-- Utilise EXCLUSIVEMENT les informations du contexte documentaire
-- Enrichis avec des détails architecturaux précis (mouqarnas, zelliges, calligraphies)
-- Intègre les sciences et arts de l'époque (astronomie, médecine, poésie, musique)
-- Mentionne les routes commerciales, les épices, les tissus, les manuscrits
-- Inclus des références aux dynasties, califats et personnages historiques réels
-
-NIVEAU DE DÉTAIL ATTENDU :
-- Descriptions de 2-3 phrases minimum pour chaque lieu
-- Contexte historique précis pour chaque époque mentionnée  
-- Explications des symboles, objets et références culturelles
-- Dialogues en style oriental pour les PNJ rencontrés
-- Défis intellectuels basés sur les connaissances de l'époque
-
- FLUIDITÉ NARRATIVE :
-- Relie les actes entre eux par des transitions naturelles, comme dans une épopée.
-- Insère des dialogues courts et évocateurs pour rendre vivants les personnages.
-- Varie le rythme entre descriptions poétiques et moments d’action.
-- Utilise un vocabulaire riche mais fluide, évitant les répétitions.
-
- IMMERSION SENSORIELLE :
-- Chaque acte doit comporter au moins un élément sensoriel : 
-  - Vue (architecture, couleurs, lumière)
-  - Son (chants, cliquetis, bruits de marché)
-  - Odeur (épices, encens, cuir)
-  - Toucher (textures des tapis, marbre, manuscrits)
-  - Goût (mets, fruits, boissons)
-
-RÈGLES STRICTES :
-- Si une information n'existe pas dans le contexte : "Cette information n'est pas disponible dans les sources consultées"
-- Jamais d'invention pure, toujours basé sur les documents fournis
-- Respecter la véracité historique tout en créant l'émerveillement
-- Éviter les anachronismes et les clichés orientalistes
-- INTERDICTION ABSOLUE : N'utilise AUCUN emoji, symbole Unicode ou caractère spécial (🏺📚🌙🏛️⭐💎 etc.)
-- Utilise UNIQUEMENT du texte ASCII standard avec accents français acceptés
-- Remplace tout symbole par du texte : "[TRESOR]" au lieu de 🏺, "[MOSQUEE]" au lieu de 🕌
-"""
-
-        prompt_suffix = """
- CONTEXTE DOCUMENTAIRE DISPONIBLE :
-{context}
-
- DEMANDE DU JOUEUR : 
-{question}
-
-CREEZ UNE EPOPEE IMMERSIVE DE 15+ PAGES :
-Basez-vous uniquement sur le contexte documentaire ci-dessus pour créer une épopée de chasse au trésor 
-exceptionnellement longue et détaillée suivant toutes les exigences mentionnées. 
-
-**IMPÉRATIF DE LONGUEUR** : Votre réponse doit être suffisamment longue pour remplir AU MINIMUM 15 pages imprimées.
-Structurez votre réponse avec des titres clairs, des descriptions très riches et une progression narrative 
-captivante sur plusieurs pages. Développez massivement chaque section :
-
-CHECKLIST OBLIGATOIRE :
-- [ ] Prologue de 2-3 pages avec contexte historique approfondi
-- [ ] 7-10 actes de 1-2 pages chacun avec défis détaillés
-- [ ] Descriptions architecturales complètes de chaque lieu
-- [ ] Biographies développées de tous les personnages historiques
-- [ ] Énigmes multiples avec explications culturelles étendues
-- [ ] Dialogues longs et authentiques pour tous les PNJ
-- [ ] Descriptions sensorielles sur plusieurs paragraphes
-- [ ] Trésor final avec signification historique approfondie
-- [ ] Épilogue développé sur 1-2 pages
-
-SCÉNARIO ÉPIQUE COMPLET DE 15+ PAGES :
-"""
-
-        GAME_PROMPT = PromptTemplate(
-            template=prompt_prefix + prompt_suffix,
-            input_variables=["context", "question"]
-        )
-
-        # Créer la chaîne QA
-        self.qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=self.retriever,
-            return_source_documents=True,
-            chain_type_kwargs={"prompt": GAME_PROMPT}
-        )
-
-        print(" Outil RAG initialisé!")
-
-    def search_documents(self, query: str) -> str:
-        """
-        Recherche dans la base de documents et retourne une réponse
-        """
-        try:
-            print(f" Recherche RAG pour: {query}")
-
-            # Obtenir la réponse du système RAG
-            result = self.qa_chain.invoke({"query": query})
-
-            # Formater la réponse avec les sources
-            response = result['result']
-
-            if result.get('source_documents'):
-                response += f"\n\n Sources ({len(result['source_documents'])} documents):"
-                for i, doc in enumerate(result['source_documents'][:3], 1):
-                    source = doc.metadata.get('source', 'Inconnu')
-                    minio_path = doc.metadata.get('minio_path', '')
-                    if minio_path:
-                        response += f"\n   {i}. {source} ( {minio_path})"
-                    else:
-                        response += f"\n   {i}. {source}"
-
-            return response
-
-        except Exception as e:
-            return f" Erreur lors de la recherche: {str(e)}"
-
-
-def create_agentic_rag_system():
-    """Créer le système RAG agentique complet"""
-
-    print("\n" + "=" * 80)
-    print("SYSTEME RAG AGENTIQUE - INITIALISATION")
-    print("=" * 80)
-
-    # Initialiser l'outil RAG
-    rag_tool = RAGTool()
-
-    # Créer l'outil pour l'agent
-    tools = [
-        Tool(
-            name="search_documents",
-            description="""OUTIL OBLIGATOIRE - Recherche dans la base de connaissances spécialisée.
-            Tu DOIS utiliser cet outil pour TOUTES les questions liées à:
-            - La civilisation arabo-musulmane (histoire, culture, personnages)
-            - La création de scénarios immersifs et chasse au trésor
-            - Les palais, architectures, trésors, légendes orientales
-            - SIFHR ou tout autre sujet de la base
-            Input: question reformulée pour optimiser la recherche""",
-            func=rag_tool.search_documents
-        )
-    ]
-
-    # Template de prompt ReAct personnalisé optimisé pour retourner le scénario complet
-    template = '''Tu es un maître narratif spécialisé dans la civilisation arabo-musulmane et les scénarios de chasse au trésor.
-
-Tu as accès aux outils suivants:
-{tools}
-
-RÈGLE ABSOLUE: Tu DOIS TOUJOURS utiliser l'outil "search_documents" (de [{tool_names}]) pour:
-- Toute question sur l'histoire, la culture ou les légendes arabo-musulmanes
-- La création de scénarios immersifs ou de chasse au trésor
-- Les questions sur les palais, trésors, architectures, personnages historiques
-- Les éléments narratifs pour des jeux immersifs
-- SIFHR ou tout autre sujet documenté dans la base
-
-Format de raisonnement OBLIGATOIRE:
-
-Question: la question d'entrée à laquelle tu dois répondre
-Thought: J'analyse la question et je DOIS chercher dans la base de connaissances
-Action: search_documents
-Action Input: [reformulation précise de la question pour la recherche]
-Observation: [résultat de la recherche dans la base]
-Thought: Je vais maintenant extraire le scénario complet de l'Observation et le présenter comme Final Answer
-Final Answer: [EXTRAIRE ET PRÉSENTER UNIQUEMENT LE SCÉNARIO COMPLET de l'Observation, SANS les sources ni métadonnées]
-
-RÈGLES CRITIQUES pour Final Answer:
-- COPIER INTÉGRALEMENT le scénario complet depuis l'Observation
-- Ne PAS inclure la section "Sources (X documents)" dans Final Answer
-- Ne PAS résumer, COPIER le scénario complet tel quel
-- Commencer Final Answer directement par le titre du scénario (# ou ##)
-- Inclure TOUS les détails: prologue, actes, énigmes, personnages, lieux
-- Si l'Observation contient "# Titre du scénario", Final Answer doit commencer par "# Titre du scénario"
-
-Commence!
-
-Question: {input}
-Thought:{agent_scratchpad}'''
-
-    prompt = CorePromptTemplate.from_template(template)
-
-    # Obtenir le modèle LLM
-    llm = get_llm()
-
-    # Créer l'agent ReAct
-    agent = create_react_agent(llm, tools, prompt)
-
-    # Créer l'exécuteur d'agent avec paramètres originaux
-    agent_executor = AgentExecutor(
-        agent=agent,
-        tools=tools,
-        verbose=True,
-        handle_parsing_errors=True,
-        max_iterations=6,   # Version originale
-        # max_execution_time=60,  # Pas de timeout pour version complète
-        return_intermediate_steps=True
-    )
-
-    print("Système RAG agentique initialisé avec succès!")
-    return agent_executor
-
-
 def main():
     """Système interactif pour jeu immersif arabo-musulman"""
 
@@ -323,15 +83,30 @@ def main():
 
 
 # API FastAPI pour connecter avec le frontend
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import uuid
+import json
+import time
+import asyncio
 import uvicorn
 from typing import List, Optional, Dict
-from similarity_checker import similarity_checker
-from pdf_converter import pdf_converter
+from similarity_checker import similarity_checker, minhash_signature
+from indexing_jobs import submit_scenario_indexing, get_indexing_job, shutdown_indexing_jobs
+from pdf_converter import pdf_converter, iter_file_chunks, remove_file
+from single_flight import SingleFlight, flight_key
+from scenario_store import VersionConflict, scenario_store
+from section_editing import SectionNotFound, aregenerate_section, split_sections
+from pdf_batch import PDF_BATCH_MAX, create_batch, get_batch_progress, stream_pdf_batch, shutdown_process_pool
+from reindex import submit_reindex, get_reindex_job, list_versions, activate_version, running_job
+from chunking_embedding import EMBEDDING_PROVIDERS
+from embedding_batcher import embedding_batch_stats
+from milvus_client import KNOWLEDGE_COLLECTION, live_alias, resolve_collection
+from main_websocket import router as websocket_router, session_store, ws_stats, WS_PER_MESSAGE_DEFLATE
 import base64
 from contextlib import asynccontextmanager
 
@@ -340,15 +115,33 @@ from contextlib import asynccontextmanager
 class ChatMessage(BaseModel):
     message: str
     session_id: Optional[str] = None
+    timeout: Optional[float] = None  # Échéance en secondes (plafonnée par SIFHR_CHAT_DEADLINE)
+    mode: Optional[str] = None  # "agent" (défaut) ou "sections" : plan puis sections en parallèle
 
 class ChatResponse(BaseModel):
     session_id: str
     response: str
     sources: List[dict] = []
+    partial: bool = False  # True : échéance atteinte, scénario incomplet
+    scenario_id: Optional[str] = None  # Scénario stocké (édition par section)
 
 class SimilarityCheckRequest(BaseModel):
     scenario_content: str
     scenario_title: str
+    include_pdf: bool = True  # False : récupérer le PDF via /export/pdf (sans base64)
+
+class PdfExportRequest(BaseModel):
+    scenario_content: str
+    scenario_title: str
+    stream: bool = False  # True : réponse chunked (StreamingResponse) au lieu de FileResponse
+
+class PdfBatchItem(BaseModel):
+    scenario_title: str
+    scenario_content: str
+
+class PdfBatchRequest(BaseModel):
+    scenarios: List[PdfBatchItem]
+    batch_id: Optional[str] = None
 
 class SimilarityResult(BaseModel):
     has_duplicates: bool
@@ -365,27 +158,41 @@ class EmbedRequest(BaseModel):
     scenario_title: str
     force_embed: bool = False
 
-# Instance globale de l'agent RAG
-global_agent = None
+class ReindexRequest(BaseModel):
+    provider: Optional[str] = None  # Fournisseur d'embedding de la nouvelle version (mistral, local)
+
+class ScenarioCreateRequest(BaseModel):
+    scenario_title: str
+    scenario_content: str
+
+class SectionEditRequest(BaseModel):
+    section: str  # Titre de la section ciblée, par exemple "## Acte 2"
+    instructions: Optional[str] = None  # Consignes de modification ; absent : régénération
+    timeout: Optional[float] = None
+
+# Générations /chat en cours, partagées entre requêtes identiques simultanées
+chat_flights = SingleFlight()
 
 async def startup_event():
-    """Initialiser le système RAG agentique au démarrage"""
-    global global_agent
+    """Initialiser le système RAG agentique (partagé par /chat et /ws) au démarrage"""
     try:
         print("Initialisation du système RAG agentique...")
-        global_agent = create_agentic_rag_system()
+        await engine.start()
         print("Système RAG agentique initialisé avec succès!")
     except Exception as e:
         print(f"Erreur lors de l'initialisation du système RAG agentique: {e}")
-        global_agent = None
+        engine.stop()
 
-# Configuration du lifespan
+# Configuration du lifespan : un seul cycle de vie pour les routes REST et WebSocket
 @asynccontextmanager
 async def lifespan(app):
     # Startup
     await startup_event()
     yield
-    # Shutdown (rien à faire pour l'instant)
+    # Shutdown : annuler les générations WebSocket en cours, puis les pools
+    session_store.cancel_all()
+    shutdown_process_pool()
+    shutdown_indexing_jobs()
 
 app = FastAPI(title="SIFHR RAG API", version="1.0.0", lifespan=lifespan)
 
@@ -398,33 +205,238 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Route WebSocket /ws (streaming, reprise, annulation) sur le même agent
+app.include_router(websocket_router)
+
 @app.get("/health")
 async def health_check():
     """Point de santé de l'API"""
     return {
         "status": "healthy", 
         "message": "SIFHR RAG API is running",
-        "agent_status": "initialized" if global_agent else "not_initialized"
+        "agent_status": "initialized" if engine.ready else "not_initialized",
+        "websocket": ws_stats()
     }
 
 @app.post("/init-agent")
 async def initialize_agent():
     """Forcer l'initialisation du système RAG agentique"""
-    global global_agent
     try:
         print("Initialisation forcee du système RAG agentique...")
-        global_agent = create_agentic_rag_system()
+        await engine.start()
         print("Système RAG agentique initialise avec succes!")
         return {"status": "success", "message": "Système RAG agentique initialise", "agent_ready": True}
     except Exception as e:
         print(f"Erreur initialisation: {e}")
         return {"status": "error", "message": str(e), "agent_ready": False}
 
+async def generate_chat_response(message: str, control: GenerationControl, mode: str = "agent") -> dict:
+    """Générer un scénario avec l'agent et extraire la réponse (partagée par les requêtes coalescées)"""
+    
+    partial = False
+    callbacks = [control, prompt_cache_metrics]
+    
+    # Invoquer l'agent RAG agentique (ou le mode sections) en async, sans thread
+    try:
+        if mode == "sections":
+            rag_tool = engine.rag_tool
+            sectioned = await arun_with_control(
+                rag_tool.agenerate_sectioned_scenario(message, callbacks=callbacks),
+                control
+            )
+            result = {"output": sectioned['text'], "intermediate_steps": [], "sources": sectioned['sources']}
+        else:
+            result = await arun_with_control(
+                engine.agent.ainvoke({"input": message}, config={"callbacks": callbacks}),
+                control
+            )
+    except GenerationDeadlineExceeded:
+        # Échéance dépassée : renvoyer ce qui a été généré jusque-là
+        if not control.partial_output:
+            raise
+        print(f"Echeance depassee: sortie partielle ({len(control.partial_output)} caracteres)")
+        result = {"output": control.partial_output, "intermediate_steps": []}
+        partial = True
+    
+    # NOUVELLE APPROCHE: Extraire DIRECTEMENT depuis les intermediate_steps
+    response_text = ""
+    sources = []
+    sources_found = []
+    
+    print(f"\n=== AGENT RESULT DEBUG ===")
+    print(f"Agent output length: {len(result.get('output', ''))}")
+    print(f"Intermediate steps count: {len(result.get('intermediate_steps', []))}")
+    if result.get('output'):
+        print(f"Output preview: {result.get('output', '')[:200]}...")
+    print("=========================")
+    
+    # Priorité 1: Chercher le scénario dans intermediate_steps (plus fiable)
+    if 'intermediate_steps' in result:
+        for i, step in enumerate(result['intermediate_steps']):
+            if len(step) > 1:
+                step_result = str(step[1])
+                
+                # Nettoyer IMMÉDIATEMENT tout le contenu dès l'extraction
+                import re
+                clean_content = re.sub(r'\x1b\[[0-9;]*m', '', step_result)
+                # Supprimer TOUS les emojis dès maintenant
+                clean_content = re.sub(r'[^\x00-\x7F]+', ' ', clean_content)
+                clean_content = re.sub(r'[\U0001F300-\U0001F9FF\U00002700-\U000027BF]', '', clean_content)
+                
+                try:
+                    print(f"Step {i}: longueur={len(clean_content)}, contient #={clean_content.count('#')}, contient Sources={'1' if ' Sources (' in clean_content else '0'}")
+                except:
+                    print(f"Step {i}: debug info [encoding safe]")
+                
+                # Si cette étape contient un scénario (titre avec #)
+                if '# ' in clean_content and len(clean_content) > 500:
+                    # Séparer le scénario des sources si nécessaire
+                    if ' Sources (' in clean_content:
+                        scenario_end = clean_content.find(' Sources (')
+                        scenario_content = clean_content[:scenario_end].strip()
+                    else:
+                        scenario_content = clean_content.strip()
+                    
+                    # Le contenu est déjà nettoyé plus haut
+                    clean_scenario = scenario_content
+                    
+                    # Garder le plus long scénario trouvé
+                    if len(clean_scenario) > len(response_text):
+                        response_text = clean_scenario
+                        try:
+                            print(f"Scénario extrait (longueur: {len(response_text)})")
+                        except:
+                            print("Scénario extrait [encoding safe]")
+    
+    # Priorité 2: Utiliser l'output de l'agent si pas de scénario dans les étapes
+    if len(response_text) < 300:
+        agent_output = result.get('output', '')
+        if len(agent_output) > len(response_text):
+            response_text = agent_output
+            print(f"Utilisation de l'output agent (longueur: {len(response_text)})")
+    
+    # Priorité 3: Si toujours pas de contenu, utiliser fallback RAG direct (sauf après l'échéance)
+    if not partial and (len(response_text) < 300 or response_text.startswith('Agent stopped') or 'Sources (' in response_text[:200]):
+        print("FALLBACK: Utilisation du RAG direct...")
+        
+        # Utiliser directement le RAG tool existant
+        try:
+            # Accéder au RAG tool depuis l'agent
+            for tool in engine.agent.tools:
+                if tool.name == "search_documents":
+                    direct_response = await arun_with_control(
+                        tool.coroutine(message, callbacks=callbacks),
+                        control
+                    )
+                    if ' Sources (' in direct_response:
+                        # Séparer scénario et sources
+                        parts = direct_response.split(' Sources (', 1)
+                        response_text = parts[0].strip()
+                    else:
+                        response_text = direct_response
+                    print(f"Fallback RAG réussi (longueur: {len(response_text)})")
+                    break
+        except GenerationDeadlineExceeded:
+            response_text = control.partial_output or "Echeance depassee pendant la generation du scenario. Veuillez reessayer."
+            partial = bool(control.partial_output)
+        except Exception as e:
+            print(f"Erreur fallback RAG: {e}")
+            response_text = "Erreur lors de la génération du scénario. Veuillez réessayer."
+    
+    # Extraction simple des sources (optionnel)
+    try:
+        if 'intermediate_steps' in result:
+            for step in result['intermediate_steps']:
+                if len(step) > 1:
+                    step_result = str(step[1])
+                    if ' Sources (' in step_result:
+                        # Parser basique des sources pour le frontend
+                        sources_start = step_result.find(' Sources (')
+                        if sources_start != -1:
+                            sources_section = step_result[sources_start:]
+                            # Simple comptage pour l'information
+                            source_count = sources_section.count('.doc')
+                            if source_count > 0:
+                                sources = [{'name': f'Document {i+1}', 'path': 'minio://...'} for i in range(min(source_count, 5))]
+                        break
+    except Exception as e:
+        print(f"Erreur extraction sources: {e}")
+        sources = []
+    
+    # Mode sections : documents de la recherche partagée
+    if result.get('sources'):
+        sources = result['sources']
+    
+    # Nettoyer spécifiquement les emojis problématiques pour l'encodage Windows
+    import re
+    
+    # Supprimer TOUS les emojis Unicode de façon plus agressive
+    emoji_pattern = re.compile(r'[\U0001F300-\U0001F9FF\U00002700-\U000027BF\U0001f018-\U0001f270\U00002600-\U000026FF\U00002000-\U0000206F\U0001F1E0-\U0001F1FF\U0001F600-\U0001F64F\U0001F680-\U0001F6FF\U0001F700-\U0001F77F\U0001F780-\U0001F7FF\U0001F800-\U0001F8FF\U0001F900-\U0001F9FF\U0001FA00-\U0001FA6F\U0001FA70-\U0001FAFF\U00002190-\U000021FF\U00002B00-\U00002BFF\U00003000-\U0000303F\U0000FE00-\U0000FE0F]')
+    response_text = emoji_pattern.sub('', response_text)
+    
+    # Supprimer aussi les emojis les plus courants individuellement
+    common_emojis = ['🌙', '📜', '🏛️', '🕌', '🏺', '📚', '🔍', '⭐', '🌟', '💎', '🗝️', '🔥', '💫', '🎭', '🎯']
+    for emoji in common_emojis:
+        response_text = response_text.replace(emoji, '')
+    
+    # Supprimer les caractères de contrôle problématiques
+    response_text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F]', '', response_text)
+    
+    # Nettoyer les codes ANSI
+    response_text = re.sub(r'\x1b\[[0-9;]*m', '', response_text)
+    
+    # Remplacer les caractères problématiques par des alternatives ASCII
+    response_text = response_text.replace('"', '"').replace('"', '"')
+    response_text = response_text.replace(''', "'").replace(''', "'")
+    response_text = response_text.replace('–', '-').replace('—', '-')
+    
+    # Safe printing pour éviter les erreurs d'encodage
+    try:
+        print(f"=== RESULTAT FINAL ===")
+        print(f"Longueur reponse: {len(response_text)} caracteres")
+        print(f"Sources: {len(sources)} documents")
+    except UnicodeEncodeError:
+        print("=== RESULTAT FINAL ===")
+        print(f"Longueur reponse: {len(response_text)} caracteres")
+        print(f"Sources: {len(sources)} documents")
+    
+    # Vérification finale - ne JAMAIS retourner juste des sources
+    if not partial and (not response_text or len(response_text) < 100 or response_text.strip().startswith('Sources (')):
+        response_text = "# SCENARIO DE DEMONSTRATION\n\nErreur temporaire. Le systeme a genere du contenu mais il y a eu un probleme d'extraction. Veuillez reessayer."
+    
+    # Stocker le scénario complet pour permettre l'édition section par section
+    scenario_id = None
+    if not partial and response_text.lstrip().startswith('#') and 'SCENARIO DE DEMONSTRATION' not in response_text[:40]:
+        stored = await run_in_threadpool(
+            scenario_store.create, extract_scenario_title(response_text, message), response_text,
+            {'prompt': message, 'mode': mode}
+        )
+        scenario_id = stored['scenario_id']
+    
+    return {"response": response_text, "sources": sources, "partial": partial, "scenario_id": scenario_id}
+
+def extract_scenario_title(content: str, fallback: str) -> str:
+    """Titre du scénario : premier titre markdown, sinon le début de la demande"""
+    for line in content.splitlines():
+        if line.startswith('#'):
+            return line.lstrip('#').strip().replace('*', '') or fallback[:80]
+    return fallback[:80]
+
+def resolve_timeout(requested: Optional[float]) -> float:
+    """Échéance demandée par le client, plafonnée par SIFHR_CHAT_DEADLINE"""
+    if not requested:
+        return CHAT_DEADLINE
+    return min(requested, CHAT_DEADLINE) if CHAT_DEADLINE else requested
+
+def sse_event(event: str, data: dict) -> str:
+    """Événement Server-Sent Events (une ligne data JSON)"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(chat_message: ChatMessage):
+async def chat_endpoint(chat_message: ChatMessage, request: Request):
     """Point d'entrée principal pour le chat avec génération de scénarios SIFHR agentique"""
     
-    if not global_agent:
+    if not engine.ready:
         raise HTTPException(
             status_code=503,
             detail="Système RAG agentique non initialisé. Veuillez réessayer plus tard."
@@ -433,152 +445,28 @@ async def chat_endpoint(chat_message: ChatMessage):
     # Générer un ID de session si non fourni
     session_id = chat_message.session_id or str(uuid.uuid4())
     
+    # Échéance propagée à l'agent, au retriever et aux appels LLM via les callbacks
+    timeout = resolve_timeout(chat_message.timeout)
+    
+    mode = chat_message.mode or GENERATION_MODE
+    if mode not in GENERATION_MODES:
+        raise HTTPException(status_code=400, detail=f"Mode inconnu: {mode} (valeurs: {', '.join(GENERATION_MODES)})")
+    
     try:
-        # Invoquer l'agent RAG agentique
-        result = global_agent.invoke({"input": chat_message.message})
-        
-        # NOUVELLE APPROCHE: Extraire DIRECTEMENT depuis les intermediate_steps
-        response_text = ""
-        sources = []
-        sources_found = []
-        
-        print(f"\n=== AGENT RESULT DEBUG ===")
-        print(f"Agent output length: {len(result.get('output', ''))}")
-        print(f"Intermediate steps count: {len(result.get('intermediate_steps', []))}")
-        if result.get('output'):
-            print(f"Output preview: {result.get('output', '')[:200]}...")
-        print("=========================")
-        
-        # Priorité 1: Chercher le scénario dans intermediate_steps (plus fiable)
-        if 'intermediate_steps' in result:
-            for i, step in enumerate(result['intermediate_steps']):
-                if len(step) > 1:
-                    step_result = str(step[1])
-                    
-                    # Nettoyer IMMÉDIATEMENT tout le contenu dès l'extraction
-                    import re
-                    clean_content = re.sub(r'\x1b\[[0-9;]*m', '', step_result)
-                    # Supprimer TOUS les emojis dès maintenant
-                    clean_content = re.sub(r'[^\x00-\x7F]+', ' ', clean_content)
-                    clean_content = re.sub(r'[\U0001F300-\U0001F9FF\U00002700-\U000027BF]', '', clean_content)
-                    
-                    try:
-                        print(f"Step {i}: longueur={len(clean_content)}, contient #={clean_content.count('#')}, contient Sources={'1' if ' Sources (' in clean_content else '0'}")
-                    except:
-                        print(f"Step {i}: debug info [encoding safe]")
-                    
-                    # Si cette étape contient un scénario (titre avec #)
-                    if '# ' in clean_content and len(clean_content) > 500:
-                        # Séparer le scénario des sources si nécessaire
-                        if ' Sources (' in clean_content:
-                            scenario_end = clean_content.find(' Sources (')
-                            scenario_content = clean_content[:scenario_end].strip()
-                        else:
-                            scenario_content = clean_content.strip()
-                        
-                        # Le contenu est déjà nettoyé plus haut
-                        clean_scenario = scenario_content
-                        
-                        # Garder le plus long scénario trouvé
-                        if len(clean_scenario) > len(response_text):
-                            response_text = clean_scenario
-                            try:
-                                print(f"Scénario extrait (longueur: {len(response_text)})")
-                            except:
-                                print("Scénario extrait [encoding safe]")
-        
-        # Priorité 2: Utiliser l'output de l'agent si pas de scénario dans les étapes
-        if len(response_text) < 300:
-            agent_output = result.get('output', '')
-            if len(agent_output) > len(response_text):
-                response_text = agent_output
-                print(f"Utilisation de l'output agent (longueur: {len(response_text)})")
-        
-        # Priorité 3: Si toujours pas de contenu, utiliser fallback RAG direct
-        if len(response_text) < 300 or response_text.startswith('Agent stopped') or 'Sources (' in response_text[:200]:
-            print("FALLBACK: Utilisation du RAG direct...")
-            
-            # Utiliser directement le RAG tool existant
-            try:
-                # Accéder au RAG tool depuis l'agent
-                for tool in global_agent.tools:
-                    if tool.name == "search_documents":
-                        direct_response = tool.func(chat_message.message)
-                        if ' Sources (' in direct_response:
-                            # Séparer scénario et sources
-                            parts = direct_response.split(' Sources (', 1)
-                            response_text = parts[0].strip()
-                        else:
-                            response_text = direct_response
-                        print(f"Fallback RAG réussi (longueur: {len(response_text)})")
-                        break
-            except Exception as e:
-                print(f"Erreur fallback RAG: {e}")
-                response_text = "Erreur lors de la génération du scénario. Veuillez réessayer."
-        
-        # Extraction simple des sources (optionnel)
-        try:
-            if 'intermediate_steps' in result:
-                for step in result['intermediate_steps']:
-                    if len(step) > 1:
-                        step_result = str(step[1])
-                        if ' Sources (' in step_result:
-                            # Parser basique des sources pour le frontend
-                            sources_start = step_result.find(' Sources (')
-                            if sources_start != -1:
-                                sources_section = step_result[sources_start:]
-                                # Simple comptage pour l'information
-                                source_count = sources_section.count('.doc')
-                                if source_count > 0:
-                                    sources = [{'name': f'Document {i+1}', 'path': 'minio://...'} for i in range(min(source_count, 5))]
-                            break
-        except Exception as e:
-            print(f"Erreur extraction sources: {e}")
-            sources = []
-        
-        # Nettoyer spécifiquement les emojis problématiques pour l'encodage Windows
-        import re
-        
-        # Supprimer TOUS les emojis Unicode de façon plus agressive
-        emoji_pattern = re.compile(r'[\U0001F300-\U0001F9FF\U00002700-\U000027BF\U0001f018-\U0001f270\U00002600-\U000026FF\U00002000-\U0000206F\U0001F1E0-\U0001F1FF\U0001F600-\U0001F64F\U0001F680-\U0001F6FF\U0001F700-\U0001F77F\U0001F780-\U0001F7FF\U0001F800-\U0001F8FF\U0001F900-\U0001F9FF\U0001FA00-\U0001FA6F\U0001FA70-\U0001FAFF\U00002190-\U000021FF\U00002B00-\U00002BFF\U00003000-\U0000303F\U0000FE00-\U0000FE0F]')
-        response_text = emoji_pattern.sub('', response_text)
-        
-        # Supprimer aussi les emojis les plus courants individuellement
-        common_emojis = ['🌙', '📜', '🏛️', '🕌', '🏺', '📚', '🔍', '⭐', '🌟', '💎', '🗝️', '🔥', '💫', '🎭', '🎯']
-        for emoji in common_emojis:
-            response_text = response_text.replace(emoji, '')
-        
-        # Supprimer les caractères de contrôle problématiques
-        response_text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F]', '', response_text)
-        
-        # Nettoyer les codes ANSI
-        response_text = re.sub(r'\x1b\[[0-9;]*m', '', response_text)
-        
-        # Remplacer les caractères problématiques par des alternatives ASCII
-        response_text = response_text.replace('"', '"').replace('"', '"')
-        response_text = response_text.replace(''', "'").replace(''', "'")
-        response_text = response_text.replace('–', '-').replace('—', '-')
-        
-        # Safe printing pour éviter les erreurs d'encodage
-        try:
-            print(f"=== RESULTAT FINAL ===")
-            print(f"Longueur reponse: {len(response_text)} caracteres")
-            print(f"Sources: {len(sources)} documents")
-        except UnicodeEncodeError:
-            print("=== RESULTAT FINAL ===")
-            print(f"Longueur reponse: {len(response_text)} caracteres")
-            print(f"Sources: {len(sources)} documents")
-        
-        # Vérification finale - ne JAMAIS retourner juste des sources
-        if not response_text or len(response_text) < 100 or response_text.strip().startswith('Sources ('):
-            response_text = "# SCENARIO DE DEMONSTRATION\n\nErreur temporaire. Le systeme a genere du contenu mais il y a eu un probleme d'extraction. Veuillez reessayer."
+        # Les requêtes identiques simultanées rejoignent la même génération ; elle n'est
+        # annulée que lorsque tous les clients qui l'attendent se sont déconnectés, et chacun
+        # attend avec sa propre échéance
+        outcome, shared = await chat_flights.join(
+            flight_key(chat_message.message, mode=mode),
+            lambda control: generate_chat_response(chat_message.message, control, mode),
+            timeout=timeout,
+            is_disconnected=request.is_disconnected
+        )
+        if shared:
+            print(f"Requete coalescee avec une generation en cours (session {session_id})")
         
         # Le texte a déjà été nettoyé plus haut
-        response_data = ChatResponse(
-            session_id=session_id,
-            response=response_text,
-            sources=sources
-        )
+        response_data = ChatResponse(session_id=session_id, **outcome)
         
         # Retourner une JSONResponse avec encodage UTF-8 explicite
         return JSONResponse(
@@ -586,6 +474,18 @@ async def chat_endpoint(chat_message: ChatMessage):
             media_type="application/json; charset=utf-8"
         )
         
+    except GenerationDeadlineExceeded:
+        return JSONResponse(
+            status_code=504,
+            content={"detail": f"Echeance de {timeout:.0f}s depassee avant toute generation"},
+            media_type="application/json; charset=utf-8"
+        )
+        
+    except ClientDisconnected:
+        # Personne n'attend plus la réponse : l'agent s'arrête au prochain callback
+        print(f"Client deconnecte, generation annulee (session {session_id})")
+        return Response(status_code=499)
+        
     except Exception as e:
         # Safe error logging
         error_msg = str(e).encode('ascii', 'ignore').decode('ascii')
@@ -600,6 +500,89 @@ async def chat_endpoint(chat_message: ChatMessage):
             media_type="application/json; charset=utf-8"
         )
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(chat_message: ChatMessage, request: Request):
+    """Variante streaming de /chat en Server-Sent Events, sans WebSocket
+
+    Événements : status, retrieval (sources), token (delta de texte du LLM), final
+    (texte complet, sources, scenario_id) ou error. Les tokens viennent directement de la
+    chaîne RAG (retriever puis LLM en streaming), sans la boucle ReAct de l'agent ni le
+    mode sections : le client web reste sur /chat sauf avec VITE_SIFHR_STREAMING=true.
+    """
+    if not engine.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Système RAG agentique non initialisé. Veuillez réessayer plus tard."
+        )
+    
+    session_id = chat_message.session_id or str(uuid.uuid4())
+    message = chat_message.message
+    timeout = resolve_timeout(chat_message.timeout)
+    control = GenerationControl(timeout=timeout)
+    
+    async def event_stream():
+        parts = []
+        sources = []
+        partial = False
+        started = time.perf_counter()
+        first_token_s = None
+        
+        yield sse_event("status", {"status": "retrieving", "session_id": session_id,
+                                   "message": "Recherche dans la base de connaissances..."})
+        try:
+            # Échéance appliquée à tout le flux, recherche comprise (pas seulement aux callbacks du LLM)
+            stream = engine.rag_tool.astream_scenario(message, callbacks=[control, prompt_cache_metrics])
+            async for item in aiter_with_deadline(stream, control):
+                if item["type"] == "retrieval":
+                    sources = item["sources"]
+                    yield sse_event("retrieval", {"documents": item["documents"], "sources": sources})
+                    yield sse_event("status", {"status": "generating", "message": "Generation en cours..."})
+                else:
+                    if first_token_s is None:
+                        first_token_s = round(time.perf_counter() - started, 2)
+                    parts.append(item["delta"])
+                    yield sse_event("token", {"delta": item["delta"]})
+        except GenerationDeadlineExceeded:
+            if not parts:
+                yield sse_event("error", {"error": f"Echeance de {timeout:.0f}s depassee avant toute generation"})
+                return
+            # Échéance dépassée : le texte déjà streamé devient la réponse (partielle)
+            partial = True
+        except Exception as e:
+            error_msg = str(e).encode('ascii', 'ignore').decode('ascii')
+            print(f"Erreur lors du streaming SSE: {error_msg}")
+            yield sse_event("error", {"error": f"Erreur lors du traitement: {error_msg}"})
+            return
+        finally:
+            # Client déconnecté (générateur fermé) : arrêter le LLM au prochain callback
+            control.cancel()
+        
+        response_text = ''.join(parts)
+        scenario_id = None
+        if not partial and response_text.strip():
+            stored = await run_in_threadpool(
+                scenario_store.create, extract_scenario_title(response_text, message), response_text,
+                {'prompt': message, 'mode': 'stream'}
+            )
+            scenario_id = stored['scenario_id']
+        
+        yield sse_event("final", {
+            "response": response_text,
+            "session_id": session_id,
+            "sources": sources,
+            "partial": partial,
+            "scenario_id": scenario_id,
+            "timings": {"first_token_s": first_token_s,
+                        "total_s": round(time.perf_counter() - started, 2)}
+        })
+    
+    # X-Accel-Buffering : empêcher nginx de mettre le flux en tampon
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream; charset=utf-8",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.delete("/chat/{session_id}")
 async def delete_session(session_id: str):
     """Supprimer une session de chat"""
@@ -705,36 +688,38 @@ async def check_scenario_similarity(request: SimilarityCheckRequest):
         pdf_filename = f"scenario_{request.scenario_title[:30].replace(' ', '_')}.pdf"
         
         try:
-            pdf_bytes, pdf_filename_result = pdf_converter.convert_to_pdf(
-                request.scenario_content, 
-                request.scenario_title
-            )
-            pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
-            pdf_filename = pdf_filename_result
-            print("PDF genere avec succes")
+            if request.include_pdf:
+                # Rendu ReportLab hors de la boucle d'événements
+                pdf_bytes, pdf_filename_result = await run_in_threadpool(
+                    pdf_converter.convert_to_pdf,
+                    request.scenario_content,
+                    request.scenario_title
+                )
+                pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
+                pdf_filename = pdf_filename_result
+                print("PDF genere avec succes")
         except Exception as pdf_error:
             print(f"Erreur generation PDF (ignoree): {pdf_error}")
             # Continuer sans PDF en cas d'erreur
             pass
         
-        # Simuler la vérification de similarité (toujours succès)
-        similarity_result = {
-            'has_duplicates': False,
-            'similarities': [],
-            'high_similarities': [],
-            'similarity_threshold': 0.65,
-            'can_auto_embed': True,
-            'message': 'Verification reussie - aucun doublon detecte'
-        }
+        # Vérification de similarité réelle (pré-filtre MinHash puis recherche vectorielle)
+        try:
+            similarity_result = await similarity_checker.acheck_scenario_similarity(request.scenario_content)
+        except Exception as similarity_error:
+            print(f"Erreur verification similarite (ignoree): {similarity_error}")
+            similarity_result = {
+                'has_duplicates': False,
+                'similarities': [],
+                'high_similarities': [],
+                'similarity_threshold': similarity_checker.threshold,
+                'can_auto_embed': True,
+                'message': f'Verification de similarite indisponible: {str(similarity_error)}'
+            }
         
         # Retourner le résultat
         result = SimilarityResult(
-            has_duplicates=False,
-            similarities=[],
-            high_similarities=[],
-            similarity_threshold=0.65,
-            can_auto_embed=True,
-            message='Verification reussie - aucun doublon detecte',
+            **similarity_result,
             pdf_data=pdf_base64,
             pdf_filename=pdf_filename
         )
@@ -756,54 +741,124 @@ async def check_scenario_similarity(request: SimilarityCheckRequest):
             pdf_filename="scenario_error.pdf"
         )
 
-@app.post("/embed-scenario")
+@app.post("/export/pdf")
+async def export_pdf(request: PdfExportRequest):
+    """Générer le PDF d'un scénario dans un fichier temporaire et le renvoyer depuis ce fichier (supprimé après envoi)"""
+    try:
+        pdf_path, pdf_filename = await run_in_threadpool(
+            pdf_converter.convert_to_file,
+            request.scenario_content,
+            request.scenario_title
+        )
+    except Exception as e:
+        print(f"Erreur export PDF: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la génération du PDF: {str(e)}")
+
+    if request.stream:
+        # Envoi par morceaux ; le fichier est supprimé à la fin de l'itération
+        return StreamingResponse(
+            iter_file_chunks(pdf_path),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{pdf_filename}"'}
+        )
+
+    return FileResponse(
+        pdf_path,
+        media_type="application/pdf",
+        filename=pdf_filename,
+        background=BackgroundTask(remove_file, pdf_path)
+    )
+
+@app.post("/export/pdf-batch")
+async def export_pdf_batch(request: PdfBatchRequest):
+    """Exporter plusieurs scénarios en PDF dans un ZIP envoyé au fil des rendus"""
+    if not request.scenarios:
+        raise HTTPException(status_code=400, detail="Aucun scénario à exporter")
+    if len(request.scenarios) > PDF_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Trop de scénarios dans le lot ({len(request.scenarios)} > {PDF_BATCH_MAX})"
+        )
+
+    batch_id = create_batch([item.scenario_title for item in request.scenarios], request.batch_id)
+    print(f"Export PDF par lot {batch_id}: {len(request.scenarios)} scenarios")
+
+    scenarios = [(item.scenario_title, item.scenario_content) for item in request.scenarios]
+    return StreamingResponse(
+        stream_pdf_batch(batch_id, scenarios),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="SIFHR_export_{batch_id[:8]}.zip"',
+            "X-Batch-Id": batch_id
+        }
+    )
+
+@app.get("/export/pdf-batch/{batch_id}")
+async def export_pdf_batch_progress(batch_id: str):
+    """Progression d'un export par lot (état de chaque scénario)"""
+    progress = get_batch_progress(batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"Lot {batch_id} introuvable")
+    return progress
+
+@app.get("/pdf-cache/stats")
+async def pdf_cache_stats():
+    """Statistiques du cache de PDF (taux de succès, taille, évictions)"""
+    return pdf_converter.cache.stats()
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Tokens consommés, tokens lus depuis le cache de prompt, latence du premier token et
+    regroupement des embeddings (taille des lots, attente ajoutée)"""
+    return {
+        **prompt_cache_metrics.stats(),
+        "coalesced_requests": chat_flights.stats['coalesced'],
+        "generations_started": chat_flights.stats['started'],
+        "embedding_batches": embedding_batch_stats()
+    }
+
+@app.post("/embed-scenario", status_code=202)
 async def embed_scenario(request: EmbedRequest):
-    """Embedder et stocker un scénario dans Milvus"""
+    """Planifier l'embedding et le stockage d'un scénario dans Milvus (job en arrière-plan)"""
     try:
         print(f"Embedding du scenario: {request.scenario_title}")
         
         if not request.force_embed:
-            # Vérifier d'abord la similarité
-            similarity_result = similarity_checker.check_scenario_similarity(request.scenario_content)
-            if similarity_result['has_duplicates']:
+            # Pré-filtre MinHash immédiat : les copies quasi exactes sont refusées tout de suite,
+            # la vérification vectorielle complète est faite dans le job
+            duplicates = await run_in_threadpool(
+                similarity_checker.prefilter,
+                minhash_signature(request.scenario_content)
+            )
+            if duplicates:
                 return JSONResponse(
                     status_code=409,
                     content={
                         "message": "Scénario similaire détecté. Utilisez force_embed=True pour forcer l'embedding.",
-                        "similarity_info": similarity_result
+                        "similarity_info": {
+                            'has_duplicates': True,
+                            'similarities': duplicates,
+                            'high_similarities': duplicates,
+                            'similarity_threshold': similarity_checker.threshold,
+                            'can_auto_embed': False,
+                            'message': f"Copie quasi exacte de: {duplicates[0]['title']}"
+                        }
                     }
                 )
         
-        # Implémenter l'embedding et le stockage dans Milvus
-        from chunking_embedding import chunk_and_embed_document
-        from multi_query_retriever import create_vectorstore_retriever
-        
-        # Diviser le scénario en chunks et créer les embeddings
-        result = chunk_and_embed_document(
-            content=request.scenario_content,
-            doc_name=request.scenario_title,
-            metadata={
-                'title': request.scenario_title,
-                'type': 'scenario_generated',
-                'source': 'sifhr_ai',
-                'embedding_date': str(datetime.now())
-            },
-            collection_name="scenarios_sifhr"
+        job_id = submit_scenario_indexing(
+            request.scenario_content,
+            request.scenario_title,
+            request.force_embed
         )
         
-        if result['success']:
-            return {
-                "message": f"Scénario '{request.scenario_title}' embedé et stocké avec succès",
-                "scenario_title": request.scenario_title,
-                "embedded": True,
-                "chunks_created": result.get('chunks_count', 0),
-                "embeddings_created": result.get('embeddings_count', 0)
-            }
-        else:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Erreur lors de l'embedding: {result.get('error', 'Erreur inconnue')}"
-            )
+        return {
+            "message": f"Indexation du scénario '{request.scenario_title}' planifiée",
+            "scenario_title": request.scenario_title,
+            "job_id": job_id,
+            "status": "queued",
+            "embedded": False
+        }
         
     except Exception as e:
         print(f"Erreur lors de l'embedding: {e}")
@@ -812,5 +867,145 @@ async def embed_scenario(request: EmbedRequest):
             detail=f"Erreur lors de l'embedding: {str(e)}"
         )
 
+@app.get("/embed-scenario/{job_id}")
+async def embed_scenario_status(job_id: str):
+    """État d'un job d'indexation (queued, checking, embedding, done, duplicate, failed)"""
+    job = get_indexing_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} introuvable")
+    return job
+
+def engine_reloader():
+    """Callback du job de réindexation (appelé dans son thread) : reconstruire l'agent sur la
+    nouvelle version, les requêtes en cours terminent sur l'ancienne"""
+    loop = asyncio.get_running_loop()
+    return lambda: asyncio.run_coroutine_threadsafe(engine.start(), loop).result()
+
+@app.post("/reindex", status_code=202)
+async def start_reindex(request: ReindexRequest):
+    """Réindexation blue/green de la base de connaissances, sans interruption du service"""
+    if request.provider and request.provider not in EMBEDDING_PROVIDERS:
+        raise HTTPException(status_code=400, detail=f"Fournisseur inconnu: {request.provider}")
+    try:
+        job_id = submit_reindex(request.provider, on_switch=engine_reloader())
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"job_id": job_id, "status": "queued", "status_url": f"/reindex/{job_id}"}
+
+@app.get("/reindex")
+async def reindex_status():
+    """Version en service, versions conservées et réindexation en cours"""
+    live, provider = await run_in_threadpool(resolve_collection, KNOWLEDGE_COLLECTION)
+    versions = await run_in_threadpool(list_versions)
+    return {
+        "alias": live_alias(KNOWLEDGE_COLLECTION),
+        "live": live,
+        "provider": provider,
+        "versions": versions,
+        "running": running_job()
+    }
+
+@app.get("/reindex/{job_id}")
+async def reindex_job_status(job_id: str):
+    """État d'une réindexation (queued, copying, validating, switching, done, failed)"""
+    job = get_reindex_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} introuvable")
+    return job
+
+@app.post("/reindex/activate/{version}")
+async def activate_reindex_version(version: str):
+    """Retour arrière vers une version conservée, puis reconstruction de l'agent"""
+    try:
+        await run_in_threadpool(activate_version, version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Version {version} introuvable")
+    await engine.start()
+    return {"live": version}
+
+@app.post("/scenarios", status_code=201)
+async def create_scenario(request: ScenarioCreateRequest):
+    """Enregistrer un scénario existant (par exemple de la bibliothèque du frontend) pour l'éditer"""
+    scenario = await run_in_threadpool(scenario_store.create, request.scenario_title, request.scenario_content)
+    return {"scenario_id": scenario['scenario_id'], "version": scenario['version']}
+
+@app.get("/scenarios")
+async def list_scenarios():
+    """Liste des scénarios stockés (sans contenu)"""
+    return await run_in_threadpool(scenario_store.list)
+
+@app.get("/scenarios/{scenario_id}")
+async def get_scenario(scenario_id: str):
+    """Scénario stocké et titres de ses sections"""
+    scenario = await run_in_threadpool(scenario_store.get, scenario_id)
+    if scenario is None:
+        raise HTTPException(status_code=404, detail=f"Scenario {scenario_id} introuvable")
+    scenario = {key: value for key, value in scenario.items() if key != 'history'}
+    scenario['sections'] = [section['heading'] for section in split_sections(scenario['content'])]
+    return scenario
+
+@app.post("/scenarios/{scenario_id}/sections")
+async def edit_scenario_section(scenario_id: str, edit: SectionEditRequest, request: Request):
+    """Régénérer ou modifier une seule section d'un scénario stocké et la réinsérer"""
+    if not engine.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Système RAG agentique non initialisé. Veuillez réessayer plus tard."
+        )
+    
+    scenario = await run_in_threadpool(scenario_store.get, scenario_id)
+    if scenario is None:
+        raise HTTPException(status_code=404, detail=f"Scenario {scenario_id} introuvable")
+    
+    timeout = resolve_timeout(edit.timeout)
+    control = GenerationControl(timeout=timeout)
+    rag_tool = engine.rag_tool
+    
+    try:
+        result = await arun_with_control(
+            aregenerate_section(
+                rag_tool.llm, rag_tool.retriever, scenario['title'], scenario['content'],
+                edit.section, edit.instructions, callbacks=[control, prompt_cache_metrics]
+            ),
+            control, request.is_disconnected
+        )
+    except SectionNotFound:
+        raise HTTPException(status_code=404, detail={
+            "message": f"Section {edit.section} introuvable",
+            "sections": [section['heading'] for section in split_sections(scenario['content'])]
+        })
+    except GenerationDeadlineExceeded:
+        raise HTTPException(status_code=504, detail=f"Echeance de {timeout:.0f}s depassee")
+    except ClientDisconnected:
+        return Response(status_code=499)
+    
+    try:
+        # Contenu reconstruit à partir de la version lue : refusé si une autre modification
+        # a été enregistrée pendant la régénération
+        updated = await run_in_threadpool(
+            scenario_store.update_content, scenario_id, result['content'],
+            {'section': result['heading'], 'instructions': edit.instructions}, scenario['version']
+        )
+    except VersionConflict as e:
+        raise HTTPException(status_code=409, detail={
+            "message": f"Scenario {scenario_id} modifie pendant la regeneration, veuillez reessayer",
+            "expected_version": e.expected,
+            "current_version": e.current
+        })
+    if updated is None:
+        raise HTTPException(status_code=404, detail=f"Scenario {scenario_id} introuvable")
+    
+    return {
+        "scenario_id": scenario_id,
+        "version": updated['version'],
+        "heading": result['heading'],
+        "section": result['section'],
+        "content": updated['content'],
+        "sources": result['sources'],
+        "timings": result['timings']
+    }
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8001, reload=False)
+    # Un seul serveur : REST, WebSocket (/ws) et export PDF sur le même port
+    uvicorn.run("main:app", host="127.0.0.1", port=8001, reload=False,
+                ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE)
@@ -1,295 +1,42 @@
-import sys
-import os
-if sys.platform.startswith('win'):
-    os.environ['PYTHONIOENCODING'] = 'utf-8'
-
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain.tools import Tool
-from langchain_core.prompts import PromptTemplate as CorePromptTemplate
-from chunking_embedding import get_embedding_model
-from multi_query_retriever import get_llm, create_vectorstore_retriever, get_multi_query_retriever
-from datetime import datetime
-
-
-class RAGTool:
-    """Outil RAG pour scénarios immersifs"""
-
-    def __init__(self):
-        print("Initialisation de l'outil RAG...")
-
-        # Initialisation des composants RAG
-        self.embedding_model = get_embedding_model()
-        self.llm = get_llm()
-
-        # Créer le retriever
-        collection_name = "data_sifhr"
-        retriever = create_vectorstore_retriever(collection_name, self.embedding_model)
-        self.retriever = get_multi_query_retriever(self.llm, retriever)
-
-        # PROMPT COMPLET VERSION ORIGINALE
-        prompt_prefix = """Tu es un maître de jeu expert spécialisé dans la création de scénarios immersifs 
-inspirés de l'histoire authentique, des légendes et des civilisations arabo-musulmanes. 
-Ton objectif est de créer des épopées de chasse au trésor exceptionnellement détaillées, captivantes et riches.
-
-EXIGENCE DE LONGUEUR CRITIQUE :
-**TON SCÉNARIO DOIT FAIRE AU MINIMUM 15 PAGES IMPRIMÉES** (environ 8000-10000 mots)
-- Développe chaque section en profondeur avec des détails exhaustifs
-- Ne résume JAMAIS, développe toujours plus en détail
-- Écris des descriptions longues et immersives pour chaque lieu, personnage, objet
-- Multiplie les sous-sections, les détails historiques, les dialogues étendus
-
-🎭 STYLE NARRATIF EXIGÉ :
-- Adopte un ton évocateur et poétique, digne des Mille et Une Nuits
-- Utilise des métaphores orientales et des descriptions sensorielles (parfums, sons, textures)
-- Intègre des éléments culturels authentiques (architecture, arts, sciences, philosophie)
-- Crée une atmosphère mystique et majestueuse
-
-📚 STRUCTURE OBLIGATOIRE DU SCÉNARIO ÉTENDU :
-1. **PROLOGUE IMMERSIF** (2-3 pages) : Contexte historique détaillé avec descriptions de l'époque, des lieux, de l'atmosphère
-2. **7-10 ACTES DÉTAILLÉS** : Chaque acte doit faire 1-2 pages minimum avec défis progressifs complexes
-3. **ÉNIGMES CULTURELLES MULTIPLES** : 3-5 énigmes par acte basées sur l'histoire, la géographie, l'art islamique
-4. **PERSONNAGES HISTORIQUES DÉVELOPPÉS** : Biographies, motivations, dialogues pour califes, érudits, poètes, marchands
-5. **LIEUX EMBLÉMATIQUES DÉTAILLÉS** : Descriptions architecturales complètes de palais, mosquées, marchés, bibliothèques
-6. **TRÉSORS MULTIPLES** : Plusieurs trésors intermédiaires avant le trésor final
-7. **ÉLÉMENTS D'AMBIANCE ÉTENDUS** : Descriptions de musique, parfums, lumières, matériaux sur plusieurs paragraphes
-
-🏛️ EXIGENCES DE CONTENU :
-- Utilise EXCLUSIVEMENT les informations du contexte documentaire
-- Enrichis avec des détails architecturaux précis (mouqarnas, zelliges, calligraphies)
-- Intègre les sciences et arts de l'époque (astronomie, médecine, poésie, musique)
-- Mentionne les routes commerciales, les épices, les tissus, les manuscrits
-- Inclus des références aux dynasties, califats et personnages historiques réels
-
-NIVEAU DE DÉTAIL ATTENDU :
-- Descriptions de 2-3 phrases minimum pour chaque lieu
-- Contexte historique précis pour chaque époque mentionnée  
-- Explications des symboles, objets et références culturelles
-- Dialogues en style oriental pour les PNJ rencontrés
-- Défis intellectuels basés sur les connaissances de l'époque
-
-🎨 FLUIDITÉ NARRATIVE :
-- Relie les actes entre eux par des transitions naturelles, comme dans une épopée.
-- Insère des dialogues courts et évocateurs pour rendre vivants les personnages.
-- Varie le rythme entre descriptions poétiques et moments d'action.
-- Utilise un vocabulaire riche mais fluide, évitant les répétitions.
-
-🌟 IMMERSION SENSORIELLE :
-- Chaque acte doit comporter au moins un élément sensoriel : 
-  - Vue (architecture, couleurs, lumière)
-  - Son (chants, cliquetis, bruits de marché)
-  - Odeur (épices, encens, cuir)
-  - Toucher (textures des tapis, marbre, manuscrits)
-  - Goût (mets, fruits, boissons)
-
-RÈGLES STRICTES :
-- Si une information n'existe pas dans le contexte : "Cette information n'est pas disponible dans les sources consultées"
-- Jamais d'invention pure, toujours basé sur les documents fournis
-- Respecter la véracité historique tout en créant l'émerveillement
-- Éviter les anachronismes et les clichés orientalistes
-- INTERDICTION ABSOLUE : N'utilise AUCUN emoji, symbole Unicode ou caractère spécial (🏺📚🌙🏛️⭐💎 etc.)
-- Utilise UNIQUEMENT du texte ASCII standard avec accents français acceptés
-- Remplace tout symbole par du texte : "[TRESOR]" au lieu de 🏺, "[MOSQUEE]" au lieu de 🕌
-"""
+"""Route WebSocket /ws : streaming des scénarios, reprise de session et annulation
 
-        prompt_suffix = """
-📖 CONTEXTE DOCUMENTAIRE DISPONIBLE :
-{context}
-
-🎯 DEMANDE DU JOUEUR : 
-{question}
-
-CREEZ UNE EPOPEE IMMERSIVE DE 15+ PAGES :
-Basez-vous uniquement sur le contexte documentaire ci-dessus pour créer une épopée de chasse au trésor 
-exceptionnellement longue et détaillée suivant toutes les exigences mentionnées. 
-
-**IMPÉRATIF DE LONGUEUR** : Votre réponse doit être suffisamment longue pour remplir AU MINIMUM 15 pages imprimées.
-Structurez votre réponse avec des titres clairs, des descriptions très riches et une progression narrative 
-captivante sur plusieurs pages. Développez massivement chaque section :
-
-CHECKLIST OBLIGATOIRE :
-- [ ] Prologue de 2-3 pages avec contexte historique approfondi
-- [ ] 7-10 actes de 1-2 pages chacun avec défis détaillés
-- [ ] Descriptions architecturales complètes de chaque lieu
-- [ ] Biographies développées de tous les personnages historiques
-- [ ] Énigmes multiples avec explications culturelles étendues
-- [ ] Dialogues longs et authentiques pour tous les PNJ
-- [ ] Descriptions sensorielles sur plusieurs paragraphes
-- [ ] Trésor final avec signification historique approfondie
-- [ ] Épilogue développé sur 1-2 pages
-
-SCÉNARIO ÉPIQUE COMPLET DE 15+ PAGES :
+Montée par main.py sur la même application que les routes REST : l'agent, le LLM et le
+retriever sont ceux de rag_engine, partagés avec /chat.
 """
+import os
 
-        GAME_PROMPT = PromptTemplate(
-            template=prompt_prefix + prompt_suffix,
-            input_variables=["context", "question"]
-        )
-
-        # Créer la chaîne QA
-        self.qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=self.retriever,
-            return_source_documents=True,
-            chain_type_kwargs={"prompt": GAME_PROMPT}
-        )
-
-        print("Outil RAG initialise!")
-
-    def search_documents(self, query: str) -> str:
-        """
-        Recherche dans la base de documents et retourne une réponse
-        """
-        try:
-            print(f"Recherche RAG pour: {query}")
-
-            # Obtenir la réponse du système RAG
-            result = self.qa_chain.invoke({"query": query})
-
-            # Formater la réponse avec les sources
-            response = result['result']
-
-            if result.get('source_documents'):
-                response += f"\n\nSources ({len(result['source_documents'])} documents):"
-                for i, doc in enumerate(result['source_documents'][:3], 1):
-                    source = doc.metadata.get('source', 'Inconnu')
-                    minio_path = doc.metadata.get('minio_path', '')
-                    if minio_path:
-                        response += f"\n   {i}. {source} (Fichier: {minio_path})"
-                    else:
-                        response += f"\n   {i}. {source}"
-
-            return response
-
-        except Exception as e:
-            return f"Erreur lors de la recherche: {str(e)}"
-
-
-def create_agentic_rag_system():
-    """Créer le système RAG agentique complet"""
-
-    print("\n" + "=" * 80)
-    print("SYSTEME RAG AGENTIQUE - INITIALISATION WEBSOCKET")
-    print("=" * 80)
-
-    # Initialiser l'outil RAG
-    rag_tool = RAGTool()
-
-    # Créer l'outil pour l'agent
-    tools = [
-        Tool(
-            name="search_documents",
-            description="""OUTIL OBLIGATOIRE - Recherche dans la base de connaissances spécialisée.
-            Tu DOIS utiliser cet outil pour TOUTES les questions liées à:
-            - La civilisation arabo-musulmane (histoire, culture, personnages)
-            - La création de scénarios immersifs et chasse au trésor
-            - Les palais, architectures, trésors, légendes orientales
-            - SIFHR ou tout autre sujet de la base
-            Input: question reformulée pour optimiser la recherche""",
-            func=rag_tool.search_documents
-        )
-    ]
-
-    # Template de prompt ReAct personnalisé optimisé pour retourner le scénario complet
-    template = '''Tu es un maître narratif spécialisé dans la civilisation arabo-musulmane et les scénarios de chasse au trésor.
-
-Tu as accès aux outils suivants:
-{tools}
-
-RÈGLE ABSOLUE: Tu DOIS TOUJOURS utiliser l'outil "search_documents" (de [{tool_names}]) pour:
-- Toute question sur l'histoire, la culture ou les légendes arabo-musulmanes
-- La création de scénarios immersifs ou de chasse au trésor
-- Les questions sur les palais, trésors, architectures, personnages historiques
-- Les éléments narratifs pour des jeux immersifs
-- SIFHR ou tout autre sujet documenté dans la base
-
-Format de raisonnement OBLIGATOIRE:
-
-Question: la question d'entrée à laquelle tu dois répondre
-Thought: J'analyse la question et je DOIS chercher dans la base de connaissances
-Action: search_documents
-Action Input: [reformulation précise de la question pour la recherche]
-Observation: [résultat de la recherche dans la base]
-Thought: Je vais maintenant extraire le scénario complet de l'Observation et le présenter comme Final Answer
-Final Answer: [EXTRAIRE ET PRÉSENTER UNIQUEMENT LE SCÉNARIO COMPLET de l'Observation, SANS les sources ni métadonnées]
-
-RÈGLES CRITIQUES pour Final Answer:
-- COPIER INTÉGRALEMENT le scénario complet depuis l'Observation
-- Ne PAS inclure la section "Sources (X documents)" dans Final Answer
-- Ne PAS résumer, COPIER le scénario complet tel quel
-- Commencer Final Answer directement par le titre du scénario (# ou ##)
-- Inclure TOUS les détails: prologue, actes, énigmes, personnages, lieux
-- Si l'Observation contient "# Titre du scénario", Final Answer doit commencer par "# Titre du scénario"
-
-Commence!
-
-Question: {input}
-Thought:{agent_scratchpad}'''
-
-    prompt = CorePromptTemplate.from_template(template)
-
-    # Obtenir le modèle LLM
-    llm = get_llm()
-
-    # Créer l'agent ReAct
-    agent = create_react_agent(llm, tools, prompt)
-
-    # Créer l'exécuteur d'agent avec paramètres originaux
-    agent_executor = AgentExecutor(
-        agent=agent,
-        tools=tools,
-        verbose=True,
-        handle_parsing_errors=True,
-        max_iterations=6,   # Version originale
-        # max_execution_time=60,  # Pas de timeout pour version complète
-        return_intermediate_steps=True
-    )
-
-    print("Systeme RAG agentique initialise avec succes!")
-    return agent_executor
-
-
-# WebSocket Server avec FastAPI
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.middleware.cors import CORSMiddleware
+from rag_engine import engine, GENERATION_MODES, GENERATION_MODE
+from scenario_prompts import prompt_cache_metrics
+from generation_control import (CHAT_DEADLINE, GenerationCancelled, GenerationControl,
+                                GenerationDeadlineExceeded, arun_with_control)
+from single_flight import flight_key
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 import json
+import re
+import time
+import uuid
 import asyncio
-from contextlib import asynccontextmanager
+import hashlib
+import threading
+from collections import deque
+from typing import Optional
+
+# Streaming : mots par frame, délai entre frames et compression permessage-deflate
+STREAM_WORDS_PER_FRAME = int(os.getenv('SIFHR_STREAM_WORDS_PER_FRAME', 4))
+STREAM_FRAME_DELAY = float(os.getenv('SIFHR_STREAM_FRAME_DELAY', 0.05))
+WS_PER_MESSAGE_DEFLATE = os.getenv('SIFHR_WS_DEFLATE', '1') == '1'
+# Mot + espaces qui le suivent : la concaténation des deltas redonne exactement le texte
+STREAM_TOKEN_PATTERN = re.compile(r'\s*\S+\s*|\s+')
+# Reprise de session : frames conservées par génération et durée de vie des résultats terminés
+REPLAY_BUFFER_FRAMES = int(os.getenv('SIFHR_REPLAY_BUFFER_FRAMES', 4096))
+SESSION_TTL = float(os.getenv('SIFHR_SESSION_TTL', 600))
+# Générations simultanées par connexion, et délai avant d'annuler une génération dont le
+# client s'est déconnecté sans la reprendre
+WS_MAX_CONCURRENT = int(os.getenv('SIFHR_WS_MAX_CONCURRENT', 2))
+ORPHAN_GRACE = float(os.getenv('SIFHR_WS_ORPHAN_GRACE', 30))
+
+router = APIRouter()
 
-# Instance globale de l'agent RAG
-global_agent = None
-
-async def startup_event():
-    """Initialiser le système RAG agentique au démarrage"""
-    global global_agent
-    try:
-        print("Initialisation du systeme RAG agentique WebSocket...")
-        global_agent = create_agentic_rag_system()
-        print("Systeme RAG agentique WebSocket initialise avec succes!")
-    except Exception as e:
-        print(f"Erreur lors de l'initialisation du systeme RAG agentique: {e}")
-        global_agent = None
-
-# Configuration du lifespan
-@asynccontextmanager
-async def lifespan(app):
-    # Startup
-    await startup_event()
-    yield
-    # Shutdown (rien à faire pour l'instant)
-
-app = FastAPI(title="SIFHR RAG WebSocket API", version="1.0.0", lifespan=lifespan)
-
-# Configuration CORS pour le frontend React
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5174", "http://localhost:5173", "http://127.0.0.1:5174", "http://127.0.0.1:5173"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
 class ConnectionManager:
     def __init__(self):
@@ -301,6 +48,8 @@ class ConnectionManager:
         print(f"Client connecte. Total: {len(self.active_connections)}")
 
     def disconnect(self, websocket: WebSocket):
+        if websocket not in self.active_connections:
+            return
         self.active_connections.remove(websocket)
         print(f"Client deconnecte. Total: {len(self.active_connections)}")
 
@@ -316,17 +65,175 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
-@app.get("/health")
-async def health_check():
-    """Point de santé de l'API WebSocket"""
+
+# Frames qui terminent une génération
+FINAL_FRAME_TYPES = ('chat_response', 'error', 'cancelled')
+
+
+class GenerationSession:
+    """Génération liée à un session_id : frames séquencés, rejouables après une reconnexion"""
+
+    def __init__(self, session_id: str, request_id: str, owner: WebSocket):
+        self.session_id = session_id
+        self.request_id = request_id
+        self.owner = owner  # Connexion qui a lancé la génération (limite de concurrence)
+        self.task: Optional[asyncio.Task] = None
+        self.flight_key: Optional[str] = None  # Clé de coalescence des prompts identiques
+        self.cancel_event = threading.Event()  # Lu par GenerationControl à chaque callback de l'agent
+        self.frames = deque(maxlen=REPLAY_BUFFER_FRAMES)
+        self.next_seq = 0
+        self.subscribers = set()
+        self.text_parts = []  # Deltas accumulés, pour resynchroniser au-delà du buffer
+        self.finished_at = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    async def publish(self, message: dict):
+        """Numéroter un frame, le garder dans le buffer et l'envoyer aux clients attachés"""
+        async with self._lock:
+            frame = dict(message, session_id=self.session_id, request_id=self.request_id,
+                         seq=self.next_seq)
+            self.next_seq += 1
+            self.frames.append(frame)
+            if frame['type'] == 'streaming_response':
+                self.text_parts.append(frame['delta'])
+            elif frame['type'] in FINAL_FRAME_TYPES:
+                self.finished_at = time.monotonic()
+
+            for websocket in list(self.subscribers):
+                try:
+                    await manager.send_json_message(frame, websocket)
+                except Exception:
+                    # Client parti : la génération continue, il pourra reprendre plus tard
+                    self.subscribers.discard(websocket)
+
+    async def resume(self, websocket: WebSocket, last_seq: int):
+        """Renvoyer les frames manqués depuis last_seq puis attacher le client au flux en direct"""
+        async with self._lock:
+            first_buffered = self.frames[0]['seq'] if self.frames else self.next_seq
+            if last_seq + 1 < first_buffered:
+                # Des frames sont sortis du buffer : renvoyer tout le texte déjà produit,
+                # suivi du frame final éventuel (numéroté juste après le resync)
+                missed = [f for f in self.frames if f['type'] in FINAL_FRAME_TYPES]
+                await manager.send_json_message({
+                    "type": "resync",
+                    "session_id": self.session_id,
+                    "request_id": self.request_id,
+                    "seq": missed[0]['seq'] - 1 if missed else self.next_seq - 1,
+                    "text": ''.join(self.text_parts)
+                }, websocket)
+            else:
+                missed = [f for f in self.frames if f['seq'] > last_seq]
+
+            for frame in missed:
+                await manager.send_json_message(frame, websocket)
+            if not self.finished:
+                self.subscribers.add(websocket)
+            return len(missed)
+
+    def cancel(self) -> bool:
+        """Arrêter la génération : tâche asyncio annulée et agent interrompu au prochain callback"""
+        if self.finished or self.task is None or self.task.done():
+            return False
+        self.cancel_event.set()
+        self.task.cancel()
+        return True
+
+    async def leave(self, websocket: WebSocket) -> bool:
+        """Un client abandonne la génération ; elle n'est annulée que s'il était le dernier"""
+        if not (self.subscribers - {websocket}):
+            return self.cancel()
+        self.subscribers.discard(websocket)
+        await manager.send_json_message({
+            "type": "cancelled",
+            "session_id": self.session_id,
+            "request_id": self.request_id,
+            "message": "Generation abandonnee (toujours en cours pour d'autres clients)"
+        }, websocket)
+        return False
+
+    def cancel_if_orphaned(self):
+        """Annuler la génération si aucun client ne l'a reprise pendant le délai de grâce"""
+        if not self.subscribers and self.cancel():
+            print(f"Generation {self.request_id} annulee: client deconnecte sans reprise")
+
+
+class SessionStore:
+    """Générations en cours et résultats terminés (conservés SESSION_TTL secondes), par request_id"""
+
+    def __init__(self):
+        self.sessions: dict[str, GenerationSession] = {}
+
+    def purge_expired(self):
+        now = time.monotonic()
+        expired = [rid for rid, session in self.sessions.items()
+                   if session.finished and now - session.finished_at > SESSION_TTL]
+        for rid in expired:
+            del self.sessions[rid]
+
+    def start(self, session_id: str, request_id: str, websocket: WebSocket) -> GenerationSession:
+        self.purge_expired()
+        session = GenerationSession(session_id, request_id, websocket)
+        session.subscribers.add(websocket)
+        self.sessions[request_id] = session
+        return session
+
+    def get(self, request_id: str) -> Optional[GenerationSession]:
+        self.purge_expired()
+        return self.sessions.get(request_id)
+
+    def latest_for_session(self, session_id: str) -> Optional[GenerationSession]:
+        """Dernière génération d'une conversation (reprise sans request_id)"""
+        self.purge_expired()
+        matches = [s for s in self.sessions.values() if s.session_id == session_id]
+        return matches[-1] if matches else None
+
+    def running_for(self, websocket: WebSocket) -> list:
+        """Générations non terminées lancées par une connexion"""
+        return [s for s in self.sessions.values() if s.owner is websocket and not s.finished]
+
+    def followed_by(self, websocket: WebSocket) -> list:
+        """Générations non terminées suivies par une connexion (lancées ou rejointes)"""
+        return [s for s in self.sessions.values()
+                if not s.finished and (s.owner is websocket or websocket in s.subscribers)]
+
+    def find_in_flight(self, key: str) -> Optional[GenerationSession]:
+        """Génération en cours pour un prompt identique (single-flight)"""
+        for session in self.sessions.values():
+            if session.flight_key == key and not session.finished:
+                return session
+        return None
+
+    def detach(self, websocket: WebSocket) -> list:
+        """Détacher une connexion fermée ; retourne les générations restées sans client"""
+        orphaned = []
+        for session in self.sessions.values():
+            session.subscribers.discard(websocket)
+            if not session.finished and not session.subscribers:
+                orphaned.append(session)
+        return orphaned
+
+    def running_count(self) -> int:
+        return sum(1 for s in self.sessions.values() if not s.finished)
+
+    def cancel_all(self):
+        for session in self.sessions.values():
+            session.cancel()
+
+
+session_store = SessionStore()
+
+def ws_stats() -> dict:
+    """Connexions et générations WebSocket (pour /health)"""
     return {
-        "status": "healthy", 
-        "message": "SIFHR RAG WebSocket API is running",
-        "agent_status": "initialized" if global_agent else "not_initialized",
-        "type": "websocket"
+        "connections": len(manager.active_connections),
+        "generations": session_store.running_count()
     }
 
-@app.websocket("/ws")
+@router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
@@ -336,10 +243,21 @@ async def websocket_endpoint(websocket: WebSocket):
             
             try:
                 message_data = json.loads(data)
+                if not isinstance(message_data, dict):
+                    await manager.send_json_message({
+                        "type": "error",
+                        "error": "Le message doit etre un objet JSON"
+                    }, websocket)
+                    continue
                 message_type = message_data.get('type')
                 
                 if message_type == 'chat':
+                    # La génération tourne dans sa propre tâche : la connexion reste réactive
                     await handle_chat_message(websocket, message_data)
+                elif message_type == 'cancel':
+                    await handle_cancel_message(websocket, message_data)
+                elif message_type == 'resume':
+                    await handle_resume_message(websocket, message_data)
                 elif message_type == 'ping':
                     await manager.send_json_message({"type": "pong"}, websocket)
                 else:
@@ -355,50 +273,150 @@ async def websocket_endpoint(websocket: WebSocket):
                 }, websocket)
                 
     except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Erreur WebSocket: {e}")
+    finally:
+        # Quelle que soit la cause de la fin de la connexion : ne pas laisser de sessions orphelines
         manager.disconnect(websocket)
+        cleanup_connection(websocket)
+
+def cleanup_connection(websocket: WebSocket):
+    """Détacher la connexion de ses générations ; celles qui ne sont pas reprises dans
+    le délai de grâce sont annulées pour ne pas laisser tourner l'agent pour rien"""
+    orphaned = session_store.detach(websocket)
+    if not orphaned:
+        return
+    loop = asyncio.get_running_loop()
+    for session in orphaned:
+        loop.call_later(ORPHAN_GRACE, session.cancel_if_orphaned)
 
-async def stream_response_to_websocket(websocket: WebSocket, text: str, session_id: str):
-    """Envoie le texte mot par mot via WebSocket pour un effet de streaming"""
-    words = text.split()
-    current_text = ""
+async def reject_invalid_field(websocket: WebSocket, field: str, expected: str):
+    """Champ de message mal typé : frame d'erreur, la connexion et ses autres générations continuent"""
+    await manager.send_json_message({
+        "type": "error",
+        "error": f"Champ {field} invalide ({expected} attendu)"
+    }, websocket)
+
+async def handle_cancel_message(websocket: WebSocket, message_data: dict):
+    """Annuler une génération (request_id) ou toutes celles lancées par la connexion"""
+    request_id = message_data.get('request_id')
+    if request_id is not None and not isinstance(request_id, str):
+        await reject_invalid_field(websocket, 'request_id', 'chaine')
+        return
     
-    for i, word in enumerate(words):
-        current_text += word + " "
-        
-        # Envoyer un chunk tous les 3-5 mots pour un effet fluide
-        if i % 4 == 0 or i == len(words) - 1:
+    if request_id:
+        session = session_store.get(request_id)
+        if session is None or (session.owner is not websocket and websocket not in session.subscribers):
             await manager.send_json_message({
-                "type": "streaming_response",
-                "session_id": session_id,
-                "chunk": current_text,
-                "is_final": i == len(words) - 1,
-                "progress": round((i + 1) / len(words) * 100, 1)
+                "type": "error",
+                "error": "Generation inconnue",
+                "request_id": request_id
             }, websocket)
-            
-            # Petit délai pour l'effet de streaming
-            await asyncio.sleep(0.05)
+            return
+        sessions = [session]
+    else:
+        sessions = session_store.followed_by(websocket)
     
-    # Message final avec le texte complet
-    await manager.send_json_message({
+    # Une génération partagée n'est annulée que lorsque son dernier client l'abandonne
+    cancelled = [s.request_id for s in sessions if await s.leave(websocket)]
+    print(f"Annulation demandee: {len(cancelled)} generation(s) annulee(s)")
+
+async def handle_resume_message(websocket: WebSocket, message_data: dict):
+    """Reprendre une génération après reconnexion : frames manqués puis flux en direct"""
+    session_id = message_data.get('session_id') or ''
+    request_id = message_data.get('request_id')
+    last_seq = message_data.get('last_seq')
+    if not isinstance(session_id, str):
+        await reject_invalid_field(websocket, 'session_id', 'chaine')
+        return
+    if request_id is not None and not isinstance(request_id, str):
+        await reject_invalid_field(websocket, 'request_id', 'chaine')
+        return
+    if last_seq is None:
+        last_seq = -1
+    elif isinstance(last_seq, str) and last_seq.lstrip('-').isdigit():
+        last_seq = int(last_seq)
+    elif isinstance(last_seq, bool) or not isinstance(last_seq, int):
+        await reject_invalid_field(websocket, 'last_seq', 'entier')
+        return
+    
+    if request_id:
+        session = session_store.get(request_id)
+    else:
+        session = session_store.latest_for_session(session_id)
+    if session is None:
+        await manager.send_json_message({
+            "type": "error",
+            "error": "Session inconnue ou expiree",
+            "session_id": session_id,
+            "request_id": request_id,
+            "resume_failed": True
+        }, websocket)
+        return
+    
+    replayed = await session.resume(websocket, last_seq)
+    print(f"Reprise de la generation {session.request_id} depuis seq={last_seq}: {replayed} frames rejoues")
+
+async def stream_response_to_session(session: GenerationSession, text: str,
+                                     include_full_response: bool = False, partial: bool = False):
+    """Envoie le texte par deltas séquencés via la session pour un effet de streaming
+
+    Chaque frame ne contient que le nouveau fragment (delta) ; son numéro de séquence est
+    attribué par la session. La bande passante et le coût de sérialisation restent
+    linéaires en la taille du texte. Le message final porte un checksum SHA-256 du texte
+    complet au lieu de le répéter.
+    """
+    tokens = STREAM_TOKEN_PATTERN.findall(text)
+    total = len(tokens)
+    frames = 0
+    
+    for start in range(0, total, STREAM_WORDS_PER_FRAME):
+        delta = ''.join(tokens[start:start + STREAM_WORDS_PER_FRAME])
+        sent = min(start + STREAM_WORDS_PER_FRAME, total)
+        
+        await session.publish({
+            "type": "streaming_response",
+            "delta": delta,
+            "is_final": sent == total,
+            "progress": round(sent / total * 100, 1)
+        })
+        frames += 1
+        
+        # Petit délai pour l'effet de streaming
+        if STREAM_FRAME_DELAY:
+            await asyncio.sleep(STREAM_FRAME_DELAY)
+    
+    # Message final : checksum du texte complet (le client vérifie la concaténation des deltas)
+    final_message = {
         "type": "chat_response",
-        "session_id": session_id,
-        "response": text,
+        "frames": frames,
         "length": len(text),
-        "processing_time": "WebSocket Streaming"
-    }, websocket)
+        "checksum": hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        "processing_time": "WebSocket Streaming",
+        "partial": partial
+    }
+    if include_full_response:
+        final_message["response"] = text
+    await session.publish(final_message)
 
 async def handle_chat_message(websocket: WebSocket, message_data: dict):
-    """Traiter les messages de chat et générer les scénarios"""
+    """Valider un message de chat et lancer sa génération dans une tâche dédiée"""
     
-    if not global_agent:
+    if not engine.ready:
         await manager.send_json_message({
             "type": "error",
             "error": "Système RAG agentique non initialisé. Veuillez réessayer plus tard."
         }, websocket)
         return
     
-    user_message = message_data.get('message', '')
-    session_id = message_data.get('session_id', f'ws_{id(websocket)}')
+    for field in ('message', 'session_id', 'request_id', 'mode'):
+        if message_data.get(field) is not None and not isinstance(message_data[field], str):
+            await reject_invalid_field(websocket, field, 'chaine')
+            return
+    
+    user_message = message_data.get('message') or ''
+    session_id = message_data.get('session_id') or f'ws_{uuid.uuid4().hex}'
     
     if not user_message.strip():
         await manager.send_json_message({
@@ -407,27 +425,104 @@ async def handle_chat_message(websocket: WebSocket, message_data: dict):
         }, websocket)
         return
     
+    request_id = message_data.get('request_id') or uuid.uuid4().hex
+    include_full_response = bool(message_data.get('full_response', False))
+    mode = message_data.get('mode') or GENERATION_MODE
+    if mode not in GENERATION_MODES:
+        await manager.send_json_message({
+            "type": "error",
+            "error": f"Mode inconnu: {mode}",
+            "request_id": request_id
+        }, websocket)
+        return
+    
+    # Prompt identique déjà en cours : rejoindre son flux au lieu de relancer l'agent
+    key = flight_key(user_message, full_response=include_full_response, mode=mode)
+    in_flight = session_store.find_in_flight(key)
+    if in_flight is not None:
+        print(f"Requete {request_id} coalescee avec la generation {in_flight.request_id}")
+        await manager.send_json_message({
+            "type": "attached",
+            "request_id": request_id,
+            "shared_request_id": in_flight.request_id,
+            "session_id": in_flight.session_id
+        }, websocket)
+        await in_flight.resume(websocket, -1)
+        return
+    
+    if len(session_store.running_for(websocket)) >= WS_MAX_CONCURRENT:
+        await manager.send_json_message({
+            "type": "error",
+            "error": f"Trop de generations simultanees (maximum {WS_MAX_CONCURRENT} par connexion)",
+            "request_id": request_id
+        }, websocket)
+        return
+    
+    existing = session_store.get(request_id)
+    if existing is not None and not existing.finished:
+        await manager.send_json_message({
+            "type": "error",
+            "error": "Une generation avec ce request_id est deja en cours",
+            "request_id": request_id
+        }, websocket)
+        return
+    
+    # Tous les frames de la génération passent par la session (rejouables après reconnexion)
+    session = session_store.start(session_id, request_id, websocket)
+    session.flight_key = key
+    session.task = asyncio.create_task(run_generation(
+        session, user_message,
+        include_full_response=include_full_response,
+        mode=mode
+    ))
+
+async def run_generation(session: GenerationSession, user_message: str,
+                         include_full_response: bool = False, mode: str = "agent"):
+    """Générer un scénario avec l'agent et le streamer via la session (annulable)"""
+    
     # Envoyer confirmation de réception
-    await manager.send_json_message({
+    await session.publish({
         "type": "status",
         "status": "processing",
         "message": "L'agent reflechit et consulte la base de connaissances..."
-    }, websocket)
+    })
     
     try:
         # Traitement asynchrone du message
         await asyncio.sleep(0.1)  # Petit délai pour éviter blocking
         
         # Invoquer l'agent RAG agentique avec streaming
-        await manager.send_json_message({
+        await session.publish({
             "type": "status",
             "status": "generating",
             "message": "Generation en cours..."
-        }, websocket)
+        })
         
-        result = await asyncio.get_event_loop().run_in_executor(
-            None, lambda: global_agent.invoke({"input": user_message})
-        )
+        # Chemin async : la génération est une tâche de la boucle, annulée avec la session ou à l'échéance
+        control = GenerationControl(timeout=CHAT_DEADLINE, cancel_event=session.cancel_event)
+        callbacks = [control, prompt_cache_metrics]
+        partial = False
+        try:
+            if mode == "sections":
+                # Plan puis sections en parallèle (voir sectioned_generation)
+                rag_tool = engine.rag_tool
+                sectioned = await arun_with_control(
+                    rag_tool.agenerate_sectioned_scenario(user_message, callbacks=callbacks),
+                    control
+                )
+                result = {"output": sectioned['text'], "intermediate_steps": []}
+            else:
+                result = await arun_with_control(
+                    engine.agent.ainvoke({"input": user_message}, config={"callbacks": callbacks}),
+                    control
+                )
+        except GenerationDeadlineExceeded:
+            # Échéance dépassée : renvoyer ce qui a été généré jusque-là
+            if not control.partial_output:
+                raise
+            print(f"Generation {session.request_id}: echeance depassee, sortie partielle")
+            result = {"output": control.partial_output, "intermediate_steps": []}
+            partial = True
         
         # Extraction et nettoyage de la réponse (même logique que FastAPI)
         response_text = ""
@@ -483,25 +578,40 @@ async def handle_chat_message(websocket: WebSocket, message_data: dict):
             response_text = response_text.replace(''', "'").replace(''', "'")
         
         # Vérification finale
-        if not response_text or len(response_text) < 100:
+        if not partial and (not response_text or len(response_text) < 100):
             response_text = "# SCÉNARIO DE DÉMONSTRATION\n\nErreur temporaire. Le système a généré du contenu mais il y a eu un problème d'extraction. Veuillez réessayer."
         
         # Envoyer la réponse via WebSocket avec streaming
-        await stream_response_to_websocket(websocket, response_text, session_id)
+        await stream_response_to_session(
+            session, response_text,
+            include_full_response=include_full_response,
+            partial=partial
+        )
         
         print(f"Reponse WebSocket envoyee ({len(response_text)} caracteres)")
         
+    except GenerationDeadlineExceeded:
+        print(f"Generation {session.request_id}: echeance depassee sans sortie")
+        await session.publish({
+            "type": "error",
+            "error": f"Echeance de {CHAT_DEADLINE:.0f}s depassee avant toute generation"
+        })
+        
+    except (asyncio.CancelledError, GenerationCancelled):
+        # Annulée par le client : la tâche de l'agent est annulée dans la boucle d'événements
+        # (arun_with_control) et GenerationControl arrête tout callback encore en cours
+        session.cancel_event.set()
+        print(f"Generation {session.request_id} annulee")
+        await session.publish({
+            "type": "cancelled",
+            "message": "Generation annulee"
+        })
+        
     except Exception as e:
         error_msg = str(e).encode('ascii', 'ignore').decode('ascii')
         print(f"Erreur lors du traitement WebSocket: {error_msg}")
         
-        await manager.send_json_message({
+        await session.publish({
             "type": "error",
-            "error": f"Erreur lors du traitement: {error_msg}",
-            "session_id": session_id
-        }, websocket)
-
-if __name__ == "__main__":
-    import uvicorn
-    print("Demarrage du serveur WebSocket SIFHR sur le port 8002...")
-    uvicorn.run("main_websocket:app", host="127.0.0.1", port=8002, reload=False)
\ No newline at end of file
+            "error": f"Erreur lors du traitement: {error_msg}"
+        })
@@ -0,0 +1,178 @@
+import re
+import threading
+from pymilvus import MilvusClient, DataType
+from config import Config
+from vectors import as_search_vectors
+
+# Base de connaissances interrogée par l'agent (nom historique de la collection)
+KNOWLEDGE_COLLECTION = "data_sifhr"
+# Description des versions : fournisseur d'embedding avec lequel la collection a été construite
+EMBEDDING_PROVIDER_PATTERN = re.compile(r'embedding_provider=(\w+)')
+
+
+_client = None
+_known_collections = set()
+_collection_lock = threading.Lock()
+
+
+def get_milvus_client():
+    # Client partagé : une seule connexion gRPC pour tout le serveur
+    global _client
+    if _client is None:
+        _client = MilvusClient(
+            uri=f"http://{Config.MILVUS_HOST}:{Config.MILVUS_PORT}"
+        )
+    return _client
+
+
+def has_collection(collection_name):
+    return get_milvus_client().has_collection(collection_name)
+
+
+def collection_fields(collection_name):
+    """Noms des champs du schéma (ensemble vide si la collection est inaccessible)"""
+    try:
+        return {field['name'] for field in get_milvus_client().describe_collection(collection_name)['fields']}
+    except Exception:
+        return set()
+
+
+def live_alias(collection_name):
+    """Alias blue/green qui désigne la version en service d'une collection"""
+    return f"{collection_name}_live"
+
+
+def embedding_provider_of(collection_name):
+    """Fournisseur d'embedding enregistré dans la description (None pour une collection historique)"""
+    description = get_milvus_client().describe_collection(collection_name).get('description') or ''
+    match = EMBEDDING_PROVIDER_PATTERN.search(description)
+    return match.group(1) if match else None
+
+
+def resolve_collection(collection_name):
+    """Collection physique à interroger et son fournisseur d'embedding
+
+    Si l'alias blue/green existe, il est résolu vers la version qu'il désigne ; sinon la
+    collection historique est utilisée telle quelle. Le retriever est ainsi attaché à une
+    version fixe : une bascule d'alias n'affecte pas les requêtes en cours.
+    """
+    try:
+        physical = get_milvus_client().describe_alias(alias=live_alias(collection_name))['collection_name']
+    except Exception:
+        # Pas d'alias (ou Milvus indisponible : le retriever gère ce cas)
+        physical = collection_name
+    try:
+        provider = embedding_provider_of(physical)
+    except Exception:
+        provider = None
+    return physical, provider
+
+
+def ensure_scenario_collection(collection_name, dim):
+    """Créer la collection de scénarios (et son index) au premier usage, sans jamais la supprimer"""
+    if collection_name in _known_collections:
+        return
+    with _collection_lock:
+        if collection_name in _known_collections:
+            return
+        client = get_milvus_client()
+
+        if not client.has_collection(collection_name):
+            schema = client.create_schema(auto_id=True, enable_dynamic_field=True)
+
+            schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
+            schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=dim)
+            schema.add_field(field_name="text", datatype=DataType.VARCHAR, max_length=65535)
+            schema.add_field(field_name="title", datatype=DataType.VARCHAR, max_length=1024)
+            schema.add_field(field_name="type", datatype=DataType.VARCHAR, max_length=128)
+            schema.add_field(field_name="source", datatype=DataType.VARCHAR, max_length=1024)
+            schema.add_field(field_name="embedding_date", datatype=DataType.VARCHAR, max_length=64)
+            schema.add_field(field_name="chunk_index", datatype=DataType.INT64)
+            # Identifiant du scénario, commun à tous ses chunks (champ dynamique dans les
+            # collections créées avant lui)
+            schema.add_field(field_name="scenario_id", datatype=DataType.INT64)
+            # Signature MinHash du scénario (JSON), renseignée sur le chunk 0 uniquement
+            schema.add_field(field_name="minhash", datatype=DataType.VARCHAR, max_length=8192)
+
+            index_params = client.prepare_index_params()
+            index_params.add_index(
+                field_name="vector",
+                index_type="IVF_FLAT",
+                metric_type="COSINE",
+                params={"nlist": 128}
+            )
+
+            client.create_collection(
+                collection_name=collection_name,
+                schema=schema,
+                index_params=index_params
+            )
+            print(f"Collection {collection_name} créée avec succès.")
+
+        _known_collections.add(collection_name)
+
+
+def insert_rows(collection_name, rows, batch_size=1000):
+    """Insérer des lignes déjà construites par lots"""
+    client = get_milvus_client()
+    total_inserted = 0
+
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        client.insert(collection_name=collection_name, data=batch)
+        total_inserted += len(batch)
+
+    return total_inserted
+
+
+def search_batch(collection_name, query_embeddings, limit=5, output_fields=None, filter=''):
+    """Recherche vectorielle groupée : une seule requête pour toutes les embeddings
+
+    query_embeddings : matrice float32 (ou listes de floats, converties une fois) ; chaque
+    ligne est transmise à pymilvus en tableau float32, sérialisé tel quel en octets.
+    """
+    client = get_milvus_client()
+
+    return client.search(
+        collection_name=collection_name,
+        data=as_search_vectors(query_embeddings),
+        anns_field="vector",
+        search_params={"metric_type": "COSINE", "params": {"nprobe": 10}},
+        output_fields=output_fields or ["text", "title"],
+        filter=filter,
+        limit=limit
+    )
+
+
+_async_client = None
+
+
+def get_async_milvus_client():
+    """Client Milvus async partagé, créé au premier appel dans la boucle d'événements du serveur"""
+    global _async_client
+    if _async_client is None:
+        from pymilvus import AsyncMilvusClient
+        _async_client = AsyncMilvusClient(
+            uri=f"http://{Config.MILVUS_HOST}:{Config.MILVUS_PORT}"
+        )
+    return _async_client
+
+
+async def ahas_collection(collection_name):
+    # Collections déjà vues : aucun aller-retour
+    if collection_name in _known_collections:
+        return True
+    return await get_async_milvus_client().has_collection(collection_name)
+
+
+async def asearch_batch(collection_name, query_embeddings, limit=5, output_fields=None, filter=''):
+    """Version async de search_batch : la boucle d'événements n'est pas bloquée pendant la recherche"""
+    return await get_async_milvus_client().search(
+        collection_name=collection_name,
+        data=as_search_vectors(query_embeddings),
+        anns_field="vector",
+        search_params={"metric_type": "COSINE", "params": {"nprobe": 10}},
+        output_fields=output_fields or ["text", "title"],
+        filter=filter,
+        limit=limit
+    )
@@ -3,7 +3,12 @@ from langchain_milvus import Milvus
 from langchain_anthropic import ChatAnthropic
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_groq import ChatGroq
+from langchain_core.language_models.chat_models import agenerate_from_stream, generate_from_stream
 from config import Config
+from chunking_embedding import get_embedding_model
+from milvus_client import resolve_collection
+from document_catalog import CatalogRetriever
+from federated_retriever import FederatedRetriever
 
 
 def get_multi_query_retriever(llm, retriever):
@@ -14,14 +19,24 @@ def get_multi_query_retriever(llm, retriever):
     )
 
 
-def create_vectorstore_retriever(collection_name, embedding_model):
+def create_vectorstore_retriever(collection_name, embedding_model=None, expr=None):
+    # expr : filtre Milvus sur des champs scalaires indexés (ex. 'theme in ["andalus"]')
     try:
+        # Alias blue/green résolu vers la version en service ; sans modèle fourni, utiliser
+        # celui avec lequel cette version a été construite
+        physical_name, provider = resolve_collection(collection_name)
+        if physical_name != collection_name:
+            print(f"Collection {collection_name}: version {physical_name} (embeddings {provider or 'par defaut'})")
+        if embedding_model is None:
+            embedding_model = get_embedding_model(provider)
         vectorstore = Milvus(
-            collection_name=collection_name,
+            collection_name=physical_name,
             embedding_function=embedding_model,
             connection_args={"host": Config.MILVUS_HOST, "port": Config.MILVUS_PORT}
         )
-        return vectorstore.as_retriever()
+        # Les chunks ne portent que doc_id : source et chemin MinIO viennent du catalogue
+        search_kwargs = {"expr": expr} if expr else {}
+        return CatalogRetriever(retriever=vectorstore.as_retriever(search_kwargs=search_kwargs))
     except Exception as e:
         print(f"Warning: Could not connect to Milvus: {e}")
         # Créer un retriever factice pour les tests
@@ -36,15 +51,51 @@ def create_vectorstore_retriever(collection_name, embedding_model):
         return MockRetriever()
 
 
-def get_llm():
+def scope_retriever(retriever, expr):
+    """Même base vectorielle restreinte par un filtre scalaire, sans nouvelle connexion
+
+    Si la recherche restreinte ne trouve rien, le retriever d'origine prend le relais.
+    """
+    if not expr:
+        return retriever
+    if isinstance(retriever, FederatedRetriever):
+        return retriever.scoped(expr)
+    if not isinstance(retriever, CatalogRetriever):
+        return retriever
+    inner = retriever.retriever
+    search_kwargs = dict(inner.search_kwargs, expr=expr)
+    return CatalogRetriever(retriever=inner.vectorstore.as_retriever(search_kwargs=search_kwargs),
+                            catalog=retriever.catalog, fallback=retriever)
+
+
+class StreamingChatGoogleGenerativeAI(ChatGoogleGenerativeAI):
+    """Gemini dont invoke/ainvoke passent par le flux : chaque token atteint les callbacks
+    (GenerationControl), comme ChatAnthropic avec streaming=True"""
+
+    streaming: bool = True
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if not self.streaming:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if not self.streaming:
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        return await agenerate_from_stream(self._astream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+
+def get_llm(streaming=False):
     # Essayer Claude d'abord, puis fallback vers Google Gemini
+    # streaming=True : les tokens passent par les callbacks (annulation en cours de génération)
     try:
         print("Tentative d'utilisation de Claude Anthropic...")
         llm = ChatAnthropic(
             anthropic_api_key=Config.ANTHROPIC_API_KEY,
             model=Config.CLAUDE_MODEL,
             temperature=0.6,
-            max_tokens=10000
+            max_tokens=10000,
+            streaming=streaming
         )
         # Test rapide pour vérifier si la clé fonctionne
         test_response = llm.invoke("Test")
@@ -54,10 +105,12 @@ def get_llm():
         print(f"[ERREUR] Claude echoue: {e}")
         print("[INFO] Passage a Google Gemini...")
         
-        # Fallback vers Google Gemini
-        return ChatGoogleGenerativeAI(
+        # Fallback vers Google Gemini (en streaming lui aussi : échéance et annulation
+        # vérifiées à chaque token, pas seulement entre deux appels)
+        return StreamingChatGoogleGenerativeAI(
             google_api_key=Config.GOOGLE_API_KEY,
             model=Config.GEMINI_MODEL,
             temperature=0.6,
-            max_output_tokens=10000
+            max_output_tokens=10000,
+            streaming=streaming
         )
\ No newline at end of file
@@ -0,0 +1,185 @@
+"""Export PDF par lots : rendu parallèle dans un pool de processus et ZIP en streaming"""
+import os
+import json
+import uuid
+import asyncio
+import zipfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from pdf_converter import remove_file
+
+# Nombre de processus de rendu (ReportLab est limité par le GIL : un processus par cœur)
+PDF_WORKERS = int(os.getenv('SIFHR_PDF_WORKERS', os.cpu_count() or 2))
+# Nombre maximal de scénarios par lot
+PDF_BATCH_MAX = int(os.getenv('SIFHR_PDF_BATCH_MAX', 100))
+# Nombre de lots dont la progression est conservée
+PROGRESS_HISTORY = 100
+
+ZIP_CHUNK_SIZE = 64 * 1024
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# Progression par lot : batch_id -> état
+batch_progress: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def render_pdf_file(scenario_content: str, scenario_title: str) -> Tuple[str, str]:
+    """Rendu d'un scénario dans un fichier temporaire (exécuté dans un processus du pool)"""
+    from pdf_converter import pdf_converter
+    return pdf_converter.convert_to_file(scenario_content, scenario_title)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Retourner le pool de processus partagé (créé au premier usage)"""
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is None:
+            # spawn : un fork du serveur (threads uvicorn, clients HTTP, verrous) peut se bloquer
+            _process_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+            print(f"Pool de rendu PDF demarre ({PDF_WORKERS} processus)")
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """Arrêter le pool de processus (à l'arrêt de l'application)"""
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+class ZipStreamBuffer:
+    """Cible d'écriture non seekable pour zipfile : les octets écrits sont vidés à chaque envoi"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def create_batch(titles: List[str], batch_id: Optional[str] = None) -> str:
+    """Enregistrer un nouveau lot et son état de progression initial"""
+    batch_id = batch_id or str(uuid.uuid4())
+    batch_progress[batch_id] = {
+        'batch_id': batch_id,
+        'status': 'pending',
+        'total': len(titles),
+        'completed': 0,
+        'failed': 0,
+        'started_at': str(datetime.now()),
+        'finished_at': None,
+        'items': [
+            {'index': i, 'title': title, 'status': 'pending', 'filename': None, 'size': None, 'error': None}
+            for i, title in enumerate(titles)
+        ],
+    }
+    batch_progress.move_to_end(batch_id)
+    while len(batch_progress) > PROGRESS_HISTORY:
+        batch_progress.popitem(last=False)
+    return batch_id
+
+
+def get_batch_progress(batch_id: str) -> Optional[dict]:
+    """Retourner l'état de progression d'un lot"""
+    return batch_progress.get(batch_id)
+
+
+async def stream_pdf_batch(batch_id: str, scenarios: List[Tuple[str, str]]) -> AsyncIterator[bytes]:
+    """Rendre les scénarios en parallèle et produire le ZIP au fur et à mesure des PDF terminés
+
+    Les entrées apparaissent dans le ZIP dans l'ordre de fin de rendu ; un fichier
+    manifest.json final récapitule l'état de chaque scénario.
+    """
+    pool = get_process_pool()
+    progress = batch_progress[batch_id]
+    progress['status'] = 'running'
+
+    futures = [pool.submit(render_pdf_file, content, title) for title, content in scenarios]
+
+    async def wait_render(index: int, future: Future):
+        try:
+            path, filename = await asyncio.wrap_future(future)
+            return index, path, filename, None
+        except Exception as e:
+            return index, None, None, str(e)
+
+    tasks = [asyncio.ensure_future(wait_render(i, future)) for i, future in enumerate(futures)]
+    zip_stream = ZipStreamBuffer()
+
+    try:
+        with zipfile.ZipFile(zip_stream, 'w', compression=zipfile.ZIP_STORED) as zf:
+            for next_done in asyncio.as_completed(tasks):
+                index, path, filename, error = await next_done
+                item = progress['items'][index]
+
+                if error is not None:
+                    item['status'] = 'failed'
+                    item['error'] = error
+                    progress['failed'] += 1
+                    print(f"Lot {batch_id}: echec du scenario {index + 1}: {error}")
+                    continue
+
+                arcname = f"{index + 1:03d}_{filename}"
+                try:
+                    with open(path, 'rb') as src, zf.open(arcname, 'w', force_zip64=True) as dst:
+                        while True:
+                            chunk = src.read(ZIP_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            dst.write(chunk)
+                            data = zip_stream.drain()
+                            if data:
+                                yield data
+                    item['size'] = os.path.getsize(path)
+                finally:
+                    remove_file(path)
+
+                item['status'] = 'done'
+                item['filename'] = arcname
+                progress['completed'] += 1
+                data = zip_stream.drain()
+                if data:
+                    yield data
+
+            progress['status'] = 'done'
+            progress['finished_at'] = str(datetime.now())
+            zf.writestr('manifest.json', json.dumps(progress, ensure_ascii=False, indent=2))
+
+        # Répertoire central écrit à la fermeture du ZIP
+        yield zip_stream.drain()
+
+    finally:
+        # Client déconnecté ou erreur : annuler les rendus en attente et nettoyer les fichiers
+        if progress['status'] != 'done':
+            progress['status'] = 'cancelled'
+            for task in tasks:
+                task.cancel()
+            for future in futures:
+                if not future.cancel():
+                    future.add_done_callback(_discard_rendered_file)
+
+
+def _discard_rendered_file(future: Future):
+    """Supprimer le fichier d'un rendu dont le résultat ne sera pas envoyé"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    path, _ = future.result()
+    remove_file(path)
@@ -1,25 +1,261 @@
 
 from io import BytesIO
+from collections import OrderedDict
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
+from reportlab.platypus.flowables import HRFlowable
+from xml.sax.saxutils import escape as xml_escape
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 
 from reportlab.lib.colors import HexColor
 import re
+import os
+import hashlib
 import logging
-from typing import Tuple
-from datetime import datetime
+import shutil
+import tempfile
+import threading
+from typing import Tuple, Optional, Iterator, Union, BinaryIO
+from datetime import date, datetime
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Expressions du tokenizer markdown (compilées une seule fois)
+BLOCK_PATTERN = re.compile(
+    r'^(?:(?P<heading>#{1,6})\s+(?P<heading_text>.*)'
+    r'|(?P<hr>(?:-\s*){3,}|(?:\*\s*){3,}|(?:_\s*){3,})'
+    r'|(?P<bullet>[-•*+])\s+(?P<bullet_text>.*)'
+    r'|(?P<number>\d{1,3})[.)]\s+(?P<number_text>.*)'
+    r'|>\s?(?P<quote_text>.*))$'
+)
+BOLD_PATTERN = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__')
+ITALIC_PATTERN = re.compile(r'(?<![*\w])\*(?=\S)(.+?)(?<=\S)\*(?![*\w])|(?<![_\w])_(?=\S)(.+?)(?<=\S)_(?![_\w])')
+CODE_PATTERN = re.compile(r'`([^`]+)`')
+
+
+class PDFCache:
+    """Cache LRU adressé par contenu pour les PDF rendus et les éléments parsés
+
+    - Les PDF sont indexés par un hash (date de génération imprimée + titre + contenu) et évincés selon leur taille
+      totale en mémoire ; un répertoire disque optionnel sert de second niveau.
+    - Les éléments parsés (blocs tokenisés) sont indexés par le hash du contenu seul,
+      ce qui permet de régénérer un PDF avec un autre titre sans re-parser le markdown.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_elements: int = 64,
+                 cache_dir: Optional[str] = None, max_disk_bytes: int = 512 * 1024 * 1024,
+                 max_file_memory_bytes: int = 512 * 1024):
+        self.max_bytes = max_bytes
+        # Rendus fichier (convert_to_file) copiés aussi en mémoire jusqu'à cette taille seulement
+        self.max_file_memory_bytes = max_file_memory_bytes
+        self.max_elements = max_elements
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._pdfs: "OrderedDict[str, bytes]" = OrderedDict()
+        self._elements: "OrderedDict[str, list]" = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.element_hits = 0
+        self.element_misses = 0
+        self.evictions = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def content_key(content: str) -> str:
+        """Clé des éléments parsés : hash du contenu uniquement"""
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def pdf_key(content: str, title: str, generated_on: Optional[date] = None) -> str:
+        """Clé du PDF rendu : hash de la date de génération imprimée, du titre et du contenu"""
+        digest = hashlib.sha256()
+        digest.update((generated_on or date.today()).isoformat().encode('utf-8'))
+        digest.update(b'\x00')
+        digest.update(title.encode('utf-8'))
+        digest.update(b'\x00')
+        digest.update(content.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_pdf(self, key: str, disk: bool = True) -> Optional[bytes]:
+        """Retourner les bytes d'un PDF en cache (mémoire puis disque si disk)"""
+        with self._lock:
+            pdf_bytes = self._pdfs.get(key)
+            if pdf_bytes is not None:
+                self._pdfs.move_to_end(key)
+                self.hits += 1
+                return pdf_bytes
+
+        pdf_bytes = self._read_disk(key) if disk else None
+        with self._lock:
+            if pdf_bytes is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store_pdf(key, pdf_bytes)
+        return pdf_bytes
+
+    def put_pdf(self, key: str, pdf_bytes: bytes):
+        """Stocker un PDF rendu en mémoire (et sur disque si configuré)"""
+        with self._lock:
+            self._store_pdf(key, pdf_bytes)
+        self._write_disk(key, pdf_bytes)
+
+    def get_elements(self, key: str) -> Optional[list]:
+        """Retourner une copie de la liste d'éléments parsés (blocs tokenisés)"""
+        with self._lock:
+            elements = self._elements.get(key)
+            if elements is None:
+                self.element_misses += 1
+                return None
+            self._elements.move_to_end(key)
+            self.element_hits += 1
+            return list(elements)
+
+    def put_elements(self, key: str, elements: list):
+        """Stocker la liste d'éléments parsés pour un contenu"""
+        with self._lock:
+            self._elements[key] = list(elements)
+            self._elements.move_to_end(key)
+            while len(self._elements) > self.max_elements:
+                self._elements.popitem(last=False)
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Retourner le chemin du PDF dans le cache disque, sans le charger en mémoire"""
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        return path
+
+    def put_file(self, key: str, path: str):
+        """Stocker un PDF rendu dans un fichier : copie fichier à fichier dans le cache disque,
+        et en mémoire uniquement s'il est petit (pas de copie complète des gros PDF)"""
+        if self.cache_dir:
+            try:
+                tmp_path = f"{self._disk_path(key)}.{threading.get_ident()}.tmp"
+                shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, self._disk_path(key))
+                self._evict_disk()
+            except OSError as e:
+                logger.warning(f"[ATTENTION] Ecriture cache PDF impossible: {e}")
+        try:
+            if os.path.getsize(path) <= self.max_file_memory_bytes:
+                with open(path, 'rb') as f:
+                    pdf_bytes = f.read()
+                with self._lock:
+                    self._store_pdf(key, pdf_bytes)
+        except OSError as e:
+            logger.warning(f"[ATTENTION] Lecture du PDF rendu impossible: {e}")
+
+    def _store_pdf(self, key: str, pdf_bytes: bytes):
+        if len(pdf_bytes) > self.max_bytes:
+            return
+        previous = self._pdfs.pop(key, None)
+        if previous is not None:
+            self._current_bytes -= len(previous)
+        self._pdfs[key] = pdf_bytes
+        self._current_bytes += len(pdf_bytes)
+        while self._current_bytes > self.max_bytes:
+            _, evicted = self._pdfs.popitem(last=False)
+            self._current_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                pdf_bytes = f.read()
+            os.utime(path, None)  # Marquer comme récemment utilisé
+            return pdf_bytes
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, pdf_bytes: bytes):
+        if not self.cache_dir:
+            return
+        try:
+            tmp_path = f"{self._disk_path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, self._disk_path(key))
+            self._evict_disk()
+        except OSError as e:
+            logger.warning(f"[ATTENTION] Ecriture cache PDF impossible: {e}")
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pdf'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_disk_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+            if total <= self.max_disk_bytes:
+                break
+
+    def clear(self):
+        """Vider le cache mémoire (le disque est conservé)"""
+        with self._lock:
+            self._pdfs.clear()
+            self._elements.clear()
+            self._current_bytes = 0
+
+    def stats(self) -> dict:
+        """Statistiques d'utilisation du cache"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            element_lookups = self.element_hits + self.element_misses
+            return {
+                'pdf_entries': len(self._pdfs),
+                'pdf_bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+                'element_entries': len(self._elements),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                'element_hits': self.element_hits,
+                'element_misses': self.element_misses,
+                'element_hit_rate': round(self.element_hits / element_lookups, 3) if element_lookups else 0.0,
+                'evictions': self.evictions,
+                'disk_enabled': bool(self.cache_dir),
+            }
+
 class PDFConverter:
     """Classe pour convertir automatiquement les scénarios en PDF"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[PDFCache] = None):
         """Initialiser le convertisseur PDF"""
         self.setup_fonts()
         self.setup_styles()
+        self.cache = cache if cache is not None else PDFCache()
         
     def setup_fonts(self):
         """Configurer les polices pour le PDF"""
@@ -83,6 +319,26 @@ class PDFConverter:
             textColor=HexColor('#1e3c72')
         ))
         
+        # Style pour les éléments de liste (puces et listes numérotées)
+        self.styles.add(ParagraphStyle(
+            name='CustomListItem',
+            parent=self.styles['CustomBody'],
+            leftIndent=18,
+            bulletIndent=6,
+            spaceBefore=2,
+            spaceAfter=2
+        ))
+        
+        # Style pour les citations (> texte)
+        self.styles.add(ParagraphStyle(
+            name='CustomQuote',
+            parent=self.styles['CustomBody'],
+            leftIndent=24,
+            rightIndent=24,
+            fontName='Helvetica-Oblique',
+            textColor=HexColor('#555555')
+        ))
+        
         # Style pour l'en-tête
         self.styles.add(ParagraphStyle(
             name='Header',
@@ -159,62 +415,127 @@ class PDFConverter:
         
         return clean_text
     
-    def parse_markdown_to_elements(self, content: str) -> list:
-        """Parser le contenu markdown et créer des éléments PDF"""
-        elements = []
+    def format_inline(self, text: str) -> str:
+        """Convertir le markdown en ligne (gras, italique, code) en balises ReportLab"""
+        text = xml_escape(text)
+        if '`' in text:
+            text = CODE_PATTERN.sub(r'<font name="Courier">\1</font>', text)
+        if '**' in text or '__' in text:
+            text = BOLD_PATTERN.sub(lambda m: f"<b>{m.group(1) or m.group(2)}</b>", text)
+        if '*' in text or '_' in text:
+            text = ITALIC_PATTERN.sub(lambda m: f"<i>{m.group(1) or m.group(2)}</i>", text)
+        return text
+
+    def tokenize_markdown(self, content: str) -> list:
+        """Découper le contenu markdown en blocs (type, texte formaté, étiquette)
+
+        Tokenizer en une seule passe : les lignes consécutives sont fusionnées en
+        paragraphes, une suite de lignes vides ne produit qu'un seul espacement et
+        les listes, citations et séparateurs sont reconnus. Les blocs sont des tuples
+        réutilisables d'un rendu à l'autre, contrairement aux flowables ReportLab
+        qui conservent un état de mise en page.
+        """
+        tokens = []
         content = self.clean_text_for_pdf(content)
-        lines = content.split('\n')
-        
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            
+
+        block_kind = None   # 'para', 'bullet', 'number' ou 'quote'
+        block_lines = []
+        block_label = None
+        pending_space = False
+
+        def flush_block():
+            nonlocal block_kind, block_lines, block_label
+            if block_kind:
+                tokens.append((block_kind, self.format_inline(' '.join(block_lines)), block_label))
+            block_kind = None
+            block_lines = []
+            block_label = None
+
+        def add_space():
+            nonlocal pending_space
+            if pending_space and tokens and tokens[-1][0] not in ('space', 'title'):
+                tokens.append(('space', None, None))
+            pending_space = False
+
+        for raw_line in content.split('\n'):
+            line = raw_line.strip()
+
             if not line:
-                elements.append(Spacer(1, 6))
-                i += 1
+                flush_block()
+                pending_space = True
                 continue
-            
-            # Titre principal (# )
-            if line.startswith('# '):
-                title = line[2:].strip()
-                elements.append(Paragraph(title, self.styles['CustomTitle']))
-                elements.append(Spacer(1, 12))
-            
-            # Sous-titre (## )
-            elif line.startswith('## '):
-                subtitle = line[3:].strip()
-                elements.append(Paragraph(subtitle, self.styles['CustomHeading']))
-            
-            # Sous-sous-titre (### )
-            elif line.startswith('### '):
-                subsubtitle = line[4:].strip()
-                para = Paragraph(f"<b>{subsubtitle}</b>", self.styles['CustomBold'])
-                elements.append(para)
-            
-            # Liste à puces
-            elif line.startswith('- ') or line.startswith('• '):
-                bullet_text = line[2:].strip()
-                para = Paragraph(f"• {bullet_text}", self.styles['CustomBody'])
-                elements.append(para)
-            
-            # Texte en gras (**text**)
-            elif '**' in line:
-                # Traiter le markdown gras
-                processed = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', line)
-                para = Paragraph(processed, self.styles['CustomBody'])
-                elements.append(para)
-            
-            # Paragraphe normal
+
+            match = BLOCK_PATTERN.match(line)
+            if match is None:
+                # Ligne de texte : continuation du bloc courant ou nouveau paragraphe
+                if block_kind is None:
+                    add_space()
+                    block_kind = 'para'
+                block_lines.append(line)
+                continue
+
+            if match.group('quote_text') is not None:
+                if block_kind != 'quote':
+                    flush_block()
+                    add_space()
+                    block_kind = 'quote'
+                quote_text = match.group('quote_text').strip()
+                if quote_text:
+                    block_lines.append(quote_text)
+                continue
+
+            flush_block()
+            add_space()
+
+            if match.group('heading'):
+                level = len(match.group('heading'))
+                kind = 'title' if level == 1 else 'heading' if level == 2 else 'subheading'
+                tokens.append((kind, self.format_inline(match.group('heading_text').strip()), None))
+            elif match.group('hr'):
+                tokens.append(('hr', None, None))
+            elif match.group('bullet'):
+                block_kind = 'bullet'
+                block_lines.append(match.group('bullet_text').strip())
             else:
-                if line:
-                    para = Paragraph(line, self.styles['CustomBody'])
-                    elements.append(para)
-            
-            i += 1
-        
+                block_kind = 'number'
+                block_label = match.group('number')
+                block_lines.append(match.group('number_text').strip())
+
+        flush_block()
+        return tokens
+
+    def build_elements(self, tokens: list) -> list:
+        """Créer des flowables ReportLab neufs à partir des blocs tokenisés"""
+        styles = self.styles
+        elements = []
+        for kind, text, label in tokens:
+            if kind == 'para':
+                elements.append(Paragraph(text, styles['CustomBody']))
+            elif kind == 'space':
+                elements.append(Spacer(1, 6))
+            elif kind == 'title':
+                elements.append(Paragraph(text, styles['CustomTitle']))
+                elements.append(Spacer(1, 12))
+            elif kind == 'heading':
+                elements.append(Paragraph(text, styles['CustomHeading']))
+            elif kind == 'subheading':
+                elements.append(Paragraph(f"<b>{text}</b>", styles['CustomBold']))
+            elif kind == 'bullet':
+                elements.append(Paragraph(text, styles['CustomListItem'], bulletText='•'))
+            elif kind == 'number':
+                elements.append(Paragraph(text, styles['CustomListItem'], bulletText=f"{label}."))
+            elif kind == 'quote':
+                elements.append(Paragraph(text, styles['CustomQuote']))
+            elif kind == 'hr':
+                elements.append(HRFlowable(width='100%', thickness=0.5, color=HexColor('#4682b4'),
+                                           spaceBefore=6, spaceAfter=6))
         return elements
+
+    def parse_markdown_to_elements(self, content: str) -> list:
+        """Parser le contenu markdown et créer des éléments PDF"""
+        return self.build_elements(self.tokenize_markdown(content))
     
-    def create_header_footer(self, canvas, doc, title: str):
+    def create_header_footer(self, canvas, doc, title: str, generated_on: Optional[date] = None):
         """Créer l'en-tête et le pied de page"""
         canvas.saveState()
         
@@ -222,7 +543,7 @@ class PDFConverter:
         header_text = f"SIFHR - Scénarios de Chasse au Trésor Arabo-Musulmans"
         canvas.setFont('Helvetica', 9)
         canvas.setFillColor(HexColor('#666666'))
-        canvas.drawCentredText(A4[0]/2, A4[1]-30, header_text)
+        canvas.drawCentredString(A4[0]/2, A4[1]-30, header_text)
         
         # Ligne de séparation
         canvas.setStrokeColor(HexColor('#4682b4'))
@@ -230,68 +551,170 @@ class PDFConverter:
         canvas.line(50, A4[1]-45, A4[0]-50, A4[1]-45)
         
         # Pied de page
-        footer_text = f"Généré le {datetime.now().strftime('%d/%m/%Y à %H:%M')} | Page {canvas.getPageNumber()}"
+        # Date du jour seulement (pas l'heure) : elle fait partie de la clé du cache PDF
+        generated_on = generated_on or date.today()
+        footer_text = f"Généré le {generated_on.strftime('%d/%m/%Y')} | Page {canvas.getPageNumber()}"
         canvas.setFont('Helvetica', 8)
         canvas.setFillColor(HexColor('#888888'))
-        canvas.drawCentredText(A4[0]/2, 30, footer_text)
+        canvas.drawCentredString(A4[0]/2, 30, footer_text)
         
         # Signature SIFHR
-        canvas.drawCentredText(A4[0]/2, 15, "Système Immersif de Fiction Historique Riche © 2024")
+        canvas.drawCentredString(A4[0]/2, 15, "Système Immersif de Fiction Historique Riche © 2024")
         
         canvas.restoreState()
     
-    def convert_to_pdf(self, scenario_content: str, scenario_title: str) -> Tuple[bytes, str]:
+    def get_elements(self, scenario_content: str, use_cache: bool = True) -> list:
+        """Retourner les éléments PDF d'un contenu, en réutilisant le parsing en cache si possible"""
+        if not use_cache:
+            return self.parse_markdown_to_elements(scenario_content)
+
+        key = self.cache.content_key(scenario_content)
+        tokens = self.cache.get_elements(key)
+        if tokens is None:
+            tokens = self.tokenize_markdown(scenario_content)
+            self.cache.put_elements(key, tokens)
+        # Les flowables gardent un état de mise en page : toujours en recréer
+        return self.build_elements(tokens)
+
+    def make_filename(self, scenario_title: str) -> str:
+        """Générer le nom de fichier du PDF"""
+        safe_title = re.sub(r'[^\w\s-]', '', scenario_title)
+        safe_title = re.sub(r'[-\s]+', '-', safe_title)[:50]
+        return f"SIFHR_{safe_title}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+
+    def render(self, target: Union[str, BinaryIO], scenario_content: str, scenario_title: str,
+               use_cache: bool = True, generated_on: Optional[date] = None):
+        """Mettre en page le scénario directement dans un fichier (chemin) ou un flux binaire
+
+        generated_on : date imprimée dans l'en-tête et le pied de page (celle de la clé du
+        cache, pour qu'un PDF en cache n'affiche jamais une date périmée).
+        """
+        generated_on = generated_on or date.today()
+        # Créer le document PDF
+        doc = SimpleDocTemplate(
+            target,
+            pagesize=A4,
+            rightMargin=60,
+            leftMargin=60,
+            topMargin=60,
+            bottomMargin=60,
+            title=scenario_title
+        )
+        
+        # Parser le contenu markdown (ou réutiliser les éléments en cache)
+        elements = self.get_elements(scenario_content, use_cache)
+        
+        # Ajouter l'en-tête du document
+        header_para = Paragraph(
+            f"Généré le {generated_on.strftime('%d %B %Y')}",
+            self.styles['Header']
+        )
+        elements.insert(0, header_para)
+        
+        # Fonction pour l'en-tête/pied de page
+        def add_page_elements(canvas, doc):
+            self.create_header_footer(canvas, doc, scenario_title, generated_on)
+        
+        # Construire le PDF
+        doc.build(elements, onFirstPage=add_page_elements, onLaterPages=add_page_elements)
+
+    def convert_to_pdf(self, scenario_content: str, scenario_title: str, use_cache: bool = True) -> Tuple[bytes, str]:
         """Convertir un scénario en PDF et retourner les bytes + nom de fichier"""
         try:
             logger.info(f"🔄 Conversion PDF démarrée pour: {scenario_title}")
+
+            generated_on = date.today()
+            pdf_key = self.cache.pdf_key(scenario_content, scenario_title, generated_on)
+            if use_cache:
+                cached_bytes = self.cache.get_pdf(pdf_key)
+                if cached_bytes is not None:
+                    logger.info(f"[CACHE] PDF servi depuis le cache: {len(cached_bytes)} bytes")
+                    return cached_bytes, self.make_filename(scenario_title)
             
             # Créer un buffer en mémoire
             buffer = BytesIO()
-            
-            # Créer le document PDF
-            doc = SimpleDocTemplate(
-                buffer,
-                pagesize=A4,
-                rightMargin=60,
-                leftMargin=60,
-                topMargin=60,
-                bottomMargin=60,
-                title=scenario_title
-            )
-            
-            # Parser le contenu markdown
-            elements = self.parse_markdown_to_elements(scenario_content)
-            
-            # Ajouter l'en-tête du document
-            header_para = Paragraph(
-                f"Généré le {datetime.now().strftime('%d %B %Y')}",
-                self.styles['Header']
-            )
-            elements.insert(0, header_para)
-            
-            # Fonction pour l'en-tête/pied de page
-            def add_page_elements(canvas, doc):
-                self.create_header_footer(canvas, doc, scenario_title)
-            
-            # Construire le PDF
-            doc.build(elements, onFirstPage=add_page_elements, onLaterPages=add_page_elements)
+            self.render(buffer, scenario_content, scenario_title, use_cache, generated_on)
             
             # Récupérer les bytes
             pdf_bytes = buffer.getvalue()
             buffer.close()
-            
-            # Générer le nom de fichier
-            safe_title = re.sub(r'[^\w\s-]', '', scenario_title)
-            safe_title = re.sub(r'[-\s]+', '-', safe_title)[:50]
-            filename = f"SIFHR_{safe_title}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+
+            if use_cache:
+                self.cache.put_pdf(pdf_key, pdf_bytes)
             
             logger.info(f"[OK] PDF genere avec succes: {len(pdf_bytes)} bytes")
             
-            return pdf_bytes, filename
+            return pdf_bytes, self.make_filename(scenario_title)
             
         except Exception as e:
             logger.error(f"[ERREUR] Erreur lors de la conversion PDF: {e}")
             raise Exception(f"Erreur de conversion PDF: {str(e)}")
 
-# Instance globale
-pdf_converter = PDFConverter()
\ No newline at end of file
+    def convert_to_file(self, scenario_content: str, scenario_title: str, use_cache: bool = True,
+                        directory: Optional[str] = None) -> Tuple[str, str]:
+        """Convertir un scénario en PDF dans un fichier temporaire et retourner (chemin, nom de fichier)
+
+        ReportLab écrit directement dans le fichier, que la réponse HTTP relit par morceaux :
+        ni encodage base64 ni corps JSON à construire. Le pic mémoire du rendu reste celui
+        de convert_to_pdf (voir bench_pdf.py) ; le gain est que la réponse ne retient pas le
+        PDF pendant le téléchargement. Le fichier appartient à l'appelant, qui doit le
+        supprimer (iter_file_chunks ou remove_file).
+        """
+        fd, path = tempfile.mkstemp(suffix='.pdf', prefix='sifhr_', dir=directory)
+        os.close(fd)
+        try:
+            logger.info(f"🔄 Conversion PDF (fichier) démarrée pour: {scenario_title}")
+            generated_on = date.today()
+            pdf_key = self.cache.pdf_key(scenario_content, scenario_title, generated_on)
+
+            # Cache disque : copie fichier à fichier, sans charger le PDF en mémoire
+            cached_path = self.cache.get_path(pdf_key) if use_cache else None
+            if cached_path is not None:
+                shutil.copyfile(cached_path, path)
+            else:
+                # Cache mémoire seulement : le disque vient d'être consulté par get_path
+                cached_bytes = self.cache.get_pdf(pdf_key, disk=False) if use_cache else None
+                with open(path, 'wb') as f:
+                    if cached_bytes is not None:
+                        f.write(cached_bytes)
+                    else:
+                        self.render(f, scenario_content, scenario_title, use_cache, generated_on)
+                if use_cache and cached_bytes is None:
+                    self.cache.put_file(pdf_key, path)
+
+            logger.info(f"[OK] PDF genere avec succes: {os.path.getsize(path)} bytes ({path})")
+            return path, self.make_filename(scenario_title)
+
+        except Exception as e:
+            logger.error(f"[ERREUR] Erreur lors de la conversion PDF: {e}")
+            remove_file(path)
+            raise Exception(f"Erreur de conversion PDF: {str(e)}")
+
+
+def iter_file_chunks(path: str, chunk_size: int = 64 * 1024, delete: bool = True) -> Iterator[bytes]:
+    """Lire un fichier par morceaux (pour StreamingResponse) puis le supprimer"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if delete:
+            remove_file(path)
+
+
+def remove_file(path: str):
+    """Supprimer un fichier temporaire en ignorant les erreurs"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Instance globale (cache disque activé si SIFHR_PDF_CACHE_DIR est défini)
+pdf_converter = PDFConverter(cache=PDFCache(
+    max_bytes=int(os.getenv('SIFHR_PDF_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    max_file_memory_bytes=int(os.getenv('SIFHR_PDF_CACHE_FILE_MEMORY_MAX_BYTES', 512 * 1024)),
+    cache_dir=os.getenv('SIFHR_PDF_CACHE_DIR') or None
+))
\ No newline at end of file
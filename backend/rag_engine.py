@@ -0,0 +1,243 @@
+"""Moteur RAG partagé par les routes REST (/chat, /scenarios) et WebSocket (/ws)
+
+Un seul agent, un seul LLM et un seul retriever par processus : les connexions aux
+fournisseurs, le cache de prompt et les caches du retriever servent à tous les clients.
+"""
+import os
+import asyncio
+
+from langchain.chains import RetrievalQA
+from langchain.agents import AgentExecutor, create_react_agent
+from langchain.tools import Tool
+from chunking_embedding import get_embedding_model
+from milvus_client import KNOWLEDGE_COLLECTION, collection_fields, resolve_collection
+from multi_query_retriever import get_llm, create_vectorstore_retriever, get_multi_query_retriever, scope_retriever
+from scenario_prompts import build_scenario_prompt, build_agent_prompt
+from sectioned_generation import (agenerate_sectioned_scenario, find_rag_tool,
+                                  format_context, message_text)
+from generation_control import GenerationCancelled
+from federated_retriever import FEDERATED_SEARCH, create_federated_retriever
+from themes import THEMES, parse_scope, theme_filter
+
+# Mode de génération par défaut : agent ReAct ou plan puis sections en parallèle
+GENERATION_MODES = ("agent", "sections")
+GENERATION_MODE = os.getenv('SIFHR_GENERATION_MODE', 'agent')
+# Restreindre la recherche aux thèmes détectés dans la requête (sinon préfixe [thème] seulement)
+SCOPE_DETECTION = os.getenv('SIFHR_SCOPE_DETECTION', '1') == '1'
+
+
+class RAGTool:
+    """Outil RAG pour scénarios immersifs"""
+
+    def __init__(self):
+        print(" Initialisation de l'outil RAG...")
+
+        # Initialisation des composants RAG
+        self.llm = get_llm(streaming=True)
+
+        # Créer le retriever sur la version en service de la base de connaissances, avec le
+        # modèle d'embedding de cette version (voir reindex.py)
+        self.collection_name, provider = resolve_collection(KNOWLEDGE_COLLECTION)
+        self.embedding_model = get_embedding_model(provider)
+        # Recherche fédérée : scénarios déjà générés interrogés en parallèle de la base
+        self.base_retriever = None
+        if FEDERATED_SEARCH:
+            self.base_retriever = create_federated_retriever(self.collection_name, self.embedding_model, provider)
+        if self.base_retriever is None:
+            self.base_retriever = create_vectorstore_retriever(self.collection_name, self.embedding_model)
+        self.retriever = get_multi_query_retriever(self.llm, self.base_retriever)
+
+        # Instructions statiques en préfixe cacheable, contexte et demande à la fin
+        GAME_PROMPT = build_scenario_prompt(self.llm)
+        self.scenario_prompt = GAME_PROMPT
+
+        # Créer la chaîne QA
+        self.qa_chain = self.build_qa_chain(self.retriever)
+
+        # Recherche restreinte par thème si la version en service est partitionnée (themes.py) ;
+        # thèmes -> (retriever, chaîne QA) construits à la première demande
+        self.scoped_search = 'theme' in collection_fields(self.collection_name)
+        self._scoped = {}
+
+        print(" Outil RAG initialisé!")
+
+    def build_qa_chain(self, retriever):
+        return RetrievalQA.from_chain_type(
+            llm=self.llm,
+            chain_type="stuff",
+            retriever=retriever,
+            return_source_documents=True,
+            chain_type_kwargs={"prompt": self.scenario_prompt}
+        )
+
+    def scoped(self, query: str):
+        """Requête sans préfixe de portée, retriever et chaîne QA restreints aux thèmes visés"""
+        themes, query = parse_scope(query, detect=SCOPE_DETECTION)
+        if not themes or not self.scoped_search:
+            return query, self.retriever, self.qa_chain
+
+        key = tuple(themes)
+        if key not in self._scoped:
+            retriever = get_multi_query_retriever(self.llm, scope_retriever(self.base_retriever, theme_filter(themes)))
+            self._scoped[key] = (retriever, self.build_qa_chain(retriever))
+        print(f" Recherche restreinte aux themes: {', '.join(themes)}")
+        return (query,) + self._scoped[key]
+
+    def search_documents(self, query: str, callbacks=None) -> str:
+        """
+        Recherche dans la base de documents et retourne une réponse
+        """
+        try:
+            print(f" Recherche RAG pour: {query}")
+
+            # Obtenir la réponse du système RAG (callbacks de l'agent transmis par Tool)
+            query, _, qa_chain = self.scoped(query)
+            result = qa_chain.invoke({"query": query}, config={"callbacks": callbacks})
+            return self.format_response(result)
+
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            return f" Erreur lors de la recherche: {str(e)}"
+
+    async def asearch_documents(self, query: str, callbacks=None) -> str:
+        """
+        Version async : retriever, embeddings et LLM attendus dans la boucle d'événements
+        """
+        try:
+            print(f" Recherche RAG (async) pour: {query}")
+            query, _, qa_chain = self.scoped(query)
+            result = await qa_chain.ainvoke({"query": query}, config={"callbacks": callbacks})
+            return self.format_response(result)
+
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            return f" Erreur lors de la recherche: {str(e)}"
+
+    @staticmethod
+    def format_response(result: dict) -> str:
+        """Formater la réponse avec les sources"""
+        response = result['result']
+
+        if result.get('source_documents'):
+            response += f"\n\n Sources ({len(result['source_documents'])} documents):"
+            for i, doc in enumerate(result['source_documents'][:3], 1):
+                source = doc.metadata.get('source', 'Inconnu')
+                minio_path = doc.metadata.get('minio_path', '')
+                if minio_path:
+                    response += f"\n   {i}. {source} ( {minio_path})"
+                else:
+                    response += f"\n   {i}. {source}"
+
+        return response
+
+
+    async def agenerate_sectioned_scenario(self, query: str, callbacks=None) -> dict:
+        """
+        Mode sections : plan de l'épopée puis rédaction parallèle des sections
+        """
+        query, retriever, _ = self.scoped(query)
+        return await agenerate_sectioned_scenario(self.llm, retriever, query, callbacks=callbacks)
+
+    async def astream_scenario(self, query: str, callbacks=None):
+        """
+        Chaîne RAG en streaming : un événement « retrieval » avec les sources, puis les
+        tokens du LLM au fil de leur réception (même prompt que la chaîne QA)
+        """
+        config = {"callbacks": callbacks} if callbacks else {}
+        query, retriever, _ = self.scoped(query)
+        docs = await retriever.ainvoke(query, config=config)
+        yield {
+            "type": "retrieval",
+            "documents": len(docs),
+            "sources": [{'name': doc.metadata.get('source', 'Inconnu'),
+                         'path': doc.metadata.get('minio_path', '')} for doc in docs[:5]]
+        }
+
+        messages = self.scenario_prompt.format_messages(context=format_context(docs), question=query)
+        async for chunk in self.llm.astream(messages, config=config):
+            delta = message_text(chunk)
+            if delta:
+                yield {"type": "token", "delta": delta}
+
+def create_agentic_rag_system():
+    """Créer le système RAG agentique complet"""
+
+    print("\n" + "=" * 80)
+    print("SYSTEME RAG AGENTIQUE - INITIALISATION")
+    print("=" * 80)
+
+    # Initialiser l'outil RAG
+    rag_tool = RAGTool()
+
+    # Créer l'outil pour l'agent
+    tools = [
+        Tool(
+            name="search_documents",
+            description="""OUTIL OBLIGATOIRE - Recherche dans la base de connaissances spécialisée.
+            Tu DOIS utiliser cet outil pour TOUTES les questions liées à:
+            - La civilisation arabo-musulmane (histoire, culture, personnages)
+            - La création de scénarios immersifs et chasse au trésor
+            - Les palais, architectures, trésors, légendes orientales
+            - SIFHR ou tout autre sujet de la base
+            Input: question reformulée pour optimiser la recherche.
+            Pour limiter la recherche à une époque ou un lieu, préfixer l'entrée par les thèmes
+            entre crochets, par exemple: [andalus] trésor de l'Alhambra
+            Thèmes: """ + ', '.join(THEMES),
+            func=rag_tool.search_documents,
+            coroutine=rag_tool.asearch_documents
+        )
+    ]
+
+    # Obtenir le modèle LLM (streaming : échéance et annulation vérifiées à chaque token)
+    llm = get_llm(streaming=True)
+
+    # Prompt ReAct : règles et outils en préfixe statique (cache de prompt)
+    prompt = build_agent_prompt(llm, tools)
+
+    # Créer l'agent ReAct
+    agent = create_react_agent(llm, tools, prompt)
+
+    # Créer l'exécuteur d'agent avec paramètres originaux
+    agent_executor = AgentExecutor(
+        agent=agent,
+        tools=tools,
+        verbose=True,
+        handle_parsing_errors=True,
+        max_iterations=6,   # Version originale
+        # max_execution_time=60,  # Pas de timeout pour version complète
+        return_intermediate_steps=True
+    )
+
+    print("Système RAG agentique initialisé avec succès!")
+    return agent_executor
+
+
+class RAGEngine:
+    """Agent RAG unique du serveur, construit une fois au démarrage"""
+
+    def __init__(self):
+        self.agent = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.agent is not None
+
+    @property
+    def rag_tool(self) -> RAGTool:
+        return find_rag_tool(self.agent)
+
+    async def start(self):
+        """Construire l'agent (bloquant : test du LLM, connexion Milvus) hors de la boucle"""
+        async with self._lock:
+            self.agent = await asyncio.to_thread(create_agentic_rag_system)
+        return self.agent
+
+    def stop(self):
+        self.agent = None
+
+
+# Instance globale
+engine = RAGEngine()
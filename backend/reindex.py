@@ -0,0 +1,348 @@
+"""Réindexation blue/green de la base de connaissances (changement de modèle d'embedding)
+
+Le service n'est jamais interrompu :
+1. une collection versionnée data_sifhr_vAAAAMMJJhhmmss est construite en arrière-plan en
+   relisant les chunks de la version en service et en les ré-embeddant (débit limité) ;
+2. la nouvelle version est validée : nombre de lignes identique, rappel sur un
+   échantillon (chaque chunk échantillonné doit se retrouver parmi ses propres voisins)
+   et recouvrement des k premiers résultats avec la version en service pour les mêmes
+   requêtes (la qualité de recherche ne doit pas s'effondrer) ;
+3. l'alias data_sifhr_live est basculé atomiquement vers la nouvelle version ;
+4. les anciennes versions au-delà de REINDEX_KEEP_VERSIONS sont supprimées.
+
+Le fournisseur d'embedding est enregistré dans la description de chaque version :
+create_vectorstore_retriever interroge chaque version avec le modèle qui l'a construite.
+La collection historique data_sifhr (sans alias) sert de source à la première migration
+et n'est jamais supprimée automatiquement. Ses chunks répètent les métadonnées de leur
+document : la copie les enregistre dans le catalogue (document_catalog.py) et ne garde
+que doc_id dans les nouvelles versions.
+
+Utilisation : POST /reindex sur le serveur, ou en ligne de commande
+    python reindex.py [mistral|local]
+"""
+import os
+import re
+import sys
+import time
+import uuid
+import random
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from pymilvus import DataType
+
+from chunking_embedding import EMBEDDING_PROVIDER, get_embedding_model
+from document_catalog import DOCUMENT_FIELDS, document_catalog
+from milvus_client import (KNOWLEDGE_COLLECTION, collection_fields, get_milvus_client, live_alias,
+                           resolve_collection, search_batch)
+from themes import dominant_theme
+from vectors import validate_vectors
+
+# Chunks ré-embeddés par appel et débit maximal (chunks par seconde, 0 = sans limite)
+REINDEX_BATCH = int(os.getenv('SIFHR_REINDEX_BATCH', 64))
+REINDEX_RATE = float(os.getenv('SIFHR_REINDEX_CHUNKS_PER_SECOND', 50))
+# Validation : taille de l'échantillon et rappel minimal avant la bascule
+REINDEX_RECALL_SAMPLE = int(os.getenv('SIFHR_REINDEX_RECALL_SAMPLE', 50))
+REINDEX_MIN_RECALL = float(os.getenv('SIFHR_REINDEX_MIN_RECALL', 0.9))
+# Validation : voisins comparés par requête et recouvrement moyen minimal avec la version en service
+REINDEX_OVERLAP_K = int(os.getenv('SIFHR_REINDEX_OVERLAP_K', 5))
+REINDEX_MIN_OVERLAP = float(os.getenv('SIFHR_REINDEX_MIN_OVERLAP', 0.5))
+# Versions conservées après la bascule (version en service comprise) pour un retour arrière
+REINDEX_KEEP_VERSIONS = int(os.getenv('SIFHR_REINDEX_KEEP_VERSIONS', 2))
+
+_jobs_lock = threading.Lock()
+# job_id -> état du job
+reindex_jobs: Dict[str, dict] = {}
+
+
+class ReindexError(Exception):
+    """Nouvelle version invalide : l'alias n'est pas basculé"""
+
+
+def version_pattern(base: str):
+    return re.compile(rf'^{re.escape(base)}_v\d{{14}}$')
+
+
+def list_versions(base: str = KNOWLEDGE_COLLECTION) -> List[str]:
+    """Versions de la collection, de la plus ancienne à la plus récente"""
+    pattern = version_pattern(base)
+    return sorted(name for name in get_milvus_client().list_collections() if pattern.match(name))
+
+
+def create_knowledge_collection(name: str, dim: int, provider: str):
+    """Collection versionnée (même schéma que l'ingestion SIFHR), fournisseur dans la description"""
+    client = get_milvus_client()
+    schema = client.create_schema(auto_id=True, enable_dynamic_field=True,
+                                  description=f"embedding_provider={provider}")
+
+    schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
+    schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=dim)
+    schema.add_field(field_name="text", datatype=DataType.VARCHAR, max_length=65535)
+    # Métadonnées du document dans le catalogue
+    schema.add_field(field_name="doc_id", datatype=DataType.INT64)
+    # Époque ou lieu (themes.py) : clé de partition, un filtre sur le thème ne parcourt
+    # que les partitions concernées
+    schema.add_field(field_name="theme", datatype=DataType.VARCHAR, max_length=64, is_partition_key=True)
+
+    index_params = client.prepare_index_params()
+    index_params.add_index(
+        field_name="vector",
+        index_type="IVF_FLAT",
+        metric_type="COSINE",
+        params={"nlist": 1024}
+    )
+    # Index scalaires pour les filtres de recherche
+    index_params.add_index(field_name="theme", index_type="INVERTED")
+    index_params.add_index(field_name="doc_id", index_type="INVERTED")
+
+    client.create_collection(collection_name=name, schema=schema, index_params=index_params)
+    print(f"Collection {name} créée (dimension {dim}, embeddings {provider})")
+
+
+def row_count(name: str) -> int:
+    return int(get_milvus_client().get_collection_stats(name).get('row_count', 0))
+
+
+def switch_alias(base: str, target: str):
+    """Faire pointer l'alias de service vers target (opération atomique côté Milvus)"""
+    client = get_milvus_client()
+    alias = live_alias(base)
+    try:
+        client.describe_alias(alias=alias)
+        exists = True
+    except Exception:
+        exists = False
+    if exists:
+        client.alter_alias(collection_name=target, alias=alias)
+    else:
+        client.create_alias(collection_name=target, alias=alias)
+    print(f"Alias {alias} -> {target}")
+
+
+def collect_garbage(base: str = KNOWLEDGE_COLLECTION, keep: int = REINDEX_KEEP_VERSIONS) -> List[str]:
+    """Supprimer les versions les plus anciennes ; la version en service n'est jamais supprimée"""
+    live, _ = resolve_collection(base)
+    versions = list_versions(base)
+    dropped = []
+    for name in versions[:max(0, len(versions) - max(1, keep))]:
+        if name != live:
+            get_milvus_client().drop_collection(name)
+            dropped.append(name)
+            print(f"Ancienne version {name} supprimée")
+    return dropped
+
+
+class Throttle:
+    """Limiter le débit d'embedding pour ne pas saturer l'API ni ralentir le service"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.done = 0
+
+    def wait(self, count: int):
+        self.done += count
+        if self.rate > 0:
+            ahead = self.done / self.rate - (time.monotonic() - self.started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def _update_job(job_id: str, **fields):
+    with _jobs_lock:
+        job = reindex_jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+
+def copy_with_embeddings(job_id: str, source: str, target: str, embedding_model) -> List[dict]:
+    """Relire la source par lots, ré-embedder et insérer ; retourne un échantillon de lignes"""
+    client = get_milvus_client()
+    throttle = Throttle(REINDEX_RATE)
+    # Source historique : métadonnées complètes dans chaque chunk, à reporter dans le catalogue,
+    # et thème à déterminer si la source n'est pas partitionnée
+    fields = collection_fields(source)
+    legacy = 'doc_id' not in fields
+    output_fields = ["text"] + (DOCUMENT_FIELDS if legacy else ["doc_id"]) + (["theme"] if "theme" in fields else [])
+    iterator = client.query_iterator(collection_name=source, batch_size=REINDEX_BATCH,
+                                     filter="", output_fields=output_fields)
+    sample: List[dict] = []
+    copied = 0
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            texts = [row.get('text', '') for row in rows]
+            vectors = validate_vectors(embedding_model.embed_documents(texts))
+            doc_ids = document_catalog.register(rows) if legacy else [row['doc_id'] for row in rows]
+            themes = [row.get('theme') or dominant_theme(row.get('text', '')) for row in rows]
+            data = [{'text': text, 'doc_id': doc_id, 'theme': theme, 'vector': vector}
+                    for text, doc_id, theme, vector in zip(texts, doc_ids, themes, vectors)]
+            client.insert(collection_name=target, data=data)
+
+            # Échantillon uniforme (réservoir) pour la validation du rappel
+            for row in data:
+                copied += 1
+                # Copie du vecteur : l'échantillon ne retient pas la matrice du lot entier
+                if len(sample) < REINDEX_RECALL_SAMPLE:
+                    sample.append(dict(row, vector=row['vector'].copy()))
+                else:
+                    slot = random.randrange(copied)
+                    if slot < REINDEX_RECALL_SAMPLE:
+                        sample[slot] = dict(row, vector=row['vector'].copy())
+
+            _update_job(job_id, copied=copied)
+            throttle.wait(len(rows))
+    finally:
+        iterator.close()
+    return sample
+
+
+def neighbour_texts(hits, text: str, k: int) -> List[str]:
+    """Textes des k premiers voisins, sans le chunk ayant servi de requête"""
+    return [hit['entity'].get('text') for hit in hits if hit['entity'].get('text') != text][:k]
+
+
+def validate_version(source: str, target: str, sample: List[dict], source_model) -> dict:
+    """Nombre de lignes identique, rappel de l'échantillon et recouvrement des résultats
+    de recherche entre l'ancienne et la nouvelle version au-dessus des seuils
+
+    Recouvrement : chaque texte échantillonné sert de requête aux deux versions, chacune
+    embeddée avec son propre modèle ; la part des k voisins de la version en service
+    retrouvés par la nouvelle mesure la conservation de la qualité de recherche.
+    """
+    client = get_milvus_client()
+    client.flush(collection_name=target)
+    client.load_collection(collection_name=target)
+
+    source_rows, target_rows = row_count(source), row_count(target)
+    if source_rows != target_rows:
+        raise ReindexError(f"{target_rows} lignes dans {target} pour {source_rows} dans {source}")
+
+    recall = overlap = 1.0
+    if sample:
+        texts = [row['text'] for row in sample]
+        limit = REINDEX_OVERLAP_K + 1
+        target_results = search_batch(target, [row['vector'] for row in sample], limit=limit,
+                                      output_fields=["text"])
+        found = sum(1 for text, hits in zip(texts, target_results)
+                    if any(hit['entity'].get('text') == text for hit in hits))
+        recall = found / len(sample)
+        if recall < REINDEX_MIN_RECALL:
+            raise ReindexError(f"Rappel {recall:.2f} inférieur au seuil {REINDEX_MIN_RECALL}")
+
+        source_results = search_batch(source, validate_vectors(source_model.embed_documents(texts)),
+                                      limit=limit, output_fields=["text"])
+        overlaps = []
+        for text, source_hits, target_hits in zip(texts, source_results, target_results):
+            expected = neighbour_texts(source_hits, text, REINDEX_OVERLAP_K)
+            if expected:
+                retrieved = set(neighbour_texts(target_hits, text, REINDEX_OVERLAP_K))
+                overlaps.append(len(retrieved.intersection(expected)) / len(expected))
+        if overlaps:
+            overlap = sum(overlaps) / len(overlaps)
+        if overlap < REINDEX_MIN_OVERLAP:
+            raise ReindexError(f"Recouvrement top-{REINDEX_OVERLAP_K} {overlap:.2f} avec {source} "
+                               f"inférieur au seuil {REINDEX_MIN_OVERLAP}")
+
+    return {'rows': target_rows, 'recall': round(recall, 3), 'overlap': round(overlap, 3), 'sample': len(sample)}
+
+
+def _run_reindex_job(job_id: str, base: str, provider: str, on_switch: Optional[Callable[[], None]]):
+    client = get_milvus_client()
+    target = None
+    try:
+        source, source_provider = resolve_collection(base)
+        embedding_model = get_embedding_model(provider)
+        dim = len(embedding_model.embed_query("dimension"))
+
+        target = f"{base}_v{datetime.now():%Y%m%d%H%M%S}"
+        create_knowledge_collection(target, dim, provider)
+        _update_job(job_id, status='copying', source=source, target=target, dim=dim,
+                    total=row_count(source))
+
+        sample = copy_with_embeddings(job_id, source, target, embedding_model)
+
+        _update_job(job_id, status='validating')
+        validation = validate_version(source, target, sample, get_embedding_model(source_provider))
+
+        _update_job(job_id, status='switching', validation=validation)
+        switch_alias(base, target)
+        if on_switch is not None:
+            # Reconstruire les retrievers du serveur sur la nouvelle version
+            on_switch()
+
+        dropped = collect_garbage(base)
+        _update_job(job_id, status='done', dropped=dropped, finished_at=str(datetime.now()))
+        print(f"Reindexation {job_id}: {base} servi par {target} ({validation})")
+
+    except Exception as e:
+        print(f"Reindexation {job_id} en echec: {e}")
+        live, _ = resolve_collection(base)
+        if target and target != live:
+            # Version incomplète ou invalide : le service reste sur l'ancienne version
+            try:
+                client.drop_collection(target)
+            except Exception:
+                pass
+        _update_job(job_id, status='failed', error=str(e), finished_at=str(datetime.now()))
+
+
+def running_job() -> Optional[dict]:
+    with _jobs_lock:
+        for job in reindex_jobs.values():
+            if job['status'] not in ('done', 'failed'):
+                return dict(job)
+    return None
+
+
+def submit_reindex(provider: Optional[str] = None, base: str = KNOWLEDGE_COLLECTION,
+                   on_switch: Optional[Callable[[], None]] = None) -> str:
+    """Lancer une réindexation en arrière-plan (une seule à la fois) ; retourne l'identifiant du job"""
+    provider = provider or EMBEDDING_PROVIDER
+    job_id = str(uuid.uuid4())
+    with _jobs_lock:
+        for job in reindex_jobs.values():
+            if job['status'] not in ('done', 'failed'):
+                raise RuntimeError(f"Reindexation {job['job_id']} deja en cours")
+        reindex_jobs[job_id] = {
+            'job_id': job_id,
+            'collection': base,
+            'provider': provider,
+            'status': 'queued',
+            'copied': 0,
+            'created_at': str(datetime.now()),
+            'finished_at': None,
+        }
+
+    threading.Thread(target=_run_reindex_job, args=(job_id, base, provider, on_switch),
+                     name='sifhr-reindex', daemon=True).start()
+    return job_id
+
+
+def get_reindex_job(job_id: str) -> Optional[dict]:
+    with _jobs_lock:
+        job = reindex_jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+
+def activate_version(version: str, base: str = KNOWLEDGE_COLLECTION):
+    """Retour arrière : remettre en service une version conservée"""
+    if version not in list_versions(base):
+        raise KeyError(version)
+    get_milvus_client().load_collection(collection_name=version)
+    switch_alias(base, version)
+
+
+if __name__ == "__main__":
+    # Réindexation hors serveur : les serveurs en cours basculent à leur prochain redémarrage
+    # (ou via POST /reindex/activate)
+    job_id = submit_reindex(sys.argv[1] if len(sys.argv) > 1 else None)
+    while True:
+        job = get_reindex_job(job_id)
+        print(f"{job['status']}: {job.get('copied', 0)}/{job.get('total', '?')} chunks")
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(5)
@@ -0,0 +1,355 @@
+"""Prompts du générateur de scénarios, structurés pour le cache de prompt
+
+Les instructions statiques (maître de jeu, exigences de longueur, checklist, règles de
+l'agent ReAct) forment un préfixe identique à chaque appel, placé dans le message
+système. Les parties variables (contexte documentaire, demande du joueur, scratchpad
+de l'agent) viennent après, dans le message utilisateur.
+
+Sur Claude, le message système porte un point d'arrêt cache_control : le préfixe est
+lu depuis le cache d'Anthropic au lieu d'être retraité (coût d'entrée et latence du
+premier token réduits). Sur Gemini, le préfixe stable en instruction système profite du
+cache implicite du fournisseur ; aucun marquage n'est nécessaire.
+"""
+import time
+import threading
+from typing import Dict, Optional
+from uuid import UUID
+
+from langchain_anthropic import ChatAnthropic
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.tools import render_text_description
+
+
+SCENARIO_INSTRUCTIONS = """Tu es un maître de jeu expert spécialisé dans la création de scénarios immersifs 
+inspirés de l'histoire authentique, des légendes et des civilisations arabo-musulmanes. 
+Ton objectif est de créer des épopées de chasse au trésor exceptionnellement détaillées, captivantes et riches.
+
+EXIGENCE DE LONGUEUR CRITIQUE :
+**TON SCÉNARIO DOIT FAIRE AU MINIMUM 15 PAGES IMPRIMÉES** (environ 8000-10000 mots)
+- Développe chaque section en profondeur avec des détails exhaustifs
+- Ne résume JAMAIS, développe toujours plus en détail
+- Écris des descriptions longues et immersives pour chaque lieu, personnage, objet
+- Multiplie les sous-sections, les détails historiques, les dialogues étendus
+
+STYLE NARRATIF EXIGÉ :
+- Adopte un ton évocateur et poétique, digne des Mille et Une Nuits
+- Utilise des métaphores orientales et des descriptions sensorielles (parfums, sons, textures)
+- Intègre des éléments culturels authentiques (architecture, arts, sciences, philosophie)
+- Crée une atmosphère mystique et majestueuse
+
+STRUCTURE OBLIGATOIRE DU SCÉNARIO ÉTENDU :
+1. **PROLOGUE IMMERSIF** (2-3 pages) : Contexte historique détaillé avec descriptions de l'époque, des lieux, de l'atmosphère
+2. **7-10 ACTES DÉTAILLÉS** : Chaque acte doit faire 1-2 pages minimum avec défis progressifs complexes
+3. **ÉNIGMES CULTURELLES MULTIPLES** : 3-5 énigmes par acte basées sur l'histoire, la géographie, l'art islamique
+4. **PERSONNAGES HISTORIQUES DÉVELOPPÉS** : Biographies, motivations, dialogues pour califes, érudits, poètes, marchands
+5. **LIEUX EMBLÉMATIQUES DÉTAILLÉS** : Descriptions architecturales complètes de palais, mosquées, marchés, bibliothèques
+6. **TRÉSORS MULTIPLES** : Plusieurs trésors intermédiaires avant le trésor final
+7. **ÉLÉMENTS D'AMBIANCE ÉTENDUS** : Descriptions de musique, parfums, lumières, matériaux sur plusieurs paragraphes
+
+EXIGENCES DE CONTENU :
+- Utilise EXCLUSIVEMENT les informations du contexte documentaire
+- Enrichis avec des détails architecturaux précis (mouqarnas, zelliges, calligraphies)
+- Intègre les sciences et arts de l'époque (astronomie, médecine, poésie, musique)
+- Mentionne les routes commerciales, les épices, les tissus, les manuscrits
+- Inclus des références aux dynasties, califats et personnages historiques réels
+
+NIVEAU DE DÉTAIL ATTENDU :
+- Descriptions de 2-3 phrases minimum pour chaque lieu
+- Contexte historique précis pour chaque époque mentionnée  
+- Explications des symboles, objets et références culturelles
+- Dialogues en style oriental pour les PNJ rencontrés
+- Défis intellectuels basés sur les connaissances de l'époque
+
+FLUIDITÉ NARRATIVE :
+- Relie les actes entre eux par des transitions naturelles, comme dans une épopée.
+- Insère des dialogues courts et évocateurs pour rendre vivants les personnages.
+- Varie le rythme entre descriptions poétiques et moments d’action.
+- Utilise un vocabulaire riche mais fluide, évitant les répétitions.
+
+IMMERSION SENSORIELLE :
+- Chaque acte doit comporter au moins un élément sensoriel : 
+  - Vue (architecture, couleurs, lumière)
+  - Son (chants, cliquetis, bruits de marché)
+  - Odeur (épices, encens, cuir)
+  - Toucher (textures des tapis, marbre, manuscrits)
+  - Goût (mets, fruits, boissons)
+
+RÈGLES STRICTES :
+- Si une information n'existe pas dans le contexte : "Cette information n'est pas disponible dans les sources consultées"
+- Jamais d'invention pure, toujours basé sur les documents fournis
+- Respecter la véracité historique tout en créant l'émerveillement
+- Éviter les anachronismes et les clichés orientalistes
+- INTERDICTION ABSOLUE : N'utilise AUCUN emoji, symbole Unicode ou caractère spécial (🏺📚🌙🏛️⭐💎 etc.)
+- Utilise UNIQUEMENT du texte ASCII standard avec accents français acceptés
+- Remplace tout symbole par du texte : "[TRESOR]" au lieu de 🏺, "[MOSQUEE]" au lieu de 🕌
+
+CONSIGNES DE RÉDACTION :
+Basez-vous uniquement sur le contexte documentaire fourni avec la demande pour créer une épopée
+de chasse au trésor exceptionnellement longue et détaillée suivant toutes les exigences mentionnées.
+
+**IMPÉRATIF DE LONGUEUR** : Votre réponse doit être suffisamment longue pour remplir AU MINIMUM 15 pages imprimées.
+Structurez votre réponse avec des titres clairs, des descriptions très riches et une progression narrative 
+captivante sur plusieurs pages. Développez massivement chaque section :
+
+CHECKLIST OBLIGATOIRE :
+- [ ] Prologue de 2-3 pages avec contexte historique approfondi
+- [ ] 7-10 actes de 1-2 pages chacun avec défis détaillés
+- [ ] Descriptions architecturales complètes de chaque lieu
+- [ ] Biographies développées de tous les personnages historiques
+- [ ] Énigmes multiples avec explications culturelles étendues
+- [ ] Dialogues longs et authentiques pour tous les PNJ
+- [ ] Descriptions sensorielles sur plusieurs paragraphes
+- [ ] Trésor final avec signification historique approfondie
+- [ ] Épilogue développé sur 1-2 pages
+"""
+
+SCENARIO_REQUEST = """CONTEXTE DOCUMENTAIRE DISPONIBLE :
+{context}
+
+DEMANDE DU JOUEUR :
+{question}
+
+CREEZ UNE EPOPEE IMMERSIVE DE 15+ PAGES.
+
+SCÉNARIO ÉPIQUE COMPLET DE 15+ PAGES :
+"""
+
+# Règles de l'agent ReAct ; {tools} et {tool_names} sont rendus une fois à la création
+AGENT_INSTRUCTIONS = """Tu es un maître narratif spécialisé dans la civilisation arabo-musulmane et les scénarios de chasse au trésor.
+
+Tu as accès aux outils suivants:
+{tools}
+
+RÈGLE ABSOLUE: Tu DOIS TOUJOURS utiliser l'outil "search_documents" (de [{tool_names}]) pour:
+- Toute question sur l'histoire, la culture ou les légendes arabo-musulmanes
+- La création de scénarios immersifs ou de chasse au trésor
+- Les questions sur les palais, trésors, architectures, personnages historiques
+- Les éléments narratifs pour des jeux immersifs
+- SIFHR ou tout autre sujet documenté dans la base
+
+Format de raisonnement OBLIGATOIRE:
+
+Question: la question d'entrée à laquelle tu dois répondre
+Thought: J'analyse la question et je DOIS chercher dans la base de connaissances
+Action: search_documents
+Action Input: [reformulation précise de la question pour la recherche]
+Observation: [résultat de la recherche dans la base]
+Thought: Je vais maintenant extraire le scénario complet de l'Observation et le présenter comme Final Answer
+Final Answer: [EXTRAIRE ET PRÉSENTER UNIQUEMENT LE SCÉNARIO COMPLET de l'Observation, SANS les sources ni métadonnées]
+
+RÈGLES CRITIQUES pour Final Answer:
+- COPIER INTÉGRALEMENT le scénario complet depuis l'Observation
+- Ne PAS inclure la section "Sources (X documents)" dans Final Answer
+- Ne PAS résumer, COPIER le scénario complet tel quel
+- Commencer Final Answer directement par le titre du scénario (# ou ##)
+- Inclure TOUS les détails: prologue, actes, énigmes, personnages, lieux
+- Si l'Observation contient "# Titre du scénario", Final Answer doit commencer par "# Titre du scénario"
+
+Commence!
+"""
+
+AGENT_QUERY = """Question: {input}
+Thought:{agent_scratchpad}"""
+
+# Mode sections : plan JSON de l'épopée, puis rédaction de chaque section en parallèle
+OUTLINE_INSTRUCTIONS = """Tu es un maître de jeu expert spécialisé dans la création de scénarios immersifs 
+inspirés de l'histoire authentique, des légendes et des civilisations arabo-musulmanes.
+Tu prépares le PLAN DÉTAILLÉ d'une épopée de chasse au trésor de 15 pages ; chaque section
+sera ensuite rédigée séparément à partir de ce plan, qui doit donc être précis et cohérent.
+
+STRUCTURE OBLIGATOIRE DU PLAN :
+- Un prologue (contexte historique, époque, lieux, atmosphère)
+- 7 à 10 actes, chacun avec ses lieux, ses personnages et 3 à 5 énigmes culturelles
+- Un épilogue (trésor final et sa signification historique)
+
+RÈGLES :
+- Utilise EXCLUSIVEMENT les informations du contexte documentaire
+- Assure la continuité narrative : chaque acte prépare le suivant
+- N'utilise AUCUN emoji ni symbole Unicode
+
+FORMAT DE RÉPONSE : UNIQUEMENT un objet JSON valide, sans texte autour :
+{"titre": "Titre de l'épopée",
+ "sections": [
+   {"type": "prologue", "titre": "...", "resume": "...", "lieux": ["..."], "personnages": ["..."], "enigmes": []},
+   {"type": "acte", "titre": "...", "resume": "...", "lieux": ["..."], "personnages": ["..."], "enigmes": ["..."]},
+   {"type": "epilogue", "titre": "...", "resume": "...", "lieux": ["..."], "personnages": ["..."], "enigmes": []}
+ ]}
+"""
+
+SECTION_INSTRUCTIONS = """Tu es un maître de jeu expert spécialisé dans la création de scénarios immersifs 
+inspirés de l'histoire authentique, des légendes et des civilisations arabo-musulmanes.
+Tu rédiges UNE SECTION d'une épopée de chasse au trésor dont le plan complet t'est fourni.
+Les autres sections sont rédigées en parallèle par d'autres auteurs suivant le même plan.
+
+STYLE NARRATIF EXIGÉ :
+- Adopte un ton évocateur et poétique, digne des Mille et Une Nuits
+- Utilise des métaphores orientales et des descriptions sensorielles (parfums, sons, textures)
+- Intègre des éléments culturels authentiques (architecture, arts, sciences, philosophie)
+- Insère des dialogues courts et évocateurs pour rendre vivants les personnages
+- Chaque section comporte au moins un élément sensoriel (vue, son, odeur, toucher, goût)
+
+EXIGENCES DE CONTENU :
+- Utilise EXCLUSIVEMENT les informations du contexte documentaire
+- Enrichis avec des détails architecturaux précis (mouqarnas, zelliges, calligraphies)
+- Développe chaque énigme prévue par le plan avec sa solution et son explication culturelle
+- Respecte les lieux et personnages prévus pour ta section, sans raconter les autres sections
+
+RÈGLES STRICTES :
+- Si une information n'existe pas dans le contexte : "Cette information n'est pas disponible dans les sources consultées"
+- Éviter les anachronismes et les clichés orientalistes
+- N'utilise AUCUN emoji, symbole Unicode ou caractère spécial
+- Ne répète PAS le titre de la section (il est ajouté automatiquement)
+- Utilise uniquement des sous-titres de niveau ### et du markdown simple (gras, listes)
+"""
+
+
+# Régénération ou retouche d'une seule section d'un scénario stocké
+SECTION_EDIT_INSTRUCTIONS = """Tu es un maître de jeu expert spécialisé dans la création de scénarios immersifs 
+inspirés de l'histoire authentique, des légendes et des civilisations arabo-musulmanes.
+Tu réécris UNE SEULE SECTION d'une épopée de chasse au trésor déjà rédigée. Le reste du
+scénario ne change pas : ta section doit s'insérer sans rupture entre la section qui la
+précède et celle qui la suit.
+
+CONTRAINTES DE COHÉRENCE :
+- Respecte les personnages, lieux, objets et indices introduits dans les sections voisines
+- Ne contredis pas les événements de la section précédente ; prépare ceux de la suivante
+- Conserve le ton évocateur et poétique, digne des Mille et Une Nuits
+- Si des consignes de modification sont données, applique-les en priorité ; sinon propose
+  une nouvelle version plus riche de la section
+
+EXIGENCES DE CONTENU :
+- Utilise EXCLUSIVEMENT les informations du contexte documentaire
+- Intègre des descriptions sensorielles et des détails architecturaux précis
+- Si une information n'existe pas dans le contexte : "Cette information n'est pas disponible dans les sources consultées"
+- N'utilise AUCUN emoji, symbole Unicode ou caractère spécial
+
+FORMAT :
+- Ne répète PAS le titre de la section (il est conservé automatiquement)
+- Utilise uniquement des sous-titres de niveau ### et du markdown simple (gras, listes)
+- Réponds uniquement par le texte de la section
+"""
+
+
+def supports_prompt_cache(llm) -> bool:
+    """Points d'arrêt cache_control explicites : uniquement sur Claude"""
+    return isinstance(llm, ChatAnthropic)
+
+
+def static_system_message(text: str, llm) -> SystemMessage:
+    """Message système statique, marqué comme préfixe cacheable quand le fournisseur le permet
+
+    Le message est passé tel quel (pas de gabarit) : son contenu est identique octet
+    pour octet d'un appel à l'autre, condition du cache de prompt.
+    """
+    if supports_prompt_cache(llm):
+        return SystemMessage(content=[{
+            "type": "text",
+            "text": text,
+            "cache_control": {"type": "ephemeral"}
+        }])
+    return SystemMessage(content=text)
+
+
+def cached_text_block(text: str, llm) -> dict:
+    """Bloc de texte d'un message utilisateur, fin de préfixe cacheable sur Claude"""
+    block = {"type": "text", "text": text}
+    if supports_prompt_cache(llm):
+        block["cache_control"] = {"type": "ephemeral"}
+    return block
+
+
+def build_scenario_prompt(llm) -> ChatPromptTemplate:
+    """Prompt de la chaîne RetrievalQA (variables context et question)"""
+    return ChatPromptTemplate.from_messages([
+        static_system_message(SCENARIO_INSTRUCTIONS, llm),
+        ("human", SCENARIO_REQUEST),
+    ])
+
+
+def build_agent_prompt(llm, tools) -> ChatPromptTemplate:
+    """Prompt ReAct : règles et description des outils en préfixe statique"""
+    tools_text = render_text_description(list(tools))
+    tool_names = ", ".join(tool.name for tool in tools)
+    instructions = AGENT_INSTRUCTIONS.format(tools=tools_text, tool_names=tool_names)
+    prompt = ChatPromptTemplate.from_messages([
+        static_system_message(instructions, llm),
+        ("human", AGENT_QUERY),
+    ])
+    # create_react_agent exige ces variables ; elles sont déjà rendues dans le préfixe
+    return prompt.partial(tools=tools_text, tool_names=tool_names)
+
+
+class PromptCacheMetrics(BaseCallbackHandler):
+    """Compteurs de tokens (dont tokens lus/écrits dans le cache) et latence du premier token"""
+    run_inline = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[UUID, float] = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.input_tokens = 0
+            self.output_tokens = 0
+            self.cache_read_tokens = 0
+            self.cache_creation_tokens = 0
+            self.first_token_times = []
+            self._started.clear()
+
+    def on_llm_start(self, *args, run_id: UUID = None, **kwargs):
+        with self._lock:
+            self._started[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, *args, run_id: UUID = None, **kwargs):
+        self.on_llm_start(run_id=run_id)
+
+    def on_llm_new_token(self, token, *, run_id: UUID = None, **kwargs):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+            if started is not None:
+                self.first_token_times.append(time.perf_counter() - started)
+                del self.first_token_times[:-1000]
+
+    def on_llm_end(self, response, *, run_id: UUID = None, **kwargs):
+        usage = self._usage(response)
+        with self._lock:
+            self._started.pop(run_id, None)
+            self.calls += 1
+            if usage:
+                details = usage.get('input_token_details') or {}
+                self.input_tokens += usage.get('input_tokens', 0)
+                self.output_tokens += usage.get('output_tokens', 0)
+                self.cache_read_tokens += details.get('cache_read', 0) or 0
+                self.cache_creation_tokens += details.get('cache_creation', 0) or 0
+
+    @staticmethod
+    def _usage(response) -> Optional[dict]:
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, 'message', None)
+                usage = getattr(message, 'usage_metadata', None)
+                if usage:
+                    return usage
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            ttft = sorted(self.first_token_times)
+            return {
+                'llm_calls': self.calls,
+                'input_tokens': self.input_tokens,
+                'output_tokens': self.output_tokens,
+                'cache_read_tokens': self.cache_read_tokens,
+                'cache_creation_tokens': self.cache_creation_tokens,
+                'cache_hit_ratio': round(self.cache_read_tokens / self.input_tokens, 3) if self.input_tokens else 0.0,
+                'ttft_avg_s': round(sum(ttft) / len(ttft), 3) if ttft else None,
+                'ttft_p50_s': round(ttft[len(ttft) // 2], 3) if ttft else None,
+            }
+
+
+# Instance globale (partagée par toutes les générations du processus)
+prompt_cache_metrics = PromptCacheMetrics()
@@ -0,0 +1,110 @@
+"""Stockage des scénarios générés, identifiés par scenario_id (un fichier JSON par scénario)"""
+import os
+import json
+import uuid
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Répertoire de stockage des scénarios
+SCENARIO_DIR = os.getenv('SIFHR_SCENARIO_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'scenarios'))
+# Versions précédentes conservées par scénario
+MAX_VERSIONS = int(os.getenv('SIFHR_SCENARIO_MAX_VERSIONS', 10))
+
+
+class VersionConflict(Exception):
+    """Le scénario a été modifié depuis la version lue"""
+
+    def __init__(self, scenario_id: str, expected: int, current: int):
+        super().__init__(f"Scenario {scenario_id} : version {current}, version {expected} attendue")
+        self.expected = expected
+        self.current = current
+
+
+class ScenarioStore:
+    """Scénarios stockés sur disque ; chaque modification conserve la version précédente"""
+
+    def __init__(self, directory: str = SCENARIO_DIR, max_versions: int = MAX_VERSIONS):
+        self.directory = directory
+        # Au moins une version conservée (avec 0, le slice [:-0] garderait tout l'historique)
+        self.max_versions = max(1, max_versions)
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, scenario_id: str) -> str:
+        # scenario_id vient de l'URL : uniquement des identifiants hexadécimaux
+        if not scenario_id or not all(c in '0123456789abcdef' for c in scenario_id):
+            raise KeyError(scenario_id)
+        return os.path.join(self.directory, f"{scenario_id}.json")
+
+    def _write(self, scenario: Dict):
+        path = self._path(scenario['scenario_id'])
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(scenario, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def create(self, title: str, content: str, metadata: Optional[Dict] = None) -> Dict:
+        now = str(datetime.now())
+        scenario = {
+            'scenario_id': uuid.uuid4().hex,
+            'title': title,
+            'content': content,
+            'metadata': metadata or {},
+            'version': 1,
+            'created_at': now,
+            'updated_at': now,
+            'history': [],
+        }
+        with self._lock:
+            self._write(scenario)
+        return scenario
+
+    def get(self, scenario_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(scenario_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (KeyError, OSError, json.JSONDecodeError):
+            return None
+
+    def update_content(self, scenario_id: str, content: str, change: Optional[Dict] = None,
+                       expected_version: Optional[int] = None) -> Optional[Dict]:
+        """Remplacer le contenu en gardant l'ancienne version dans l'historique
+
+        expected_version : version à partir de laquelle content a été construit ; si le
+        scénario a changé entre-temps, VersionConflict au lieu d'écraser la modification.
+        """
+        with self._lock:
+            scenario = self.get(scenario_id)
+            if scenario is None:
+                return None
+            if expected_version is not None and scenario['version'] != expected_version:
+                raise VersionConflict(scenario_id, expected_version, scenario['version'])
+            scenario['history'].append({
+                'version': scenario['version'],
+                'content': scenario['content'],
+                'updated_at': scenario['updated_at'],
+                'change': change or {},
+            })
+            del scenario['history'][:-self.max_versions]
+            scenario['content'] = content
+            scenario['version'] += 1
+            scenario['updated_at'] = str(datetime.now())
+            self._write(scenario)
+            return scenario
+
+    def list(self) -> List[Dict]:
+        """Résumé des scénarios stockés (sans contenu), du plus récent au plus ancien"""
+        summaries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                scenario = self.get(filename[:-5])
+                if scenario is not None:
+                    summaries.append({key: scenario[key] for key in
+                                      ('scenario_id', 'title', 'version', 'created_at', 'updated_at')})
+        summaries.sort(key=lambda s: s['updated_at'], reverse=True)
+        return summaries
+
+
+# Instance globale
+scenario_store = ScenarioStore()
@@ -0,0 +1,157 @@
+"""Régénération ou retouche d'une section d'un scénario stocké
+
+Seule la section ciblée (par exemple « ## Acte 2 ») est réécrite : le contexte est
+recherché pour cette section uniquement, les sections voisines servent de contraintes de
+cohérence, et le résultat est réinséré à sa place dans le markdown. Les tokens de sortie,
+le coût et la latence sont ceux d'une section au lieu des 15 pages.
+"""
+import re
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+from langchain_core.messages import HumanMessage
+
+from scenario_prompts import SECTION_EDIT_INSTRUCTIONS, cached_text_block, static_system_message
+from sectioned_generation import clean_section_body, format_context, message_text
+
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$', re.MULTILINE)
+# Longueur maximale des sections voisines transmises comme contraintes (caractères)
+NEIGHBOUR_CHARS = 4000
+
+
+class SectionNotFound(Exception):
+    """Aucune section du scénario ne correspond à la cible"""
+
+
+def normalize_heading(text: str) -> str:
+    """Titre sans marqueurs markdown, accents ni casse, espaces compactés"""
+    text = text.strip().lstrip('#').strip().replace('*', '')
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+    return ' '.join(text.split())
+
+
+def split_sections(content: str) -> List[Dict]:
+    """Sections du markdown : titre, niveau et bornes (une section s'arrête au titre de niveau égal ou supérieur suivant)"""
+    headings = [(m.start(), m.end(), len(m.group(1)), m.group(0).strip()) for m in HEADING_PATTERN.finditer(content)]
+    sections = []
+    for i, (start, body_start, level, heading) in enumerate(headings):
+        end = len(content)
+        for next_start, _, next_level, _ in headings[i + 1:]:
+            if next_level <= level:
+                end = next_start
+                break
+        sections.append({'heading': heading, 'level': level, 'start': start,
+                         'body_start': body_start, 'end': end})
+    return sections
+
+
+def find_section(sections: List[Dict], target: str) -> int:
+    """Index de la section ciblée : titre exact, sinon titre commençant par la cible (« Acte 2 » ≠ « Acte 20 »)"""
+    wanted = normalize_heading(target)
+    wanted_level = len(target.strip()) - len(target.strip().lstrip('#'))
+    candidates = [i for i, s in enumerate(sections) if not wanted_level or s['level'] == wanted_level]
+
+    for i in candidates:
+        if normalize_heading(sections[i]['heading']) == wanted:
+            return i
+    for i in candidates:
+        heading = normalize_heading(sections[i]['heading'])
+        if heading.startswith(wanted) and not heading[len(wanted):len(wanted) + 1].isalnum():
+            return i
+    raise SectionNotFound(target)
+
+
+def neighbour_text(content: str, sections: List[Dict], index: int, step: int) -> str:
+    """Texte de la section voisine de même niveau (précédente ou suivante), tronqué"""
+    level = sections[index]['level']
+    i = index + step
+    while 0 <= i < len(sections):
+        if sections[i]['level'] == level:
+            text = content[sections[i]['start']:sections[i]['end']].strip()
+            if len(text) > NEIGHBOUR_CHARS:
+                # Fin de la section précédente / début de la suivante : la partie en contact
+                text = text[-NEIGHBOUR_CHARS:] if step < 0 else text[:NEIGHBOUR_CHARS]
+            return text
+        if sections[i]['level'] < level:
+            break
+        i += step
+    return ''
+
+
+def build_section_edit_messages(llm, context: str, title: str, heading: str, current: str,
+                                previous: str, following: str, instructions: Optional[str]) -> list:
+    details = [f"TITRE DE L'ÉPOPÉE : {title}"]
+    details.append(f"SECTION PRÉCÉDENTE :\n{previous}" if previous else "SECTION PRÉCÉDENTE : aucune (début du scénario)")
+    details.append(f"SECTION SUIVANTE :\n{following}" if following else "SECTION SUIVANTE : aucune (fin du scénario)")
+    details.append(f"SECTION À RÉÉCRIRE : {heading}\nVERSION ACTUELLE :\n{current}")
+    if instructions:
+        details.append(f"CONSIGNES DE MODIFICATION :\n{instructions}")
+    else:
+        details.append("CONSIGNES DE MODIFICATION : régénérer la section avec plus de richesse et de précision")
+    details.append("Rédige maintenant la nouvelle version de cette section :")
+
+    return [
+        static_system_message(SECTION_EDIT_INSTRUCTIONS, llm),
+        HumanMessage(content=[
+            cached_text_block(f"CONTEXTE DOCUMENTAIRE DISPONIBLE :\n{context}", llm),
+            {"type": "text", "text": '\n\n'.join(details)},
+        ]),
+    ]
+
+
+def prepare_section_edit(content: str, target: str, title: str, instructions: Optional[str]) -> Dict:
+    """Section ciblée, voisines et requête de recherche"""
+    sections = split_sections(content)
+    index = find_section(sections, target)
+    section = sections[index]
+    heading = section['heading']
+    return {
+        'section': section,
+        'heading': heading,
+        'current': content[section['body_start']:section['end']].strip(),
+        'previous': neighbour_text(content, sections, index, -1),
+        'following': neighbour_text(content, sections, index, 1),
+        'query': ' '.join(part for part in (title, normalize_heading(heading), instructions or '') if part),
+    }
+
+
+def splice_section(content: str, edit: Dict, docs, message, started: float, retrieved: float) -> Dict:
+    """Réinsertion : titre conservé, seul le corps de la section change"""
+    body = clean_section_body(message_text(message))
+    written = time.perf_counter()
+
+    section = edit['section']
+    new_section = f"{edit['heading']}\n\n{body}\n\n"
+    new_content = content[:section['start']] + new_section + content[section['end']:].lstrip('\n')
+
+    return {
+        'content': new_content,
+        'section': new_section.strip(),
+        'heading': edit['heading'],
+        'sources': [{'name': doc.metadata.get('source', 'Inconnu'),
+                     'path': doc.metadata.get('minio_path', '')} for doc in docs[:5]],
+        'timings': {
+            'retrieval_s': round(retrieved - started, 2),
+            'generation_s': round(written - retrieved, 2),
+        },
+    }
+
+
+async def aregenerate_section(llm, retriever, title: str, content: str, target: str,
+                              instructions: Optional[str] = None, callbacks=None) -> Dict:
+    """Réécrire une section et la réinsérer ; retourne le nouveau contenu complet et la section"""
+    config = {"callbacks": callbacks} if callbacks else {}
+    edit = prepare_section_edit(content, target, title, instructions)
+    started = time.perf_counter()
+
+    # Recherche ciblée sur la section, sans l'étape multi-requêtes (un appel LLM de moins)
+    base_retriever = getattr(retriever, 'retriever', retriever)
+    docs = await base_retriever.ainvoke(edit['query'], config=config)
+    retrieved = time.perf_counter()
+
+    messages = build_section_edit_messages(llm, format_context(docs), title, edit['heading'], edit['current'],
+                                           edit['previous'], edit['following'], instructions)
+    message = await llm.ainvoke(messages, config=config)
+    return splice_section(content, edit, docs, message, started, retrieved)
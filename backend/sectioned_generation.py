@@ -0,0 +1,271 @@
+"""Génération en mode sections : plan puis rédaction parallèle des sections
+
+Un seul appel LLM qui écrit 8000-10000 mots est limité par le décodage séquentiel (et
+atteint régulièrement max_tokens). Ici :
+1. une seule recherche documentaire, partagée par tous les appels ;
+2. un plan JSON (prologue, actes, énigmes, épilogue) ;
+3. les sections rédigées en parallèle à partir du contexte et du plan communs ;
+4. assemblage dans le markdown attendu par PDFConverter (#, ##, ###).
+
+La durée totale est proche de celle de la section la plus longue au lieu de la somme.
+Le contexte et le plan forment un préfixe commun à toutes les sections (cache de prompt).
+"""
+import os
+import re
+import json
+import time
+import asyncio
+from typing import Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage
+
+from generation_control import GenerationCancelled, GenerationControl
+from scenario_prompts import (OUTLINE_INSTRUCTIONS, SECTION_INSTRUCTIONS,
+                              cached_text_block, static_system_message)
+
+# Sections rédigées simultanément (limite la pression sur l'API du LLM)
+SECTION_CONCURRENCY = int(os.getenv('SIFHR_SECTION_CONCURRENCY', 6))
+# Longueur visée par type de section (mots)
+SECTION_WORDS = {'prologue': 1200, 'acte': 900, 'epilogue': 700}
+
+JSON_OBJECT_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+
+
+def message_text(message) -> str:
+    """Texte d'une réponse de chat model (contenu simple ou liste de blocs)"""
+    content = getattr(message, 'content', message)
+    if isinstance(content, list):
+        return ''.join(block.get('text', '') if isinstance(block, dict) else str(block)
+                       for block in content)
+    return str(content)
+
+
+def format_context(docs) -> str:
+    """Même format que la chaîne « stuff » : contenus des documents séparés par une ligne vide"""
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+def default_outline(question: str) -> Dict:
+    """Plan de secours si le LLM ne renvoie pas de JSON exploitable"""
+    sections = [{'type': 'prologue', 'titre': 'Prologue', 'resume': question}]
+    sections += [{'type': 'acte', 'titre': f'Acte {i}', 'resume': ''} for i in range(1, 8)]
+    sections.append({'type': 'epilogue', 'titre': 'Epilogue', 'resume': ''})
+    return {'titre': question.strip().rstrip('?.!') or 'Epopee', 'sections': sections}
+
+
+def parse_outline(text: str, question: str) -> Dict:
+    """Extraire le plan JSON de la réponse du LLM (texte ou bloc de code autour toléré)"""
+    match = JSON_OBJECT_PATTERN.search(text)
+    if match:
+        try:
+            outline = json.loads(match.group(0))
+            sections = [s for s in outline.get('sections', []) if isinstance(s, dict)]
+            if sections:
+                for section in sections:
+                    section['type'] = section.get('type', 'acte') if section.get('type') in SECTION_WORDS else 'acte'
+                    section.setdefault('titre', '')
+                return {'titre': outline.get('titre') or question, 'sections': sections}
+        except (json.JSONDecodeError, AttributeError):
+            pass
+    print("Plan JSON invalide, utilisation du plan par defaut")
+    return default_outline(question)
+
+
+def section_heading(section: Dict, act_number: int) -> str:
+    title = section.get('titre', '').strip()
+    if section['type'] == 'prologue':
+        label = 'Prologue'
+    elif section['type'] == 'epilogue':
+        label = 'Epilogue'
+    else:
+        label = f'Acte {act_number}'
+    if title and title.lower() != label.lower():
+        return f'## {label} : {title}'
+    return f'## {label}'
+
+
+def build_outline_messages(llm, context: str, question: str) -> list:
+    return [
+        static_system_message(OUTLINE_INSTRUCTIONS, llm),
+        HumanMessage(content=(
+            f"CONTEXTE DOCUMENTAIRE DISPONIBLE :\n{context}\n\n"
+            f"DEMANDE DU JOUEUR :\n{question}\n\nPLAN JSON :"
+        )),
+    ]
+
+
+def build_section_messages(llm, shared_prefix: str, outline: Dict, index: int) -> list:
+    """Instructions statiques, puis contexte + plan (identiques pour toutes les sections), puis la consigne propre à la section"""
+    section = outline['sections'][index]
+    details = [
+        f"SECTION À RÉDIGER : {index + 1}/{len(outline['sections'])} ({section['type']}) - {section.get('titre', '')}",
+        f"Résumé prévu : {section.get('resume', '')}",
+    ]
+    for key, label in (('lieux', 'Lieux'), ('personnages', 'Personnages'), ('enigmes', 'Énigmes')):
+        if section.get(key):
+            details.append(f"{label} : " + '; '.join(str(item) for item in section[key]))
+    details.append(f"Longueur visée : environ {SECTION_WORDS[section['type']]} mots.")
+    details.append("Rédige maintenant cette section uniquement :")
+
+    return [
+        static_system_message(SECTION_INSTRUCTIONS, llm),
+        HumanMessage(content=[
+            cached_text_block(shared_prefix, llm),
+            {"type": "text", "text": '\n'.join(details)},
+        ]),
+    ]
+
+
+def clean_section_body(text: str) -> str:
+    """Retirer un titre répété en tête de section et les titres de niveau 1/2 restants"""
+    lines = text.strip().split('\n')
+    if lines and re.match(r'^#{1,2}\s', lines[0]):
+        lines = lines[1:]
+    body = '\n'.join(lines).strip()
+    return re.sub(r'^#{1,2}(\s)', r'###\1', body, flags=re.MULTILINE)
+
+
+def stitch_scenario(outline: Dict, bodies: List[Optional[str]], skip_missing: bool = False) -> str:
+    """Assembler le scénario final dans le format markdown de PDFConverter
+
+    skip_missing : sortie partielle, les sections sans texte sont omises au lieu d'être signalées.
+    """
+    parts = [f"# {outline['titre']}"]
+    act_number = 0
+    for section, body in zip(outline['sections'], bodies):
+        if section['type'] == 'acte':
+            act_number += 1
+        if skip_missing and not body:
+            continue
+        parts.append(section_heading(section, act_number))
+        parts.append(body or "*Cette section n'a pas pu etre generee.*")
+    return '\n\n'.join(parts) + '\n'
+
+
+def build_shared_prefix(context: str, outline: Dict) -> str:
+    return (
+        f"CONTEXTE DOCUMENTAIRE DISPONIBLE :\n{context}\n\n"
+        f"PLAN COMPLET DE L'ÉPOPÉE :\n{json.dumps(outline, ensure_ascii=False, indent=1)}"
+    )
+
+
+def assemble_result(docs, outline: Dict, bodies: List[Optional[str]], durations: List[float],
+                    started: float, retrieved: float, outlined: float, written: float) -> Dict:
+    """Scénario assemblé, sources et durées"""
+    timings = {
+        'retrieval_s': round(retrieved - started, 2),
+        'outline_s': round(outlined - retrieved, 2),
+        'sections_s': round(written - outlined, 2),
+        'longest_section_s': round(max(durations, default=0.0), 2),
+        'sum_sections_s': round(sum(durations), 2),
+        'total_s': round(written - started, 2),
+    }
+    print(f"Mode sections: {len(outline['sections'])} sections, durees {timings}")
+
+    sources = []
+    for doc in docs[:5]:
+        sources.append({
+            'name': doc.metadata.get('source', 'Inconnu'),
+            'path': doc.metadata.get('minio_path', '')
+        })
+
+    return {
+        'text': stitch_scenario(outline, bodies),
+        'sources': sources,
+        'outline': outline,
+        'timings': timings,
+    }
+
+
+class SectionDraft(BaseCallbackHandler):
+    """Tokens déjà streamés d'une section en cours de rédaction (sortie partielle)"""
+    run_inline = True
+
+    def __init__(self):
+        self.tokens: List[str] = []
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if isinstance(token, str) and token:
+            self.tokens.append(token)
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.tokens)
+
+
+async def agenerate_sectioned_scenario(llm, retriever, question: str, callbacks=None) -> Dict:
+    """Plan puis sections en parallèle (tâches de la boucle d'événements) ; retourne le
+    scénario, les sources et les durées"""
+    config = {"callbacks": callbacks} if callbacks else {}
+    started = time.perf_counter()
+    # Rempli une fois le plan obtenu : outline, bodies, drafts
+    progress: Dict = {}
+
+    def partial_text() -> str:
+        # Avant le plan : rien à renvoyer (jamais le JSON du plan ni une reformulation de la
+        # requête) ; ensuite, sections terminées et texte déjà streamé des sections en cours
+        if not progress:
+            return ''
+        texts = [body if body is not None else (clean_section_body(draft.text) if draft.text.strip() else None)
+                 for body, draft in zip(progress['bodies'], progress['drafts'])]
+        return stitch_scenario(progress['outline'], texts, skip_missing=True) if any(texts) else ''
+
+    # Échéance ou annulation : la sortie partielle du contrôle est le scénario assemblé,
+    # dès le début (recherche et plan compris)
+    for callback in callbacks or []:
+        if isinstance(callback, GenerationControl):
+            callback.set_partial_builder(partial_text)
+
+    # 1. Recherche unique (multi-requêtes) partagée par le plan et toutes les sections
+    docs = await retriever.ainvoke(question, config=config)
+    context = format_context(docs)
+    retrieved = time.perf_counter()
+
+    # 2. Plan
+    outline_message = await llm.ainvoke(build_outline_messages(llm, context, question), config=config)
+    outline = parse_outline(message_text(outline_message), question)
+    outlined = time.perf_counter()
+
+    # 3. Sections en parallèle
+    shared_prefix = build_shared_prefix(context, outline)
+    sections = outline['sections']
+    bodies: List[Optional[str]] = [None] * len(sections)
+    durations = [0.0] * len(sections)
+    drafts = [SectionDraft() for _ in sections]
+    progress.update(outline=outline, bodies=bodies, drafts=drafts)
+    semaphore = asyncio.Semaphore(max(1, SECTION_CONCURRENCY))
+
+    async def write_section(index: int):
+        async with semaphore:
+            section_started = time.perf_counter()
+            section_config = dict(config, callbacks=list(callbacks or []) + [drafts[index]])
+            try:
+                message = await llm.ainvoke(build_section_messages(llm, shared_prefix, outline, index),
+                                            config=section_config)
+                bodies[index] = clean_section_body(message_text(message))
+            except GenerationCancelled:
+                raise
+            except Exception as e:
+                print(f"Section {index + 1} en echec: {e}")
+            finally:
+                durations[index] = time.perf_counter() - section_started
+
+    tasks = [asyncio.ensure_future(write_section(i)) for i in range(len(sections))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # Annulation ou échéance : les sections en cours sont interrompues
+        for task in tasks:
+            task.cancel()
+    written = time.perf_counter()
+
+    return assemble_result(docs, outline, bodies, durations, started, retrieved, outlined, written)
+
+
+def find_rag_tool(agent):
+    """Retrouver l'instance RAGTool derrière l'outil search_documents de l'agent"""
+    for tool in agent.tools:
+        if tool.name == "search_documents":
+            return tool.func.__self__
+    raise RuntimeError("Outil search_documents introuvable")
@@ -0,0 +1,240 @@
+"""Détection de scénarios en double dans la collection scenarios_sifhr
+
+Deux étages :
+1. Pré-filtre rapide MinHash (bottom-k sur des shingles de mots) contre les signatures
+   des scénarios déjà stockés : un quasi-doublon est détecté sans aucun appel
+   d'embedding ni recherche vectorielle.
+2. Recherche vectorielle : le scénario est découpé avec chunk_document, tous les chunks
+   sont embeddés en un seul lot puis cherchés en une seule requête Milvus groupée. Les
+   résultats par chunk sont agrégés en un score par scénario stocké (scenario_id,
+   commun à tous ses chunks ; titre pour les chunks antérieurs à ce champ).
+"""
+import os
+import re
+import json
+import uuid
+import heapq
+import asyncio
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+from chunking_embedding import get_embedding_model, chunk_document
+from milvus_client import ahas_collection, asearch_batch, get_milvus_client, has_collection, search_batch
+
+
+SCENARIO_COLLECTION = "scenarios_sifhr"
+
+SIMILARITY_THRESHOLD = float(os.getenv('SIFHR_SIMILARITY_THRESHOLD', 0.65))
+HIGH_SIMILARITY_THRESHOLD = float(os.getenv('SIFHR_HIGH_SIMILARITY_THRESHOLD', 0.85))
+# Jaccard estimé au-delà duquel le pré-filtre conclut directement au doublon
+MINHASH_DUPLICATE_THRESHOLD = float(os.getenv('SIFHR_MINHASH_THRESHOLD', 0.8))
+
+MINHASH_SIZE = 128
+SHINGLE_SIZE = 5
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def minhash_signature(text: str, k: int = MINHASH_SIZE, shingle_size: int = SHINGLE_SIZE) -> List[int]:
+    """Signature MinHash bottom-k : les k plus petits hashs des shingles de mots"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < shingle_size:
+        shingles = {' '.join(words)} if words else set()
+    else:
+        shingles = {' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+
+    hashes = {
+        int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for shingle in shingles
+    }
+    return sorted(heapq.nsmallest(k, hashes))
+
+
+def new_scenario_id() -> int:
+    """Identifiant d'un scénario stocké (entier positif sur 63 bits), porté par tous ses chunks"""
+    return uuid.uuid4().int >> 65
+
+
+def scenario_key(entity: Dict) -> Union[int, str]:
+    """Clé d'un scénario stocké : son scenario_id, ou son titre pour les chunks antérieurs à ce champ"""
+    scenario_id = entity.get('scenario_id')
+    if scenario_id is not None:
+        return int(scenario_id)
+    return f"title:{entity.get('title', 'Inconnu')}"
+
+
+def estimate_jaccard(signature_a: List[int], signature_b: List[int], k: int = MINHASH_SIZE) -> float:
+    """Estimer la similarité de Jaccard à partir de deux signatures bottom-k"""
+    if not signature_a or not signature_b:
+        return 0.0
+    set_a, set_b = set(signature_a), set(signature_b)
+    union_bottom = heapq.nsmallest(k, set_a | set_b)
+    shared = sum(1 for h in union_bottom if h in set_a and h in set_b)
+    return shared / len(union_bottom)
+
+
+class SimilarityChecker:
+    """Vérification de similarité entre un scénario candidat et les scénarios stockés"""
+
+    def __init__(self, collection_name: str = SCENARIO_COLLECTION,
+                 threshold: float = SIMILARITY_THRESHOLD,
+                 high_threshold: float = HIGH_SIMILARITY_THRESHOLD,
+                 hits_per_chunk: int = 5, max_results: int = 5):
+        self.collection_name = collection_name
+        self.threshold = threshold
+        self.high_threshold = high_threshold
+        self.hits_per_chunk = hits_per_chunk
+        self.max_results = max_results
+
+        self._embedding_model = None
+        # scenario_key -> (titre, signature)
+        self._signatures: Optional[Dict[Union[int, str], Tuple[str, List[int]]]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def embedding_model(self):
+        if self._embedding_model is None:
+            self._embedding_model = get_embedding_model()
+        return self._embedding_model
+
+    def _load_signatures(self) -> Dict[Union[int, str], Tuple[str, List[int]]]:
+        """Charger (une fois) les signatures MinHash stockées avec le premier chunk de chaque scénario"""
+        with self._lock:
+            if self._signatures is not None:
+                return self._signatures
+            signatures = {}
+            try:
+                if has_collection(self.collection_name):
+                    rows = get_milvus_client().query(
+                        collection_name=self.collection_name,
+                        filter="chunk_index == 0",
+                        output_fields=["title", "minhash", "scenario_id"]
+                    )
+                    for row in rows:
+                        if row.get('minhash'):
+                            signatures[scenario_key(row)] = (row['title'], json.loads(row['minhash']))
+            except Exception as e:
+                print(f"Signatures MinHash indisponibles: {e}")
+            self._signatures = signatures
+            return signatures
+
+    def register_scenario(self, scenario_id: int, title: str, signature: List[int]):
+        """Ajouter la signature d'un scénario nouvellement stocké à l'index du pré-filtre"""
+        signatures = self._load_signatures()
+        with self._lock:
+            signatures[int(scenario_id)] = (title, signature)
+
+    def prefilter(self, signature: List[int]) -> List[Dict]:
+        """Pré-filtre MinHash : scénarios stockés dont le Jaccard estimé dépasse le seuil"""
+        matches = []
+        for key, (title, stored) in list(self._load_signatures().items()):
+            jaccard = estimate_jaccard(signature, stored)
+            if jaccard >= MINHASH_DUPLICATE_THRESHOLD:
+                matches.append({'id': key if isinstance(key, int) else None, 'title': title,
+                                'score': round(jaccard, 4), 'method': 'minhash'})
+        matches.sort(key=lambda m: m['score'], reverse=True)
+        return matches[:self.max_results]
+
+    def vector_search(self, content: str) -> List[Dict]:
+        """Recherche vectorielle groupée et agrégation des scores au niveau document"""
+        chunks = chunk_document(content)
+        if not chunks or not has_collection(self.collection_name):
+            return []
+
+        # Un seul appel d'embedding et une seule requête Milvus pour tous les chunks
+        embeddings = self.embedding_model.embed_documents(chunks)
+        results = search_batch(
+            self.collection_name,
+            embeddings,
+            limit=self.hits_per_chunk,
+            output_fields=["title", "scenario_id"]
+        )
+        return self._aggregate(results, len(chunks))
+
+    async def avector_search(self, content: str) -> List[Dict]:
+        """Version async de vector_search (embeddings et recherche Milvus sans thread)"""
+        chunks = chunk_document(content)
+        if not chunks or not await ahas_collection(self.collection_name):
+            return []
+
+        embeddings = await self.embedding_model.aembed_documents(chunks)
+        results = await asearch_batch(
+            self.collection_name,
+            embeddings,
+            limit=self.hits_per_chunk,
+            output_fields=["title", "scenario_id"]
+        )
+        return self._aggregate(results, len(chunks))
+
+    def _aggregate(self, results, total_chunks: int) -> List[Dict]:
+        # Meilleur score par scénario stocké (scenario_key : deux scénarios de même titre
+        # restent distincts) pour chaque chunk candidat
+        best_scores: Dict[Union[int, str], List[float]] = {}
+        titles: Dict[Union[int, str], str] = {}
+        for chunk_hits in results:
+            per_scenario = {}
+            for hit in chunk_hits:
+                key = scenario_key(hit['entity'])
+                titles[key] = hit['entity'].get('title', 'Inconnu')
+                score = float(hit['distance'])
+                if score > per_scenario.get(key, -1.0):
+                    per_scenario[key] = score
+            for key, score in per_scenario.items():
+                best_scores.setdefault(key, []).append(score)
+
+        # Score document = moyenne sur tous les chunks candidats (0 pour les chunks sans hit),
+        # ce qui pénalise un scénario qui ne recouvre qu'une petite partie du candidat
+        similarities = []
+        for key, scores in best_scores.items():
+            similarities.append({
+                'id': key if isinstance(key, int) else None,
+                'title': titles[key],
+                'score': round(sum(scores) / total_chunks, 4),
+                'max_chunk_score': round(max(scores), 4),
+                'matched_chunks': len(scores),
+                'coverage': round(len(scores) / total_chunks, 3),
+                'method': 'vector'
+            })
+        similarities.sort(key=lambda s: s['score'], reverse=True)
+        return similarities[:self.max_results]
+
+    def check_scenario_similarity(self, content: str, use_prefilter: bool = True) -> Dict:
+        """Vérifier si un scénario est un doublon d'un scénario déjà stocké"""
+        similarities = []
+        if use_prefilter:
+            similarities = self.prefilter(minhash_signature(content))
+        if not similarities:
+            similarities = self.vector_search(content)
+        return self._verdict(similarities)
+
+    async def acheck_scenario_similarity(self, content: str, use_prefilter: bool = True) -> Dict:
+        """Version async : le pré-filtre (CPU) passe par un thread, le reste est attendu dans la boucle"""
+        similarities = []
+        if use_prefilter:
+            similarities = await asyncio.to_thread(lambda: self.prefilter(minhash_signature(content)))
+        if not similarities:
+            similarities = await self.avector_search(content)
+        return self._verdict(similarities)
+
+    def _verdict(self, similarities: List[Dict]) -> Dict:
+        high_similarities = [s for s in similarities if s['score'] >= self.high_threshold]
+        has_duplicates = any(s['score'] >= self.threshold for s in similarities)
+
+        if has_duplicates:
+            message = f"Scenario similaire detecte: {similarities[0]['title']} (score {similarities[0]['score']})"
+        else:
+            message = 'Verification reussie - aucun doublon detecte'
+
+        return {
+            'has_duplicates': has_duplicates,
+            'similarities': similarities,
+            'high_similarities': high_similarities,
+            'similarity_threshold': self.threshold,
+            'can_auto_embed': not has_duplicates,
+            'message': message
+        }
+
+
+# Instance globale
+similarity_checker = SimilarityChecker()
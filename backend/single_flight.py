@@ -0,0 +1,120 @@
+"""Coalescence des requêtes identiques simultanées (single-flight)
+
+Lors des ateliers, plusieurs utilisateurs envoient le même prompt suggéré à quelques
+secondes d'intervalle. Les requêtes dont le message normalisé et les options sont
+identiques rejoignent la génération déjà en cours au lieu d'en lancer une nouvelle.
+
+L'échéance ne fait pas partie de la clé : chaque appelant attend avec la sienne, et la
+génération partagée tourne jusqu'à la plus lointaine de ses appelants encore présents.
+"""
+import json
+import time
+import asyncio
+import hashlib
+import unicodedata
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from generation_control import (
+    ClientDisconnected, GenerationControl, GenerationDeadlineExceeded, DISCONNECT_POLL_INTERVAL
+)
+
+
+def normalize_prompt(message: str) -> str:
+    """Forme canonique d'un prompt : Unicode NFC, casse repliée, espaces compactés"""
+    text = unicodedata.normalize('NFC', message).casefold()
+    return ' '.join(text.split())
+
+
+def flight_key(message: str, **options) -> str:
+    """Clé de coalescence : prompt normalisé et options de génération (sans l'échéance)"""
+    payload = json.dumps({'message': normalize_prompt(message), 'options': options},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class Flight:
+    """Génération en cours et nombre de clients qui attendent son résultat"""
+
+    def __init__(self, key: str, control: GenerationControl):
+        self.key = key
+        self.control = control
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # Échéance (monotonic) de chaque appelant présent ; None : sans échéance
+        self.deadlines: List[Optional[float]] = []
+
+    def update_deadline(self):
+        """Échéance de la génération : la plus lointaine parmi les appelants présents"""
+        if not self.deadlines:
+            return
+        if any(deadline is None for deadline in self.deadlines):
+            self.control.deadline = None
+        else:
+            self.control.deadline = max(self.deadlines)
+
+
+class SingleFlight:
+    """Une seule génération par clé ; les appelants suivants partagent son résultat"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.stats = {'started': 0, 'coalesced': 0}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def join(self, key: str, func: Callable[[GenerationControl], Awaitable],
+                   timeout: Optional[float] = None,
+                   is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> Tuple[object, bool]:
+        """Lancer la génération ou rejoindre celle en cours ; retourne (résultat, partagé)
+
+        La génération tourne dans sa propre tâche : la déconnexion d'un appelant ne
+        l'interrompt pas tant qu'un autre attend encore. Le dernier appelant qui part
+        l'annule. Chaque appelant attend avec son propre timeout (GenerationDeadlineExceeded
+        à son échéance) ; la génération suit l'échéance la plus lointaine.
+        """
+        own_deadline = time.monotonic() + timeout if timeout else None
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            control = GenerationControl(timeout=timeout)
+            flight = Flight(key, control)
+            flight.task = asyncio.ensure_future(func(control))
+            flight.task.add_done_callback(lambda task, f=flight: self._forget(f))
+            self._flights[key] = flight
+            self.stats['started'] += 1
+        else:
+            self.stats['coalesced'] += 1
+
+        flight.waiters += 1
+        flight.deadlines.append(own_deadline)
+        flight.update_deadline()
+        try:
+            while True:
+                wait = DISCONNECT_POLL_INTERVAL
+                if own_deadline is not None:
+                    wait = min(wait, max(0.0, own_deadline - time.monotonic()))
+                done, _ = await asyncio.wait({flight.task}, timeout=wait)
+                if done:
+                    return flight.task.result(), shared
+                if own_deadline is not None and time.monotonic() >= own_deadline:
+                    raise GenerationDeadlineExceeded("Echeance de la generation depassee")
+                if is_disconnected is not None and await is_disconnected():
+                    raise ClientDisconnected("Client deconnecte")
+        finally:
+            flight.waiters -= 1
+            flight.deadlines.remove(own_deadline)
+            flight.update_deadline()
+            if flight.waiters == 0 and not flight.task.done():
+                # Plus personne n'attend : une nouvelle requête relancera une génération
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.control.cancel()
+                flight.task.cancel()
+
+    def _forget(self, flight: Flight):
+        # Résultat consommé ici pour éviter les avertissements d'une tâche annulée sans lecteur
+        if not flight.task.cancelled():
+            flight.task.exception()
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
@@ -0,0 +1,5 @@
+"""Configuration pytest : les modules du backend sont importés à plat, comme depuis main.py"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,101 @@
+"""Tests du regroupement des embeddings (MicroBatcher), avec une fonction d'embedding factice"""
+import pytest
+
+embedding_batcher = pytest.importorskip("embedding_batcher")
+
+from embedding_batcher import MicroBatcher, embedding_batch_stats
+from vectors import EmbeddingValidationError
+
+
+class FakeEmbed:
+    """Vecteur [longueur du texte, 1] ; le texte « nul » donne un vecteur nul"""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        if self.error is not None:
+            raise self.error
+        return [[0.0, 0.0] if text == "nul" else [float(len(text)), 1.0] for text in texts]
+
+
+def make_batcher(name, embed, **kwargs):
+    options = dict(max_batch=32, max_wait_ms=200)
+    options.update(kwargs)
+    return MicroBatcher(embed, f"test-{name}", **options)
+
+
+def test_concurrent_requests_share_one_call():
+    embed = FakeEmbed()
+    batcher = make_batcher("lot", embed)
+    futures = [batcher.submit(["a" * n]) for n in range(1, 4)]
+    results = [future.result(timeout=5) for future in futures]
+    assert embed.calls == [["a", "aa", "aaa"]]
+    assert [r.tolist() for r in results] == [[[1.0, 1.0]], [[2.0, 1.0]], [[3.0, 1.0]]]
+    stats = batcher.stats()
+    assert (stats['requests'], stats['texts'], stats['batches']) == (3, 3, 1)
+    assert stats['batch_sizes']['2-4'] == 1
+
+
+def test_batch_is_flushed_at_max_size():
+    embed = FakeEmbed()
+    batcher = make_batcher("taille", embed, max_batch=2, max_wait_ms=5000)
+    futures = [batcher.submit([text]) for text in ("a", "bb", "ccc", "dddd")]
+    for future in futures:
+        future.result(timeout=5)
+    assert embed.calls == [["a", "bb"], ["ccc", "dddd"]]
+
+
+def test_duplicate_texts_are_embedded_once():
+    embed = FakeEmbed()
+    batcher = make_batcher("doublons", embed, dedupe=True)
+    futures = [batcher.submit(["grenade"]), batcher.submit(["grenade", "cordoue"])]
+    first, second = (future.result(timeout=5) for future in futures)
+    assert embed.calls == [["grenade", "cordoue"]]
+    assert first.tolist() == [[7.0, 1.0]]
+    assert second.tolist() == [[7.0, 1.0], [7.0, 1.0]]
+    assert batcher.stats()['deduplicated'] == 1
+
+
+def test_embedding_error_fails_every_request_of_the_batch():
+    batcher = make_batcher("erreur", FakeEmbed(error=RuntimeError("API indisponible")))
+    futures = [batcher.submit(["a"]), batcher.submit(["b"])]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    assert batcher.stats()['errors'] == 1
+
+
+def test_invalid_vector_fails_only_its_request():
+    batcher = make_batcher("invalide", FakeEmbed())
+    valid, invalid = batcher.submit(["a"]), batcher.submit(["nul"])
+    assert valid.result(timeout=5).tolist() == [[1.0, 1.0]]
+    with pytest.raises(EmbeddingValidationError):
+        invalid.result(timeout=5)
+
+
+def test_empty_request_does_not_call_the_model():
+    embed = FakeEmbed()
+    batcher = make_batcher("vide", embed)
+    assert batcher.submit([]).result(timeout=5).shape[0] == 0
+    assert embed.calls == []
+
+
+def test_parallel_workers():
+    embed = FakeEmbed()
+    batcher = make_batcher("workers", embed, max_batch=1, workers=2)
+    futures = [batcher.submit([text]) for text in ("a", "bb", "ccc")]
+    assert [f.result(timeout=5).tolist() for f in futures] == [[[1.0, 1.0]], [[2.0, 1.0]], [[3.0, 1.0]]]
+    assert batcher.stats()['batches'] == 3
+
+
+def test_stats_registry_and_reset():
+    batcher = make_batcher("stats", FakeEmbed())
+    batcher.submit(["a"]).result(timeout=5)
+    assert embedding_batch_stats()["test-stats"]['requests'] == 1
+    batcher.reset()
+    stats = batcher.stats()
+    assert stats['requests'] == 0
+    assert stats['wait_avg_ms'] is None
@@ -0,0 +1,77 @@
+"""Tests du tokenizer markdown de PDFConverter (sans rendu ReportLab)"""
+import pytest
+
+pytest.importorskip("reportlab")
+
+from pdf_converter import PDFCache, PDFConverter
+
+
+@pytest.fixture(scope="module")
+def converter():
+    return PDFConverter(cache=PDFCache())
+
+
+def test_headings_by_level(converter):
+    tokens = converter.tokenize_markdown("# Titre\n## Acte 1\n### Scène")
+    assert tokens == [
+        ('title', 'Titre', None),
+        ('heading', 'Acte 1', None),
+        ('subheading', 'Scène', None),
+    ]
+
+
+def test_consecutive_lines_merge_into_one_paragraph(converter):
+    tokens = converter.tokenize_markdown("première ligne\nseconde ligne")
+    assert tokens == [('para', 'première ligne seconde ligne', None)]
+
+
+def test_blank_lines_give_a_single_space(converter):
+    tokens = converter.tokenize_markdown("un\n\n\n\ndeux")
+    assert tokens == [('para', 'un', None), ('space', None, None), ('para', 'deux', None)]
+
+
+def test_no_space_after_title(converter):
+    tokens = converter.tokenize_markdown("# Titre\n\ntexte")
+    assert tokens == [('title', 'Titre', None), ('para', 'texte', None)]
+
+
+def test_lists(converter):
+    tokens = converter.tokenize_markdown("- premier\n* second\n3. troisième\n4) quatrième")
+    assert tokens == [
+        ('bullet', 'premier', None),
+        ('bullet', 'second', None),
+        ('number', 'troisième', '3'),
+        ('number', 'quatrième', '4'),
+    ]
+
+
+def test_list_item_continuation(converter):
+    tokens = converter.tokenize_markdown("- début\nsuite de l'élément")
+    assert tokens == [('bullet', "début suite de l'élément", None)]
+
+
+def test_quote_lines_merge(converter):
+    tokens = converter.tokenize_markdown("> première\n> seconde\n>\ntexte")
+    assert tokens == [('quote', 'première seconde texte', None)]
+
+
+def test_horizontal_rule(converter):
+    for rule in ("---", "* * *", "___"):
+        assert converter.tokenize_markdown(rule) == [('hr', None, None)]
+
+
+def test_inline_formatting(converter):
+    tokens = converter.tokenize_markdown("**gras** et *italique* et `code` et __aussi__")
+    assert tokens == [('para', '<b>gras</b> et <i>italique</i> et <font name="Courier">code</font> et <b>aussi</b>', None)]
+
+
+def test_inline_markup_is_escaped(converter):
+    assert converter.tokenize_markdown("a < b & c") == [('para', 'a &lt; b &amp; c', None)]
+
+
+def test_underscores_inside_words_are_kept(converter):
+    assert converter.tokenize_markdown("snake_case_name") == [('para', 'snake_case_name', None)]
+
+
+def test_emojis_are_replaced_or_removed(converter):
+    assert converter.tokenize_markdown("🏰 Alhambra 🙂") == [('para', '[PALAIS] Alhambra', None)]
@@ -0,0 +1,93 @@
+"""Tests du cache PDF (mémoire LRU et second niveau disque)"""
+from datetime import date
+
+import pytest
+
+pytest.importorskip("reportlab")
+
+from pdf_converter import PDFCache
+
+
+def test_pdf_key_depends_on_date_title_and_content():
+    day = date(2026, 1, 15)
+    key = PDFCache.pdf_key("contenu", "Titre", day)
+    assert key == PDFCache.pdf_key("contenu", "Titre", day)
+    assert key != PDFCache.pdf_key("contenu", "Titre", date(2026, 1, 16))
+    assert key != PDFCache.pdf_key("contenu", "Autre titre", day)
+    assert key != PDFCache.pdf_key("autre contenu", "Titre", day)
+
+
+def test_content_key_ignores_title():
+    assert PDFCache.content_key("contenu") == PDFCache.content_key("contenu")
+    assert PDFCache.content_key("contenu") != PDFCache.content_key("contenu modifie")
+
+
+def test_memory_hit_and_miss():
+    cache = PDFCache()
+    assert cache.get_pdf("a") is None
+    cache.put_pdf("a", b"%PDF-a")
+    assert cache.get_pdf("a") == b"%PDF-a"
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+
+def test_lru_eviction_by_total_size():
+    cache = PDFCache(max_bytes=10)
+    cache.put_pdf("a", b"12345")
+    cache.put_pdf("b", b"12345")
+    cache.get_pdf("a")  # "a" devient le plus récent
+    cache.put_pdf("c", b"12345")
+    assert cache.get_pdf("b") is None
+    assert cache.get_pdf("a") == b"12345"
+    assert cache.get_pdf("c") == b"12345"
+    assert cache.stats()['evictions'] == 1
+
+
+def test_pdf_larger_than_cache_is_not_stored():
+    cache = PDFCache(max_bytes=4)
+    cache.put_pdf("a", b"12345")
+    assert cache.get_pdf("a") is None
+    assert cache.stats()['pdf_bytes'] == 0
+
+
+def test_disk_second_level(tmp_path):
+    cache = PDFCache(cache_dir=str(tmp_path))
+    cache.put_pdf("a", b"%PDF-a")
+    cache.clear()
+    assert cache.get_pdf("a", disk=False) is None
+    assert cache.get_pdf("a") == b"%PDF-a"
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_put_file_copies_to_disk_and_caps_memory(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache = PDFCache(cache_dir=str(cache_dir), max_file_memory_bytes=4)
+    rendered = tmp_path / "rendu.pdf"
+    rendered.write_bytes(b"%PDF-gros")
+
+    cache.put_file("a", str(rendered))
+    assert cache.get_pdf("a", disk=False) is None
+    path = cache.get_path("a")
+    assert path is not None
+    with open(path, 'rb') as f:
+        assert f.read() == b"%PDF-gros"
+
+
+def test_put_file_keeps_small_pdf_in_memory(tmp_path):
+    cache = PDFCache()
+    rendered = tmp_path / "rendu.pdf"
+    rendered.write_bytes(b"%PDF")
+    cache.put_file("a", str(rendered))
+    assert cache.get_pdf("a", disk=False) == b"%PDF"
+
+
+def test_elements_are_copied():
+    cache = PDFCache(max_elements=1)
+    tokens = [('para', 'texte', None)]
+    cache.put_elements("a", tokens)
+    cached = cache.get_elements("a")
+    cached.append(('space', None, None))
+    assert cache.get_elements("a") == tokens
+    cache.put_elements("b", tokens)
+    assert cache.get_elements("a") is None
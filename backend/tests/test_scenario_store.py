@@ -0,0 +1,67 @@
+"""Tests du stockage des scénarios : versions, historique et conflits"""
+import pytest
+
+from scenario_store import ScenarioStore, VersionConflict
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ScenarioStore(directory=str(tmp_path), max_versions=2)
+
+
+def test_create_and_get(store):
+    scenario = store.create("Grenade", "# Grenade", {'mode': 'agent'})
+    loaded = store.get(scenario['scenario_id'])
+    assert loaded['content'] == "# Grenade"
+    assert loaded['version'] == 1
+    assert loaded['history'] == []
+
+
+def test_unknown_or_invalid_ids(store):
+    assert store.get("0" * 32) is None
+    assert store.get("../secret") is None
+    assert store.update_content("0" * 32, "x") is None
+
+
+def test_update_keeps_previous_version(store):
+    scenario = store.create("Grenade", "v1")
+    updated = store.update_content(scenario['scenario_id'], "v2", change={'section': 'Acte 1'})
+    assert updated['version'] == 2
+    assert updated['content'] == "v2"
+    assert updated['history'][-1]['content'] == "v1"
+    assert updated['history'][-1]['change'] == {'section': 'Acte 1'}
+
+
+def test_history_is_trimmed(store):
+    scenario_id = store.create("Grenade", "v1")['scenario_id']
+    for i in range(2, 6):
+        store.update_content(scenario_id, f"v{i}")
+    history = store.get(scenario_id)['history']
+    assert [entry['content'] for entry in history] == ["v3", "v4"]
+
+
+def test_max_versions_zero_keeps_one_version(tmp_path):
+    store = ScenarioStore(directory=str(tmp_path), max_versions=0)
+    scenario_id = store.create("Grenade", "v1")['scenario_id']
+    for i in range(2, 5):
+        store.update_content(scenario_id, f"v{i}")
+    assert [entry['content'] for entry in store.get(scenario_id)['history']] == ["v3"]
+
+
+def test_expected_version_conflict(store):
+    scenario_id = store.create("Grenade", "v1")['scenario_id']
+    store.update_content(scenario_id, "v2", expected_version=1)
+    with pytest.raises(VersionConflict) as conflict:
+        store.update_content(scenario_id, "v2 concurrent", expected_version=1)
+    assert (conflict.value.expected, conflict.value.current) == (1, 2)
+    # La modification concurrente n'a rien écrasé
+    assert store.get(scenario_id)['content'] == "v2"
+
+
+def test_list_most_recent_first(store):
+    first = store.create("Premier", "a")
+    second = store.create("Second", "b")
+    store.update_content(first['scenario_id'], "a2")
+    summaries = store.list()
+    assert [s['scenario_id'] for s in summaries] == [first['scenario_id'], second['scenario_id']]
+    assert 'content' not in summaries[0]
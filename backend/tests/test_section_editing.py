@@ -0,0 +1,81 @@
+"""Tests du découpage en sections et de la réinsertion d'une section réécrite"""
+import pytest
+
+section_editing = pytest.importorskip("section_editing")
+
+from section_editing import (
+    NEIGHBOUR_CHARS, SectionNotFound, find_section, neighbour_text, normalize_heading,
+    prepare_section_edit, split_sections
+)
+
+SCENARIO = """# La chute de Grenade
+
+Introduction.
+
+## Acte 1 : Le siège
+
+Le camp de Santa Fe.
+
+### Scène 1
+
+Les remparts.
+
+## Acte 2 : La reddition
+
+Les clefs de l'Alhambra.
+
+## Acte 20 : Épilogue
+
+Le soupir du Maure.
+"""
+
+
+def test_normalize_heading():
+    assert normalize_heading("## **Épilogue**  final ") == "epilogue final"
+
+
+def test_split_sections_bounds():
+    sections = split_sections(SCENARIO)
+    assert [s['heading'] for s in sections] == [
+        "# La chute de Grenade", "## Acte 1 : Le siège", "### Scène 1",
+        "## Acte 2 : La reddition", "## Acte 20 : Épilogue",
+    ]
+    act1 = sections[1]
+    # Une section s'arrête au titre de niveau égal ou supérieur suivant, sous-sections comprises
+    assert SCENARIO[act1['start']:act1['end']].rstrip().endswith("Les remparts.")
+    assert sections[0]['end'] == len(SCENARIO)
+
+
+def test_find_section_prefix_does_not_match_longer_number():
+    sections = split_sections(SCENARIO)
+    assert find_section(sections, "Acte 2") == 3
+    assert find_section(sections, "acte 20 : epilogue") == 4
+    assert find_section(sections, "### Scène 1") == 2
+    with pytest.raises(SectionNotFound):
+        find_section(sections, "Acte 3")
+    with pytest.raises(SectionNotFound):
+        find_section(sections, "### Acte 2")
+
+
+def test_neighbours_have_the_same_level():
+    sections = split_sections(SCENARIO)
+    assert neighbour_text(SCENARIO, sections, 3, -1).startswith("## Acte 1")
+    assert neighbour_text(SCENARIO, sections, 3, 1).startswith("## Acte 20")
+    assert neighbour_text(SCENARIO, sections, 4, 1) == ''
+    # Pas de voisine de même niveau au-delà de la section parente
+    assert neighbour_text(SCENARIO, sections, 2, 1) == ''
+
+
+def test_neighbour_is_truncated_on_the_contact_side():
+    content = "## A\n\n" + "a" * (NEIGHBOUR_CHARS + 100) + "\n\n## B\n\nb\n"
+    sections = split_sections(content)
+    previous = neighbour_text(content, sections, 1, -1)
+    assert len(previous) == NEIGHBOUR_CHARS
+    assert previous.endswith("a")
+
+
+def test_prepare_section_edit():
+    edit = prepare_section_edit(SCENARIO, "Acte 2", "La chute de Grenade", "plus de dialogues")
+    assert edit['heading'] == "## Acte 2 : La reddition"
+    assert edit['current'] == "Les clefs de l'Alhambra."
+    assert edit['query'] == "La chute de Grenade acte 2 : la reddition plus de dialogues"
@@ -0,0 +1,100 @@
+"""Tests du pré-filtre MinHash et de l'agrégation par scénario (sans Milvus ni embeddings)"""
+import pytest
+
+similarity_checker = pytest.importorskip("similarity_checker")
+
+from similarity_checker import (
+    MINHASH_SIZE, SimilarityChecker, estimate_jaccard, minhash_signature, scenario_key
+)
+
+TEXT = ("Au printemps 1492 le dernier émir de Grenade remet les clefs de l'Alhambra "
+        "aux souverains catholiques tandis que les habitants de l'Albaicin observent "
+        "le cortège depuis les terrasses de leurs maisons blanches")
+
+
+def test_signature_is_deterministic_and_bounded():
+    signature = minhash_signature(TEXT)
+    assert signature == minhash_signature(TEXT)
+    assert signature == sorted(signature)
+    assert 0 < len(signature) <= MINHASH_SIZE
+
+
+def test_signature_ignores_case_and_punctuation():
+    assert minhash_signature(TEXT) == minhash_signature(TEXT.upper().replace(' ', ' , '))
+
+
+def test_short_and_empty_texts():
+    assert len(minhash_signature("deux mots")) == 1
+    assert minhash_signature("") == []
+
+
+def test_jaccard_identical_disjoint_and_empty():
+    signature = minhash_signature(TEXT)
+    assert estimate_jaccard(signature, signature) == 1.0
+    other = minhash_signature("texte sans aucun rapport avec la prise de Grenade écrit pour ce test")
+    assert estimate_jaccard(signature, other) == 0.0
+    assert estimate_jaccard(signature, []) == 0.0
+
+
+def test_jaccard_near_duplicate_is_high():
+    near = TEXT.replace("maisons blanches", "maisons blanchies")
+    assert estimate_jaccard(minhash_signature(TEXT), minhash_signature(near)) >= 0.8
+
+
+def test_scenario_key_falls_back_to_title():
+    assert scenario_key({'scenario_id': '42', 'title': 'A'}) == 42
+    assert scenario_key({'title': 'A'}) == "title:A"
+
+
+def make_checker(signatures):
+    checker = SimilarityChecker(max_results=5)
+    checker._signatures = signatures
+    return checker
+
+
+def test_prefilter_returns_scenario_ids():
+    signature = minhash_signature(TEXT)
+    checker = make_checker({
+        7: ("Grenade", signature),
+        "title:Ancien": ("Ancien", signature),
+        8: ("Autre", minhash_signature("un scénario totalement différent sur Cordoue au dixième siècle")),
+    })
+    matches = checker.prefilter(signature)
+    assert {(m['id'], m['title']) for m in matches} == {(7, "Grenade"), (None, "Ancien")}
+    assert all(m['method'] == 'minhash' for m in matches)
+
+
+def test_register_scenario_adds_to_prefilter():
+    checker = make_checker({})
+    signature = minhash_signature(TEXT)
+    checker.register_scenario(9, "Grenade", signature)
+    assert checker.prefilter(signature)[0]['id'] == 9
+
+
+def hit(scenario_id, title, distance):
+    return {'entity': {'scenario_id': scenario_id, 'title': title}, 'distance': distance}
+
+
+def test_aggregate_groups_by_scenario_id_not_title():
+    checker = make_checker({})
+    results = [
+        [hit(1, "Même titre", 0.9), hit(2, "Même titre", 0.5), hit(1, "Même titre", 0.7)],
+        [hit(2, "Même titre", 0.6)],
+    ]
+    similarities = checker._aggregate(results, total_chunks=2)
+    by_id = {s['id']: s for s in similarities}
+    assert set(by_id) == {1, 2}
+    # Meilleur hit par chunk, moyenne sur tous les chunks candidats
+    assert by_id[1]['score'] == pytest.approx(0.45)
+    assert by_id[1]['matched_chunks'] == 1
+    assert by_id[2]['score'] == pytest.approx(0.55)
+    assert by_id[2]['coverage'] == 1.0
+    assert similarities[0]['id'] == 2
+
+
+def test_verdict_thresholds():
+    checker = SimilarityChecker(threshold=0.6, high_threshold=0.9)
+    verdict = checker._verdict([{'id': 1, 'title': "A", 'score': 0.7}])
+    assert verdict['has_duplicates'] and not verdict['can_auto_embed']
+    assert verdict['high_similarities'] == []
+    assert not checker._verdict([])['has_duplicates']
@@ -0,0 +1,137 @@
+"""Tests de la coalescence des requêtes identiques (SingleFlight)"""
+import asyncio
+
+import pytest
+
+single_flight = pytest.importorskip("single_flight")
+
+from generation_control import ClientDisconnected, GenerationDeadlineExceeded
+from single_flight import SingleFlight, flight_key, normalize_prompt
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  Raconte   la Prise\nde GRENADE ") == "raconte la prise de grenade"
+    # NFC : forme décomposée et composée équivalentes
+    assert normalize_prompt("épopée") == normalize_prompt("épopée")
+
+
+def test_flight_key_depends_on_prompt_and_options():
+    assert flight_key("Grenade", mode="agent") == flight_key(" grenade ", mode="agent")
+    assert flight_key("Grenade", mode="agent") != flight_key("Grenade", mode="sections")
+    assert flight_key("Grenade", mode="agent") != flight_key("Cordoue", mode="agent")
+
+
+class Generation:
+    """Génération factice : compte les lancements et rend la main sur release"""
+
+    def __init__(self, result="scenario"):
+        self.result = result
+        self.calls = 0
+        self.controls = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, control):
+        self.calls += 1
+        self.controls.append(control)
+        await self.release.wait()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_identical_requests_share_one_generation():
+    async def scenario():
+        flights = SingleFlight()
+        generation = Generation()
+        first = asyncio.ensure_future(flights.join("k", generation))
+        second = asyncio.ensure_future(flights.join("k", generation))
+        await asyncio.sleep(0)
+        assert flights.in_flight() == 1
+        generation.release.set()
+        results = await asyncio.gather(first, second)
+        return flights, generation, results
+
+    flights, generation, results = asyncio.run(scenario())
+    assert generation.calls == 1
+    assert results == [("scenario", False), ("scenario", True)]
+    assert flights.stats == {'started': 1, 'coalesced': 1}
+    assert flights.in_flight() == 0
+
+
+def test_finished_flight_is_not_reused():
+    async def scenario():
+        flights = SingleFlight()
+        generation = Generation()
+        generation.release.set()
+        await flights.join("k", generation)
+        await flights.join("k", generation)
+        return generation
+
+    assert asyncio.run(scenario()).calls == 2
+
+
+def test_errors_reach_every_waiter():
+    async def scenario():
+        flights = SingleFlight()
+        generation = Generation(result=ValueError("echec"))
+        waiters = [asyncio.ensure_future(flights.join("k", generation)) for _ in range(2)]
+        await asyncio.sleep(0)
+        generation.release.set()
+        return await asyncio.gather(*waiters, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_each_waiter_keeps_its_own_deadline():
+    async def scenario():
+        flights = SingleFlight()
+        generation = Generation()
+        short = asyncio.ensure_future(flights.join("k", generation, timeout=0.05))
+        await asyncio.sleep(0)
+        long = asyncio.ensure_future(flights.join("k", generation, timeout=30))
+        await asyncio.sleep(0)
+        control = generation.controls[0]
+        # La génération partagée suit l'échéance la plus lointaine
+        assert control.remaining() > 1
+        with pytest.raises(GenerationDeadlineExceeded):
+            await short
+        # Le départ du premier appelant n'annule pas la génération
+        assert not control.cancel_event.is_set()
+        generation.release.set()
+        return await long
+
+    assert asyncio.run(scenario()) == ("scenario", True)
+
+
+def test_waiter_without_deadline_lifts_the_flight_deadline():
+    async def scenario():
+        flights = SingleFlight()
+        generation = Generation()
+        first = asyncio.ensure_future(flights.join("k", generation, timeout=30))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flights.join("k", generation))
+        await asyncio.sleep(0)
+        deadline = generation.controls[0].deadline
+        generation.release.set()
+        await asyncio.gather(first, second)
+        return deadline
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_last_waiter_leaving_cancels_the_generation():
+    async def scenario():
+        flights = SingleFlight()
+        generation = Generation()
+
+        async def disconnected():
+            return True
+
+        with pytest.raises(ClientDisconnected):
+            await flights.join("k", generation, is_disconnected=disconnected)
+        return flights, generation
+
+    flights, generation = asyncio.run(scenario())
+    assert generation.controls[0].cancel_event.is_set()
+    assert flights.in_flight() == 0
@@ -0,0 +1,85 @@
+"""Thèmes (époques et lieux) de la base de connaissances : clé de partition et filtres
+
+À l'ingestion, chaque chunk reçoit un thème (mots-clés du chunk, sinon thème dominant de
+son document). Le champ theme est la clé de partition des collections de connaissances :
+un filtre « theme in [...] » ne parcourt que les partitions concernées au lieu de tout
+le corpus. À la recherche, les thèmes viennent d'un préfixe explicite de l'agent
+(« [andalus] requête ») ou des mots-clés de la requête.
+"""
+import re
+import unicodedata
+from collections import Counter
+from typing import Iterable, List, Tuple
+
+# Thème -> mots-clés (sans accents, en minuscules)
+THEMES = {
+    'abbassides': ('abbasside', 'abbassides', 'bagdad', 'baghdad', 'haroun al-rachid', 'harun al-rashid',
+                   'maison de la sagesse', 'bayt al-hikma', 'al-mamoun', 'samarra'),
+    'andalus': ('al-andalus', 'andalus', 'andalousie', 'cordoue', 'grenade', 'alhambra', 'seville',
+                'tolede', 'medina azahara', 'nasride', 'nasrides'),
+    'route_de_la_soie': ('route de la soie', 'routes de la soie', 'samarcande', 'boukhara', 'caravanserail',
+                         'khwarezm', 'merv', 'kachgar'),
+    'omeyyades': ('omeyyade', 'omeyyades', 'damas', 'dome du rocher'),
+    'fatimides': ('fatimide', 'fatimides', 'le caire', 'al-azhar'),
+    'maghreb': ('maghreb', 'fes', 'marrakech', 'kairouan', 'almoravide', 'almoravides', 'almohade', 'almohades'),
+    'ottomans': ('ottoman', 'ottomans', 'ottomane', 'istanbul', 'constantinople', 'topkapi'),
+}
+# Thème des chunks sans mot-clé reconnu
+DEFAULT_THEME = 'general'
+THEME_NAMES = tuple(THEMES) + (DEFAULT_THEME,)
+
+SCOPE_PREFIX_PATTERN = re.compile(r'^\s*\[([^\]]*)\]\s*')
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+_KEYWORD_PATTERNS = {
+    theme: re.compile(r'\b(?:' + '|'.join(re.escape(_normalize(k)) for k in keywords) + r')\b')
+    for theme, keywords in THEMES.items()
+}
+
+
+def theme_scores(text: str) -> Counter:
+    """Nombre d'occurrences des mots-clés de chaque thème"""
+    text = _normalize(text)
+    scores = Counter()
+    for theme, pattern in _KEYWORD_PATTERNS.items():
+        hits = len(pattern.findall(text))
+        if hits:
+            scores[theme] = hits
+    return scores
+
+
+def dominant_theme(text: str, default: str = DEFAULT_THEME) -> str:
+    scores = theme_scores(text)
+    return scores.most_common(1)[0][0] if scores else default
+
+
+def chunk_themes(chunks: Iterable[str], content: str) -> List[str]:
+    """Thème de chaque chunk : ses propres mots-clés, sinon le thème dominant du document"""
+    document_theme = dominant_theme(content)
+    return [dominant_theme(chunk, default=document_theme) for chunk in chunks]
+
+
+def parse_scope(query: str, detect: bool = True) -> Tuple[List[str], str]:
+    """Thèmes visés et requête nettoyée
+
+    Préfixe explicite « [andalus, abbassides] requête » (noms de thèmes inconnus ignorés),
+    sinon, si detect, thèmes détectés dans la requête.
+    """
+    match = SCOPE_PREFIX_PATTERN.match(query)
+    if match:
+        names = [_normalize(name).strip().replace(' ', '_') for name in match.group(1).split(',')]
+        return sorted({name for name in names if name in THEME_NAMES}), query[match.end():]
+    return (sorted(theme_scores(query)) if detect else []), query
+
+
+def theme_filter(themes: Iterable[str]) -> str:
+    """Expression Milvus sur la clé de partition (thèmes connus uniquement)"""
+    themes = sorted(set(themes) & set(THEME_NAMES))
+    if not themes:
+        return ''
+    return 'theme in [' + ', '.join(f'"{theme}"' for theme in themes) + ']'
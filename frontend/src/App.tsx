@@ -75,6 +75,99 @@ function App() {
 
   // Constante API
   const API_BASE_URL = 'http://localhost:8001';
+  // Streaming SSE (/chat/stream) en option : chaîne RAG directe, sans l'agent ni le mode sections
+  const USE_STREAMING = import.meta.env.VITE_SIFHR_STREAMING === 'true';
+
+  const fetchChat = async (message: string) => {
+    const response = await fetch(`${API_BASE_URL}/chat`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({
+        message,
+        session_id: currentSessionId,
+      }),
+    });
+
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    return response.json();
+  };
+
+  const fetchChatStream = async (message: string, botMessageId: string) => {
+    // Le texte s'affiche au fil des tokens du LLM
+    const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Accept': 'text/event-stream',
+      },
+      body: JSON.stringify({
+        message,
+        session_id: currentSessionId,
+      }),
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    setMessages(prev => [...prev, {
+      id: botMessageId,
+      text: '',
+      isUser: false,
+      timestamp: new Date(),
+    }]);
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let streamedText = '';
+    let data: any = null;
+
+    while (data === null) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Un événement SSE se termine par une ligne vide
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        let eventType = 'message';
+        let payload = '';
+        for (const line of rawEvent.split('\n')) {
+          if (line.startsWith('event:')) eventType = line.slice(6).trim();
+          else if (line.startsWith('data:')) payload += line.slice(5).trim();
+        }
+        if (!payload) continue;
+        const eventData = JSON.parse(payload);
+
+        if (eventType === 'token') {
+          streamedText += eventData.delta;
+          const text = streamedText;
+          setMessages(prev => prev.map(msg => msg.id === botMessageId ? { ...msg, text } : msg));
+        } else if (eventType === 'retrieval') {
+          setMessages(prev => prev.map(msg => msg.id === botMessageId ? { ...msg, sources: eventData.sources } : msg));
+        } else if (eventType === 'error') {
+          throw new Error(eventData.error);
+        } else if (eventType === 'final') {
+          data = eventData;
+        }
+      }
+    }
+
+    if (data === null) {
+      throw new Error('Flux interrompu avant la fin de la generation');
+    }
+    return data;
+  };
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -98,33 +191,23 @@ function App() {
     setInputText('');
     setIsLoading(true);
 
-    try {
-      const response = await fetch(`${API_BASE_URL}/chat`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          message: inputText,
-          session_id: currentSessionId,
-        }),
-      });
+    const botMessageId = (Date.now() + 1).toString();
 
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
-      }
-
-      const data = await response.json();
+    try {
+      const data = USE_STREAMING
+        ? await fetchChatStream(inputText, botMessageId)
+        : await fetchChat(inputText);
 
       const botMessage: Message = {
-        id: (Date.now() + 1).toString(),
+        id: botMessageId,
         text: data.response,
         isUser: false,
         timestamp: new Date(),
         sources: data.sources || [],
       };
 
-      setMessages(prev => [...prev, botMessage]);
+      // Remplacer le message streamé, ou ajouter la réponse de /chat
+      setMessages(prev => [...prev.filter(msg => msg.id !== botMessageId), botMessage]);
       
       // Auto-sauvegarder en PDF si c'est un scénario de chasse au trésor
       const isScenario = botMessage.text.toLowerCase().includes('scénario') || 
@@ -166,12 +249,13 @@ function App() {
     } catch (error) {
       console.error('Erreur:', error);
       const errorMessage: Message = {
-        id: (Date.now() + 1).toString(),
+        id: botMessageId,
         text: `Erreur de connexion: ${error instanceof Error ? error.message : 'Erreur inconnue'}`,
         isUser: false,
         timestamp: new Date(),
       };
-      setMessages(prev => [...prev, errorMessage]);
+      // Remplacer le message partiellement streamé, s'il existe
+      setMessages(prev => [...prev.filter(msg => msg.id !== botMessageId), errorMessage]);
     } finally {
       setIsLoading(false);
     }
@@ -924,8 +1008,8 @@ function App() {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
                         body: JSON.stringify({
-                          content: currentScenarioData.content,
-                          title: currentScenarioData.title,
+                          scenario_content: currentScenarioData.content,
+                          scenario_title: currentScenarioData.title,
                           force_embed: true
                         })
                       });
@@ -1,5 +1,5 @@
 import React, { useState, useRef, useEffect } from 'react';
-import { Send, MessageSquare, History, Trash2, Settings, BookOpen, Download, FileText, Eye } from 'lucide-react';
+import { Send, Square, MessageSquare, History, Trash2, Settings, BookOpen, Download, FileText, Eye } from 'lucide-react';
 import jsPDF from 'jspdf';
 import './App.css';
 
@@ -36,13 +36,31 @@ interface WebSocketMessage {
   type: string;
   message?: string;
   session_id?: string;
+  request_id?: string;
+  shared_request_id?: string;
   response?: string;
   sources?: any[];
   length?: number;
   error?: string;
   status?: string;
+  seq?: number;
+  delta?: string;
+  progress?: number;
+  is_final?: boolean;
+  checksum?: string;
+  frames?: number;
+  full_response?: boolean;
+  last_seq?: number;
+  text?: string;
+  resume_failed?: boolean;
 }
 
+// Checksum SHA-256 (hex) du texte reconstitué à partir des deltas
+const sha256Hex = async (text: string): Promise<string> => {
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+};
+
 function App() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [inputText, setInputText] = useState('');
@@ -60,10 +78,15 @@ function App() {
   const [streamingMessage, setStreamingMessage] = useState('');
   const [isStreaming, setIsStreaming] = useState(false);
   const wsRef = useRef<WebSocket | null>(null);
+  // Texte reconstitué à partir des deltas et prochain numéro de séquence attendu
+  const streamBufferRef = useRef('');
+  // Génération en cours : permet de reprendre le flux après une reconnexion ou de l'annuler
+  const activeRequestRef = useRef<string | null>(null);
+  const lastSeqRef = useRef(-1);
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   // WebSocket URL
-  const WS_URL = 'ws://127.0.0.1:8002/ws';
+  const WS_URL = 'ws://127.0.0.1:8001/ws';
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -86,6 +109,15 @@ function App() {
         
         // Send ping to test connection
         sendWebSocketMessage({ type: 'ping' });
+
+        // Reprendre une génération interrompue par la déconnexion
+        if (activeRequestRef.current) {
+          sendWebSocketMessage({
+            type: 'resume',
+            request_id: activeRequestRef.current,
+            last_seq: lastSeqRef.current,
+          });
+        }
       };
 
       wsRef.current.onmessage = (event) => {
@@ -142,6 +174,20 @@ function App() {
   const handleWebSocketMessage = (data: WebSocketMessage) => {
     console.log('WebSocket message received:', data);
 
+    // Les frames d'une génération sont numérotés en continu (statut, deltas, réponse finale)
+    if (data.seq !== undefined && data.request_id) {
+      if (data.request_id !== activeRequestRef.current) {
+        return; // Frame d'une génération abandonnée
+      }
+      if (data.seq <= lastSeqRef.current) {
+        return; // Frame déjà reçu (rejoué lors d'une reprise)
+      }
+      if (data.type !== 'resync' && data.seq !== lastSeqRef.current + 1) {
+        console.warn(`Frame hors sequence: recu ${data.seq}, attendu ${lastSeqRef.current + 1}`);
+      }
+      lastSeqRef.current = data.seq;
+    }
+
     switch (data.type) {
       case 'pong':
         console.log('Pong received');
@@ -152,19 +198,44 @@ function App() {
         if (data.status === 'generating') {
           setIsStreaming(true);
           setStreamingMessage('');
+          streamBufferRef.current = '';
+        }
+        break;
+
+      case 'attached':
+        // Prompt identique déjà en cours : le serveur nous abonne à cette génération
+        if (data.request_id === activeRequestRef.current && data.shared_request_id) {
+          activeRequestRef.current = data.shared_request_id;
+          lastSeqRef.current = -1;
         }
         break;
 
+      case 'resync':
+        // Trop de frames manqués : le serveur renvoie tout le texte déjà généré
+        setIsStreaming(true);
+        streamBufferRef.current = data.text || '';
+        setStreamingMessage(streamBufferRef.current);
+        break;
+
       case 'streaming_response':
-        setStreamingMessage(data.chunk || '');
+        streamBufferRef.current += data.delta || '';
+        setStreamingMessage(streamBufferRef.current);
         setWsStatus(`Streaming... ${data.progress || 0}%`);
         break;
 
-      case 'chat_response':
-        if (data.response) {
+      case 'chat_response': {
+        const responseText = data.response ?? streamBufferRef.current;
+        if (data.checksum && !data.response) {
+          sha256Hex(responseText).then(checksum => {
+            if (checksum !== data.checksum) {
+              console.error('Checksum du scenario invalide : des frames ont ete perdues');
+            }
+          });
+        }
+        if (responseText) {
           const botMessage: Message = {
             id: (Date.now() + 1).toString(),
-            text: data.response,
+            text: responseText,
             isUser: false,
             timestamp: new Date(),
             sources: data.sources || [],
@@ -202,16 +273,26 @@ function App() {
             const newSession: ChatSession = {
               id: data.session_id,
               name: inputText.substring(0, 30) + (inputText.length > 30 ? '...' : ''),
-              lastMessage: data.response.substring(0, 50) + '...',
+              lastMessage: responseText.substring(0, 50) + '...',
               timestamp: new Date(),
             };
             setSessions(prev => [newSession, ...prev]);
           }
         }
         
+        activeRequestRef.current = null;
         setIsLoading(false);
         setWsStatus('Connected');
         break;
+      }
+
+      case 'cancelled':
+        activeRequestRef.current = null;
+        setIsStreaming(false);
+        setStreamingMessage('');
+        setIsLoading(false);
+        setWsStatus('Generation annulee');
+        break;
 
       case 'error':
         const errorMessage: Message = {
@@ -221,6 +302,8 @@ function App() {
           timestamp: new Date(),
         };
         setMessages(prev => [...prev, errorMessage]);
+        activeRequestRef.current = null;
+        setIsStreaming(false);
         setIsLoading(false);
         setWsStatus('Error');
         break;
@@ -256,14 +339,26 @@ function App() {
     const messageToSend = inputText;
     setInputText('');
 
+    // Chaque génération a son request_id : reprise et annulation ciblées
+    const requestId = `req_${Date.now()}_${Math.random().toString(36).slice(2, 8)}`;
+    activeRequestRef.current = requestId;
+    lastSeqRef.current = -1;
+
     // Send via WebSocket
     sendWebSocketMessage({
       type: 'chat',
       message: messageToSend,
       session_id: currentSessionId || undefined,
+      request_id: requestId,
     });
   };
 
+  const cancelGeneration = () => {
+    if (activeRequestRef.current) {
+      sendWebSocketMessage({ type: 'cancel', request_id: activeRequestRef.current });
+    }
+  };
+
   const newChat = () => {
     setMessages([]);
     setCurrentSessionId(null);
@@ -709,13 +804,24 @@ function App() {
                   disabled={isLoading || !wsConnected}
                   rows={1}
                 />
-                <button 
-                  onClick={sendMessage} 
-                  disabled={isLoading || !inputText.trim() || !wsConnected}
-                  className="send-btn"
-                >
-                  <Send size={20} />
-                </button>
+                {isLoading ? (
+                  <button 
+                    onClick={cancelGeneration} 
+                    disabled={!wsConnected}
+                    className="send-btn"
+                    title="Arreter la generation"
+                  >
+                    <Square size={20} />
+                  </button>
+                ) : (
+                  <button 
+                    onClick={sendMessage} 
+                    disabled={!inputText.trim() || !wsConnected}
+                    className="send-btn"
+                  >
+                    <Send size={20} />
+                  </button>
+                )}
               </div>
             </div>
           </>